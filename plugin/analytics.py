@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, compress
+from typing import Iterable, List, Optional
+
+from payloads import JSON_SEPARATORS
+from router import target_key
+from storage import locked, write_atomic
+
+# ts, latency_ms, ttft_ms, ok, keyword code, provider:model code
+ROW = struct.Struct("<dIIBHB")
+COLUMN_TYPES = (
+    ("ts", "d"),
+    ("latency_ms", "I"),
+    ("ttft_ms", "I"),
+    ("ok", "B"),
+    ("keyword", "H"),
+    ("target", "B"),
+)
+# Row count and timestamp of the first row covered by a snapshot.
+SNAPSHOT_HEADER = struct.Struct("<Qd")
+SNAPSHOT_INTERVAL = 256
+CODE_KINDS = ("keyword", "target")
+# Values beyond the capacity of a code column share the last code.
+CODE_LIMITS = {"keyword": 0xFFFF, "target": 0xFF}
+OTHER = "(other)"
+# Latencies are whole milliseconds; this marks a request without one.
+MISSING = 0xFFFFFFFF
+SECONDS_PER_DAY = 86400
+INVERT = bytes([1]) + bytes(255)
+
+
+class Columns:
+    """
+    Request metrics as parallel arrays. Strings are interned: keywords,
+    provider:model targets are stored as indexes into the code tables.
+    """
+
+    def __init__(self, codes: dict):
+        self.codes = codes
+        for name, typecode in COLUMN_TYPES:
+            setattr(self, name, array(typecode))
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def extend_rows(self, rows: Iterable[tuple]) -> None:
+        for (name, _), values in zip(COLUMN_TYPES, zip(*rows)):
+            getattr(self, name).extend(values)
+
+    def name(self, kind: str, code: int) -> str:
+        names = self.codes.get(kind, [])
+        return names[code] if code < len(names) else "?"
+
+
+class ColumnStore:
+    """
+    Per-request metrics for the analytics view.
+
+    Each request appends one fixed-width ROW to a binary log with a single
+    O_APPEND write; strings are interned through a small JSON table of
+    codes. Readers load a columnar snapshot (<name>.columns, one array per
+    column) with array.frombytes and only unpack the rows logged after it;
+    the snapshot is refreshed once SNAPSHOT_INTERVAL rows have accumulated.
+    Beyond max_rows the log is compacted to its newest half.
+    """
+
+    def __init__(self, path: str, max_rows: int = 200000):
+        self.path = path
+        base = os.path.splitext(path)[0]
+        self.codes_path = f"{base}.codes.json"
+        self.snapshot_path = f"{base}.columns"
+        self.max_rows = max_rows
+
+    def record(
+        self,
+        ts: float,
+        latency_ms: Optional[float],
+        ttft_ms: Optional[float],
+        ok: bool,
+        keyword: str,
+        provider: str,
+        model: str,
+    ) -> None:
+        try:
+            with locked(self.path):
+                codes = self._intern(
+                    [{"keyword": keyword, "target": target_key(provider, model)}]
+                )[0]
+                self._append(self._pack(ts, latency_ms, ttft_ms, ok, codes))
+        except OSError as error:
+            logging.error(f"Failed to write request analytics: {error}")
+
+    def backfill(self, records: Iterable[dict]) -> None:
+        """
+        Seed an empty store from request stats records, oldest first.
+        """
+        records = list(records)
+        try:
+            with locked(self.path):
+                if os.path.exists(self.path):
+                    return
+                all_codes = self._intern(
+                    [
+                        {
+                            "keyword": record.get("keyword") or "",
+                            "target": target_key(
+                                record.get("provider") or "", record.get("model") or ""
+                            ),
+                        }
+                        for record in records
+                    ]
+                )
+                rows = [
+                    self._pack(
+                        record.get("ts", 0.0),
+                        record.get("latency_ms"),
+                        record.get("ttft_ms"),
+                        record.get("ok") is not False,
+                        codes,
+                    )
+                    for record, codes in zip(records, all_codes)
+                ]
+                write_atomic(self.path, b"".join(rows))
+        except OSError as error:
+            logging.error(f"Failed to write request analytics: {error}")
+
+    def load(self) -> Columns:
+        columns = Columns(self._read_codes())
+        try:
+            with open(self.path, "rb") as file:
+                first_row = file.read(ROW.size)
+                covered = self._read_snapshot(columns, first_row)
+                file.seek(covered * ROW.size)
+                tail = file.read()
+        except FileNotFoundError:
+            return columns
+        tail = tail[: len(tail) - len(tail) % ROW.size]
+        if tail:
+            columns.extend_rows(ROW.iter_unpack(tail))
+        if len(tail) >= SNAPSHOT_INTERVAL * ROW.size:
+            self._write_snapshot(columns, first_row)
+        return columns
+
+    def _pack(
+        self,
+        ts: float,
+        latency_ms: Optional[float],
+        ttft_ms: Optional[float],
+        ok: bool,
+        codes: List[int],
+    ) -> bytes:
+        return ROW.pack(
+            ts,
+            MISSING if latency_ms is None else min(MISSING - 1, round(latency_ms)),
+            MISSING if ttft_ms is None else min(MISSING - 1, round(ttft_ms)),
+            1 if ok else 0,
+            *codes,
+        )
+
+    def _append(self, row: bytes) -> None:
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            os.write(fd, row)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.max_rows * ROW.size:
+            rows = size // ROW.size
+            with open(self.path, "rb") as file:
+                file.seek((rows - self.max_rows // 2) * ROW.size)
+                write_atomic(self.path, file.read(self.max_rows // 2 * ROW.size))
+
+    def _read_snapshot(self, columns: Columns, first_row: bytes) -> int:
+        """
+        Fill columns from the snapshot and return the number of log rows it
+        covers, or 0 if it is missing or belongs to an older log.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return 0
+        if len(data) < SNAPSHOT_HEADER.size or len(first_row) < ROW.size:
+            return 0
+        rows, first_ts = SNAPSHOT_HEADER.unpack_from(data)
+        if first_ts != ROW.unpack(first_row)[0]:
+            return 0
+        view = memoryview(data)[SNAPSHOT_HEADER.size :]
+        offset = 0
+        for name, typecode in COLUMN_TYPES:
+            column = getattr(columns, name)
+            size = rows * column.itemsize
+            if offset + size > len(view):
+                return 0
+            column.frombytes(view[offset : offset + size])
+            offset += size
+        return rows
+
+    def _write_snapshot(self, columns: Columns, first_row: bytes) -> None:
+        header = SNAPSHOT_HEADER.pack(len(columns), ROW.unpack(first_row)[0])
+        data = b"".join(getattr(columns, name).tobytes() for name, _ in COLUMN_TYPES)
+        try:
+            write_atomic(self.snapshot_path, header + data)
+        except OSError as error:
+            logging.error(f"Failed to write request analytics snapshot: {error}")
+
+    def _intern(self, values: List[dict]) -> List[List[int]]:
+        codes = self._read_codes()
+        indexes = {
+            kind: {name: code for code, name in enumerate(codes.setdefault(kind, []))}
+            for kind in CODE_KINDS
+        }
+        changed = False
+        result = []
+        for value in values:
+            row = []
+            for kind in CODE_KINDS:
+                known = indexes[kind]
+                name = value[kind]
+                if name not in known and len(codes[kind]) >= CODE_LIMITS[kind]:
+                    name = OTHER
+                if name not in known:
+                    known[name] = len(codes[kind])
+                    codes[kind].append(name)
+                    changed = True
+                row.append(known[name])
+            result.append(row)
+        if changed:
+            data = json.dumps(codes, ensure_ascii=False, separators=JSON_SEPARATORS)
+            write_atomic(self.codes_path, data.encode("utf-8"))
+        return result
+
+    def _read_codes(self) -> dict:
+        try:
+            with open(self.codes_path, "rb") as file:
+                codes = json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return codes if isinstance(codes, dict) else {}
+
+
+def latency_summary(histogram: dict) -> dict:
+    """
+    p50, p90 and p99 of a {latency_ms: count} histogram.
+    """
+    latencies = sorted(latency for latency in histogram if latency != MISSING)
+    if not latencies:
+        return dict.fromkeys(("p50", "p90", "p99"))
+    cumulative = list(accumulate(map(histogram.__getitem__, latencies)))
+    return {
+        name: latencies[bisect_right(cumulative, fraction * cumulative[-1])]
+        for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+    }
+
+
+def aggregate(columns: Columns, now: float, utc_offset: float, days: int = 7) -> dict:
+    """
+    Latency percentiles, error rates, answers per day, top keywords and a
+    per provider/model breakdown.
+
+    Every figure is computed with whole-column passes that run in C:
+    byte counts and bytes.translate masks over the one-byte ok and target
+    columns, compress and Counter, and bisect on the time-ordered ts
+    column. Percentiles come from per-target histograms of whole
+    milliseconds, so only the distinct latencies are sorted.
+    """
+    ok = columns.ok.tobytes()
+    failed = ok.translate(INVERT)
+    target = columns.target.tobytes()
+    total = len(columns)
+    answers = ok.count(1)
+    first_day = int((now + utc_offset) // SECONDS_PER_DAY) - days + 1
+    bounds = [
+        bisect_left(columns.ts, (first_day + offset) * SECONDS_PER_DAY - utc_offset)
+        for offset in range(days + 1)
+    ]
+    per_day = [
+        ((first_day + offset) * SECONDS_PER_DAY, ok.count(1, start, end))
+        for offset, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+    keywords = Counter(compress(columns.keyword, ok))
+    failures = Counter(compress(target, failed))
+    overall = Counter()
+    targets = []
+    for code, requests in Counter(target).items():
+        mask = target.translate(bytes(int(byte == code) for byte in range(256)))
+        histogram = Counter(compress(columns.latency_ms, mask))
+        overall.update(histogram)
+        provider, _, model = columns.name("target", code).partition(":")
+        targets.append(
+            {
+                "provider": provider,
+                "model": model,
+                "requests": requests,
+                "errors": failures[code],
+                "latency": latency_summary(histogram),
+            }
+        )
+    return {
+        "requests": total,
+        "errors": total - answers,
+        "latency": latency_summary(overall),
+        "per_day": per_day,
+        "top_keywords": [
+            (columns.name("keyword", code), count)
+            for code, count in keywords.most_common(5)
+        ],
+        "targets": sorted(targets, key=lambda target: -target["requests"]),
+    }
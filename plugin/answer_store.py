@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+
+ANSWER_ID_LENGTH = 32
+ANSWER_ID_PATTERN = re.compile(r"^[0-9a-f]{%d}$" % ANSWER_ID_LENGTH)
+BLOB_SUFFIX = ".json"
+
+
+class AnswerStore:
+    """
+    Content-addressed store for answers referenced from result actions.
+
+    Each prompt/answer pair is written once to <directory>/<id>.json, where
+    the id is derived from the record bytes, so result payloads only carry
+    the id. The directory is pruned to the max_entries most recently used
+    blobs.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 200):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def key(self, prompt: str, answer: str) -> str:
+        """
+        The id put() stores the pair under, without writing anything.
+        """
+        return self._encode(prompt, answer)[0]
+
+    def put(self, prompt: str, answer: str) -> str:
+        answer_id, data = self._encode(prompt, answer)
+        path = self._path(answer_id)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return answer_id
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError as error:
+            logging.error(f"Failed to store answer {answer_id}: {error}")
+            return answer_id
+        self._prune()
+        return answer_id
+
+    def get(self, answer_id: str) -> Optional[dict]:
+        if not answer_id or not ANSWER_ID_PATTERN.match(answer_id):
+            return None
+        try:
+            with open(self._path(answer_id), "rb") as file:
+                return json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError) as error:
+            logging.error(f"Failed to load answer {answer_id}: {error}")
+            return None
+
+    def _encode(self, prompt: str, answer: str) -> Tuple[str, bytes]:
+        record = {"prompt": prompt, "answer": answer}
+        data = json.dumps(
+            record, ensure_ascii=False, separators=JSON_SEPARATORS, sort_keys=True
+        ).encode("utf-8")
+        return hashlib.sha256(data).hexdigest()[:ANSWER_ID_LENGTH], data
+
+    def _path(self, answer_id: str) -> str:
+        return os.path.join(self.directory, f"{answer_id}{BLOB_SUFFIX}")
+
+    def _prune(self) -> None:
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(BLOB_SUFFIX)
+            ]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries :]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
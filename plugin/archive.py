@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import re
+import time
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+from payloads import JSON_SEPARATORS
+from storage import locked, write_atomic
+
+COMPRESSORS = {"gzip": (".gz", gzip), "lzma": (".xz", lzma)}
+DEFAULT_COMPRESSION = "gzip"
+MANIFEST_NAME = "manifest.json"
+OPEN_SUFFIX = ".open"
+UNSAFE_FILENAME_CHARS = re.compile(r"[^\w.-]")
+
+
+class Archive:
+    """
+    Closed log segments under archive/, compressed with gzip or lzma.
+
+    Lines handed to append() collect in an uncompressed open segment per
+    stream, which is closed once it reaches segment_bytes or spans
+    segment_seconds (0 disables either trigger); add_segment() closes a
+    ready-made segment directly.
+    manifest.json lists every segment with its stream, time range, entry
+    count and size, so readers skip segments outside a requested range
+    without opening them. After each close, segments older than
+    max_age_seconds are deleted, then the oldest ones until the archive
+    fits max_bytes (0 disables either budget).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compression: str = DEFAULT_COMPRESSION,
+        segment_bytes: int = 1024 * 1024,
+        segment_seconds: int = 7 * 24 * 3600,
+        max_bytes: int = 0,
+        max_age_seconds: int = 0,
+    ):
+        self.directory = directory
+        self.compression = (
+            compression if compression in COMPRESSORS else DEFAULT_COMPRESSION
+        )
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+    def append(
+        self,
+        stream: str,
+        lines: List[bytes],
+        start: float,
+        end: float,
+        refs: Iterable[str] = (),
+    ) -> None:
+        """
+        Add lines (oldest first) covering start..end to the open segment of
+        stream. refs are keys the lines depend on, see referenced().
+        """
+        if not lines:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with locked(self.manifest_path):
+            manifest = self._load()
+            current = manifest["open"].get(stream)
+            name = current["name"] if current else self._open_name(stream)
+            path = self._path(name)
+            with open(path, "ab") as file:
+                file.write(b"".join(line.rstrip(b"\n") + b"\n" for line in lines))
+            segment = manifest["open"].setdefault(
+                stream,
+                {
+                    "name": name,
+                    "stream": stream,
+                    "start": start,
+                    "end": end,
+                },
+            )
+            segment["start"] = min(segment["start"], start)
+            segment["end"] = max(segment["end"], end)
+            segment["entries"] = segment.get("entries", 0) + len(lines)
+            segment["refs"] = sorted(set(segment.get("refs", [])) | set(refs))
+            if self.segment_full(
+                os.path.getsize(path), segment["end"] - segment["start"]
+            ):
+                with open(path, "rb") as file:
+                    data = file.read()
+                self._close(manifest, stream, data, segment)
+                del manifest["open"][stream]
+                os.remove(path)
+            self._save(manifest)
+
+    def segment_full(self, size: int, span: float) -> bool:
+        return bool(
+            (self.segment_bytes and size >= self.segment_bytes)
+            or (self.segment_seconds and span >= self.segment_seconds)
+        )
+
+    def add_segment(
+        self, stream: str, data: bytes, start: float, end: float, entries: int
+    ) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with locked(self.manifest_path):
+            manifest = self._load()
+            segment = {"start": start, "end": end, "entries": entries}
+            self._close(manifest, stream, data, segment)
+            self._save(manifest)
+
+    def segments(
+        self,
+        stream: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> List[dict]:
+        """
+        Segments of stream overlapping since..until, newest first. The open
+        segment, if any, comes first.
+        """
+        manifest = self._load()
+        found = [
+            segment
+            for segment in manifest["segments"]
+            if segment["stream"] == stream
+            and (since is None or segment["end"] >= since)
+            and (until is None or segment["start"] <= until)
+        ]
+        found.sort(key=lambda segment: segment["end"], reverse=True)
+        current = manifest["open"].get(stream)
+        if current and (since is None or current["end"] >= since):
+            if until is None or current["start"] <= until:
+                found.insert(0, current)
+        return found
+
+    def iter_lines(self, segment: dict) -> Iterator[bytes]:
+        """
+        Yield the lines of a segment, oldest first, decompressing as it goes.
+        """
+        path = self._path(segment["name"])
+        compression = segment.get("compression")
+        opener = COMPRESSORS[compression][1].open if compression else open
+        try:
+            with opener(path, "rb") as file:
+                for line in file:
+                    if line.strip():
+                        yield line.rstrip(b"\r\n")
+        except (OSError, EOFError, lzma.LZMAError) as error:
+            logging.error(f"Failed to read archive segment {path}: {error}")
+
+    def read(self, segment: dict) -> bytes:
+        """
+        Return the whole decompressed content of a segment.
+        """
+        path = self._path(segment["name"])
+        compression = segment.get("compression")
+        opener = COMPRESSORS[compression][1].open if compression else open
+        try:
+            with opener(path, "rb") as file:
+                return file.read()
+        except (OSError, EOFError, lzma.LZMAError) as error:
+            logging.error(f"Failed to read archive segment {path}: {error}")
+            return b""
+
+    def streams(self) -> set:
+        manifest = self._load()
+        return {
+            segment["stream"]
+            for segment in manifest["segments"] + list(manifest["open"].values())
+        }
+
+    def referenced(self, stream: str) -> set:
+        manifest = self._load()
+        refs = set()
+        for segment in manifest["segments"] + list(manifest["open"].values()):
+            if segment["stream"] == stream:
+                refs.update(segment.get("refs", []))
+        return refs
+
+    def _close(self, manifest: dict, stream: str, data: bytes, segment: dict) -> None:
+        suffix, module = COMPRESSORS[self.compression]
+        stamp = datetime.fromtimestamp(segment["start"]).strftime("%Y%m%d-%H%M%S")
+        base = f"{self._safe(stream)}-{stamp}"
+        name = f"{base}{suffix}"
+        index = 1
+        while os.path.exists(self._path(name)):
+            index += 1
+            name = f"{base}-{index}{suffix}"
+        write_atomic(self._path(name), module.compress(data))
+        closed = {
+            "name": name,
+            "stream": stream,
+            "compression": self.compression,
+            "start": segment["start"],
+            "end": segment["end"],
+            "entries": segment.get("entries", 0),
+            "raw_bytes": len(data),
+            "bytes": os.path.getsize(self._path(name)),
+        }
+        if segment.get("refs"):
+            closed["refs"] = segment["refs"]
+        manifest["segments"].append(closed)
+        self._enforce_budgets(manifest)
+
+    def _enforce_budgets(self, manifest: dict) -> None:
+        segments = sorted(manifest["segments"], key=lambda segment: segment["end"])
+        if self.max_age_seconds > 0:
+            cutoff = time.time() - self.max_age_seconds
+            while segments and segments[0]["end"] < cutoff:
+                self._remove(segments.pop(0))
+        if self.max_bytes > 0:
+            total = sum(segment["bytes"] for segment in segments)
+            while segments and total > self.max_bytes:
+                expired = segments.pop(0)
+                total -= expired["bytes"]
+                self._remove(expired)
+        manifest["segments"] = segments
+
+    def _remove(self, segment: dict) -> None:
+        try:
+            os.remove(self._path(segment["name"]))
+        except FileNotFoundError:
+            pass
+
+    def _load(self) -> dict:
+        try:
+            with open(self.manifest_path, "rb") as file:
+                manifest = json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault("segments", [])
+        manifest.setdefault("open", {})
+        return manifest
+
+    def _save(self, manifest: dict) -> None:
+        data = json.dumps(manifest, ensure_ascii=False, separators=JSON_SEPARATORS)
+        write_atomic(self.manifest_path, data.encode("utf-8"))
+
+    def _open_name(self, stream: str) -> str:
+        return f"{self._safe(stream)}{OPEN_SUFFIX}"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _safe(self, stream: str) -> str:
+        """
+        A file name part for stream. Streams that needed replacements get a
+        hash suffix, so "a:b" and "a_b" do not share segment names.
+        """
+        safe = UNSAFE_FILENAME_CHARS.sub("_", stream)
+        if safe != stream:
+            digest = hashlib.sha1(stream.encode("utf-8")).hexdigest()[:8]
+            safe = f"{safe}-{digest}"
+        return safe
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from typing import Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+from storage import locked, write_atomic
+
+BUDGET_ACTIONS = ("block", "warn", "downgrade")
+
+
+class BudgetGuard:
+    """
+    Spend of the current day and month per currency, kept in a small JSON
+    file next to the usage ledger.
+
+    Each recorded cost updates the counters in place and a counter starts
+    over when its day or month key changes, so checking the budget before
+    a request reads a few hundred bytes regardless of how much history
+    exists.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def add(self, currency: Optional[str], cost: float, now: float = None) -> None:
+        if not currency or cost <= 0:
+            return
+        try:
+            with locked(self.path):
+                counters = self._current(now)
+                for period in ("daily", "monthly"):
+                    spend = counters[period]
+                    spend[currency] = round(spend.get(currency, 0.0) + cost, 8)
+                data = json.dumps(counters, separators=JSON_SEPARATORS)
+                write_atomic(self.path, data.encode("utf-8"))
+        except OSError as error:
+            logging.error(f"Failed to update budget counters: {error}")
+
+    def spent(self, currency: str, now: float = None) -> Tuple[float, float]:
+        """
+        Return (today's spend, this month's spend) in currency.
+        """
+        counters = self._current(now)
+        return (
+            counters["daily"].get(currency, 0.0),
+            counters["monthly"].get(currency, 0.0),
+        )
+
+    def _current(self, now: Optional[float]) -> dict:
+        moment = time.localtime(now)
+        day = time.strftime("%Y-%m-%d", moment)
+        month = time.strftime("%Y-%m", moment)
+        try:
+            with open(self.path, "rb") as file:
+                counters = json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            counters = {}
+        if not isinstance(counters, dict):
+            counters = {}
+        if counters.get("day") != day:
+            counters["day"], counters["daily"] = day, {}
+        if counters.get("month") != month:
+            counters["month"], counters["monthly"] = month, {}
+        return counters
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+from storage import append_line, iter_lines_reversed, keep_tail_lines, locked
+
+SESSION_SUFFIX = ".jsonl"
+SUMMARY_SUFFIX = ".summary.json"
+LOCK_SUFFIX = ".summary.lock"
+UNSAFE_FILENAME_CHARS = re.compile(r"[^\w.-]")
+
+
+class ConversationStore:
+    """
+    Per-keyword conversation sessions stored as append-only JSON lines.
+
+    Turns are appended in O(1). The context window is built by reading the
+    session file backwards, so its cost depends on the token budget, not on
+    the length of the session. A reset marker or a turn older than the
+    session timeout ends the window. Files above max_file_bytes are
+    compacted to their newest half.
+
+    Turns evicted from the window can be folded into a rolling summary
+    (<keyword>.summary.json) that records the timestamp of the last turn it
+    covers; only turns after it are read as raw context.
+    """
+
+    def __init__(self, directory: str, max_file_bytes: int = 1024 * 1024):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+
+    def session_path(self, keyword: str) -> str:
+        return os.path.join(self.directory, f"{self._name(keyword)}{SESSION_SUFFIX}")
+
+    def append_turn(
+        self,
+        keyword: str,
+        prompt: str,
+        answer: str,
+        timestamp: datetime,
+        response_id: Optional[str] = None,
+    ) -> None:
+        turn = {"ts": timestamp.timestamp(), "prompt": prompt, "answer": answer}
+        if response_id:
+            turn["response_id"] = response_id
+        self._append(keyword, turn)
+
+    def reset(self, keyword: str) -> None:
+        self._append(keyword, {"ts": time.time(), "reset": True})
+        self._remove(self._summary_path(keyword))
+
+    def recent_turns(
+        self,
+        keyword: str,
+        token_budget: int,
+        estimate_tokens: Callable[[str], int],
+        max_age_seconds: Optional[float] = None,
+        after_ts: Optional[float] = None,
+    ) -> Tuple[List[dict], bool]:
+        """
+        Return the most recent turns (oldest first) that fit the budget, and
+        whether older turns were left out because the budget ran out.
+        Turns at or before after_ts (already summarized) are not read.
+        """
+        window = deque()
+        used_tokens = 0
+        cutoff = time.time() - max_age_seconds if max_age_seconds else None
+        for line in iter_lines_reversed(self.session_path(keyword)):
+            try:
+                turn = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+            if turn.get("reset"):
+                break
+            turn_ts = turn.get("ts", 0)
+            if cutoff is not None and turn_ts < cutoff:
+                break
+            if after_ts is not None and turn_ts <= after_ts:
+                break
+            cost = estimate_tokens(turn.get("prompt", "")) + estimate_tokens(
+                turn.get("answer", "")
+            )
+            if used_tokens + cost > token_budget:
+                return list(window), True
+            window.appendleft(turn)
+            used_tokens += cost
+        return list(window), False
+
+    def load_summary(
+        self, keyword: str, max_age_seconds: Optional[float] = None
+    ) -> Optional[dict]:
+        try:
+            with open(self._summary_path(keyword), "rb") as file:
+                summary = json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+        cutoff = time.time() - max_age_seconds if max_age_seconds else None
+        if cutoff is not None and summary.get("until_ts", 0) < cutoff:
+            return None
+        return summary
+
+    def save_summary(self, keyword: str, text: str, until_ts: float) -> None:
+        path = self._summary_path(keyword)
+        data = json.dumps(
+            {"summary": text, "until_ts": until_ts, "updated": time.time()},
+            ensure_ascii=False,
+            separators=JSON_SEPARATORS,
+        ).encode("utf-8")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError as error:
+            logging.error(f"Failed to save conversation summary: {error}")
+
+    def acquire_summary_lock(self, keyword: str, stale_after: float = 300.0) -> bool:
+        """
+        Claim the right to compact this session; False if another process
+        already holds a fresh lock.
+        """
+        path = self._lock_path(keyword)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if time.time() - os.path.getmtime(path) > stale_after:
+                self._remove(path)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
+            return False
+        return True
+
+    def release_summary_lock(self, keyword: str) -> None:
+        self._remove(self._lock_path(keyword))
+
+    def _summary_path(self, keyword: str) -> str:
+        return os.path.join(self.directory, f"{self._name(keyword)}{SUMMARY_SUFFIX}")
+
+    def _lock_path(self, keyword: str) -> str:
+        return os.path.join(self.directory, f"{self._name(keyword)}{LOCK_SUFFIX}")
+
+    def _name(self, keyword: str) -> str:
+        return UNSAFE_FILENAME_CHARS.sub("_", keyword or "default")
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _append(self, keyword: str, record: dict) -> None:
+        path = self.session_path(keyword)
+        data = json.dumps(
+            record, ensure_ascii=False, separators=JSON_SEPARATORS
+        ).encode("utf-8")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with locked(path):
+                append_line(path, data)
+                if os.path.getsize(path) > self.max_file_bytes:
+                    keep_tail_lines(path, self.max_file_bytes // 2)
+        except OSError as error:
+            logging.error(f"Failed to write conversation session: {error}")
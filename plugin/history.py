@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+from archive import Archive
+from payloads import JSON_SEPARATORS
+from storage import append_line, count_lines, iter_lines_reversed, locked, write_atomic
+
+LEGACY_SUFFIX = ".json"
+SYSTEM_MESSAGES_SUFFIX = ".system_messages.json"
+ARCHIVE_STREAM = "history"
+# The file may exceed the limit by this fraction before it is rewritten.
+TRIM_SLACK = 0.25
+TRIM_SAMPLE_LINES = 64
+TRIM_ESTIMATE_MARGIN = 0.9
+
+
+def system_message_hash(system_message: str) -> str:
+    return hashlib.sha256(system_message.encode("utf-8")).hexdigest()[:16]
+
+
+def entry_time(entry: dict) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(entry["prompt_timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RequestHistory:
+    """
+    The newest requests with their answers, one JSON line per request
+    (request_history.jsonl).
+
+    Entries are appended in O(1) and read newest-first by scanning the file
+    backwards, so readers that stop early use constant memory. The file is
+    trimmed back to the limit once it exceeds it by TRIM_SLACK; readers
+    pass the limit to ignore the surplus.
+
+    System messages repeat across entries and can be several KB long, so
+    each distinct one is stored once in a side table
+    (request_history.system_messages.json) keyed by its hash; entries only
+    hold the hash. The table is loaded on the first lookup.
+
+    With an archive, trimmed entries are moved into its "history" stream
+    instead of being dropped, and readers continue into it once the file
+    is exhausted.
+
+    A request_history.json array written by older versions is converted on
+    first access.
+    """
+
+    def __init__(self, path: str, archive: Optional[Archive] = None):
+        self.path = path
+        self.archive = archive
+        base = os.path.splitext(path)[0]
+        self.legacy_path = base + LEGACY_SUFFIX
+        self.system_messages_path = base + SYSTEM_MESSAGES_SUFFIX
+        self._system_messages = None
+
+    def add(self, entry: dict, limit: int) -> None:
+        entry = dict(entry)
+        system_message = entry.pop("system_message", None) or ""
+        digest = system_message_hash(system_message)
+        entry["system_message_hash"] = digest
+        data = json.dumps(entry, ensure_ascii=False, separators=JSON_SEPARATORS)
+        try:
+            with locked(self.path):
+                self._migrate_legacy()
+                table = self._read_system_messages()
+                if table.get(digest) != system_message:
+                    table[digest] = system_message
+                    self._save_system_messages(table)
+                append_line(self.path, data.encode("utf-8"))
+                if self._needs_trim(limit):
+                    self._trim(limit, table)
+        except OSError as error:
+            logging.error(f"Failed to write request history: {error}")
+
+    def iter_entries(
+        self,
+        limit: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> Iterator[dict]:
+        """
+        Yield up to limit entries, newest first, optionally only those whose
+        prompt was sent between the since and until timestamps. Archive
+        segments outside that range are skipped unopened.
+        """
+        if os.path.exists(self.legacy_path):
+            try:
+                with locked(self.path):
+                    self._migrate_legacy()
+            except OSError as error:
+                logging.error(f"Failed to convert request history: {error}")
+        count = 0
+        for line in self._iter_lines(since, until):
+            if limit is not None and count >= limit:
+                return
+            try:
+                entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+            if since is not None or until is not None:
+                timestamp = entry_time(entry)
+                if timestamp is None:
+                    continue
+                if until is not None and timestamp > until:
+                    continue
+                if since is not None and timestamp < since:
+                    continue
+            count += 1
+            yield entry
+
+    def _iter_lines(
+        self, since: Optional[float], until: Optional[float]
+    ) -> Iterator[bytes]:
+        yield from iter_lines_reversed(self.path)
+        if self.archive is None:
+            return
+        for segment in self.archive.segments(ARCHIVE_STREAM, since, until):
+            yield from reversed(list(self.archive.iter_lines(segment)))
+
+    def system_message(self, entry: dict) -> Optional[str]:
+        if "system_message" in entry:
+            return entry["system_message"]
+        if self._system_messages is None:
+            self._system_messages = self._read_system_messages()
+        return self._system_messages.get(entry.get("system_message_hash"))
+
+    def _needs_trim(self, limit: int) -> bool:
+        """
+        Estimate the entry count from the file size and the length of the
+        newest entries; the file is only counted exactly near the threshold.
+        """
+        threshold = limit + max(1, int(limit * TRIM_SLACK))
+        sample = list(islice(iter_lines_reversed(self.path), TRIM_SAMPLE_LINES))
+        if not sample:
+            return False
+        average_size = sum(len(line) + 1 for line in sample) / len(sample)
+        estimate = os.path.getsize(self.path) / average_size
+        if estimate < threshold * TRIM_ESTIMATE_MARGIN:
+            return False
+        return count_lines(self.path) > threshold
+
+    def _trim(self, limit: int, table: dict) -> None:
+        with open(self.path, "rb") as file:
+            lines = [line for line in file.read().split(b"\n") if line.strip()]
+        dropped, kept = lines[:-limit], lines[-limit:]
+        write_atomic(self.path, b"".join(line + b"\n" for line in kept))
+        referenced = set(self._hashes(kept))
+        if self.archive is not None and dropped:
+            self._archive(dropped)
+            referenced |= self.archive.referenced(ARCHIVE_STREAM)
+        pruned = {
+            digest: text for digest, text in table.items() if digest in referenced
+        }
+        if pruned != table:
+            self._save_system_messages(pruned)
+
+    def _archive(self, lines: list) -> None:
+        times = []
+        for line in lines:
+            try:
+                timestamp = entry_time(json.loads(line.decode("utf-8")))
+            except ValueError:
+                continue
+            if timestamp is not None:
+                times.append(timestamp)
+        if not times:
+            times.append(time.time())
+        self.archive.append(
+            ARCHIVE_STREAM, lines, min(times), max(times), set(self._hashes(lines))
+        )
+
+    def _hashes(self, lines: list) -> Iterator[str]:
+        for line in lines:
+            try:
+                yield json.loads(line.decode("utf-8"))["system_message_hash"]
+            except (ValueError, KeyError):
+                continue
+
+    def _migrate_legacy(self) -> None:
+        """
+        Convert a request_history.json array (newest first, inline system
+        messages) into JSON lines placed before any lines already written.
+        A file that is not valid JSON is kept as <name>.corrupt.
+        """
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as file:
+                legacy = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError as error:
+            logging.error(f"Request history is not valid JSON, kept aside: {error}")
+            os.replace(self.legacy_path, f"{self.legacy_path}.corrupt")
+            return
+        if not isinstance(legacy, list):
+            legacy = []
+        table = self._read_system_messages()
+        lines = list(self._legacy_lines(reversed(legacy), table))
+        try:
+            with open(self.path, "rb") as file:
+                lines.append(file.read())
+        except FileNotFoundError:
+            pass
+        self._save_system_messages(table)
+        write_atomic(self.path, b"".join(lines))
+        os.remove(self.legacy_path)
+
+    def _legacy_lines(self, entries: Iterable, table: dict) -> Iterator[bytes]:
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            if "system_message" in entry:
+                system_message = entry.pop("system_message") or ""
+                digest = system_message_hash(system_message)
+                table[digest] = system_message
+                entry["system_message_hash"] = digest
+            data = json.dumps(entry, ensure_ascii=False, separators=JSON_SEPARATORS)
+            yield data.encode("utf-8") + b"\n"
+
+    def _read_system_messages(self) -> dict:
+        try:
+            with open(self.system_messages_path, "rb") as file:
+                table = json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return table if isinstance(table, dict) else {}
+
+    def _save_system_messages(self, table: dict) -> None:
+        data = json.dumps(table, ensure_ascii=False, separators=JSON_SEPARATORS)
+        write_atomic(self.system_messages_path, data.encode("utf-8"))
+        self._system_messages = None
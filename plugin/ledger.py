@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Iterator, Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+from storage import append_line, iter_lines_reversed, keep_tail_lines, locked
+
+TOKENS_PER_PRICE_UNIT = 1000000
+CURRENCY_FORMATS = {"USD": "${:.4f}", "RUB": "{:.2f} ₽", "EUR": "€{:.4f}"}
+
+
+class PriceTable:
+    """
+    Per-model token prices read from prices.csv: model prefix, currency and
+    the price per million input, cached input and output tokens. The
+    longest matching prefix wins, so "gpt-5-mini" is not billed as "gpt-5".
+    """
+
+    def __init__(self, path: str):
+        self.rows = []
+        try:
+            with open(path, encoding="utf-8") as file:
+                for row in csv.DictReader(file, delimiter=";"):
+                    try:
+                        self.rows.append(
+                            (
+                                row["Model Prefix"].strip().lower(),
+                                row["Currency"].strip().upper(),
+                                float(row["Input"]),
+                                float(row["Cached Input"] or row["Input"]),
+                                float(row["Output"]),
+                            )
+                        )
+                    except (KeyError, TypeError, ValueError):
+                        logging.warning(f"Skipping invalid price row: {row}")
+        except FileNotFoundError:
+            logging.warning(f"No price table at {path}")
+        self.rows.sort(key=lambda row: -len(row[0]))
+
+    def price(self, model: str) -> Optional[tuple]:
+        name = (model or "").lower()
+        if name.startswith("gpt://"):
+            name = name.split("/", 3)[-1]
+        for row in self.rows:
+            if name.startswith(row[0]):
+                return row
+        return None
+
+    def cost(self, model: str, usage: dict) -> Tuple[Optional[str], float]:
+        """
+        Return (currency, cost) of a usage block; currency is None for
+        models without a price.
+        """
+        row = self.price(model)
+        if row is None:
+            return None, 0.0
+        _, currency, input_price, cached_price, output_price = row
+        cached = usage.get("cached_tokens", 0)
+        uncached = max(0, usage.get("prompt_tokens", 0) - cached)
+        cost = (
+            uncached * input_price
+            + cached * cached_price
+            + usage.get("completion_tokens", 0) * output_price
+        ) / TOKENS_PER_PRICE_UNIT
+        return currency, cost
+
+
+class UsageLedger:
+    """
+    Append-only ledger of the token usage and cost of every API call, one
+    compact JSON line per call. Entries are appended in time order, so
+    readers walk the file backwards and stop at the start of their period.
+    The file is compacted to its newest half above max_file_bytes.
+    """
+
+    def __init__(self, path: str, prices: PriceTable, max_file_bytes: int = 8 << 20):
+        self.path = path
+        self.prices = prices
+        self.max_file_bytes = max_file_bytes
+
+    def record(
+        self, keyword: str, provider: str, model: str, usage: dict
+    ) -> Optional[dict]:
+        if not usage:
+            return None
+        currency, cost = self.prices.cost(model, usage)
+        entry = {
+            "ts": round(time.time(), 3),
+            "keyword": keyword,
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cost": round(cost, 8),
+            "currency": currency,
+        }
+        data = json.dumps(entry, ensure_ascii=False, separators=JSON_SEPARATORS)
+        try:
+            with locked(self.path):
+                append_line(self.path, data.encode("utf-8"))
+                if os.path.getsize(self.path) > self.max_file_bytes:
+                    keep_tail_lines(self.path, self.max_file_bytes // 2)
+        except OSError as error:
+            logging.error(f"Failed to write usage ledger: {error}")
+        return entry
+
+    def entries(self, since: float) -> Iterator[dict]:
+        """
+        Yield the entries recorded since the given timestamp, newest first.
+        """
+        for line in iter_lines_reversed(self.path):
+            try:
+                entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+            if entry.get("ts", 0) < since:
+                return
+            yield entry
+
+
+def spend_by(entries, key) -> dict:
+    """
+    Group entries by key(entry) into {group: {"requests", "tokens",
+    "cost": {currency: amount}}}.
+    """
+    groups = defaultdict(lambda: {"requests": 0, "tokens": 0, "cost": {}})
+    for entry in entries:
+        group = groups[key(entry)]
+        group["requests"] += 1
+        group["tokens"] += entry.get("prompt_tokens", 0) + entry.get(
+            "completion_tokens", 0
+        )
+        currency = entry.get("currency")
+        if currency:
+            group["cost"][currency] = group["cost"].get(currency, 0.0) + entry.get(
+                "cost", 0.0
+            )
+    return dict(groups)
+
+
+def format_cost(cost: dict) -> str:
+    if not cost:
+        return "no priced usage"
+    return " + ".join(
+        CURRENCY_FORMATS.get(currency, "{:.4f} " + currency).format(amount)
+        for currency, amount in sorted(cost.items())
+    )
@@ -1,26 +1,89 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import sys
 import csv
+import glob
+import heapq
 import logging
+import subprocess
 import time
 from datetime import datetime
+from functools import cached_property
+from itertools import islice
 from flox import Flox  # noqa: E402
 import webbrowser  # noqa: E402
-import requests  # noqa: E402
 import json  # noqa: E402
 import pyperclip  # noqa: E402
-from typing import Tuple, Optional
-
-PROXIES = {
-    "http": os.environ.get("HTTP_PROXY", ""),
-    "https": os.environ.get("HTTPS_PROXY", ""),
+from typing import Iterator, Tuple, Optional
+from analytics import ColumnStore, aggregate  # noqa: E402
+from answer_store import AnswerStore  # noqa: E402
+from archive import Archive  # noqa: E402
+from budget import BUDGET_ACTIONS, BudgetGuard  # noqa: E402
+from conversation import ConversationStore  # noqa: E402
+from prompt_index import PromptIndex  # noqa: E402
+from providers import DEFAULT_MAX_OUTPUT_TOKENS, PROVIDERS  # noqa: E402
+from history import RequestHistory, entry_time  # noqa: E402
+from ledger import PriceTable, UsageLedger, format_cost, spend_by  # noqa: E402
+from request_stats import RequestStats, summarize  # noqa: E402
+from router import ModelRouter, target_key  # noqa: E402
+from search_index import ConversationIndex, parse_exchanges  # noqa: E402
+from single_flight import SingleFlight, request_fingerprint  # noqa: E402
+from storage import locked, write_atomic  # noqa: E402
+from tokens import TokenEstimator, model_limits, truncate_to_tokens  # noqa: E402
+
+CODE_BLOCK_PATTERN = re.compile(r"```([\w+#.-]*)[^\n]*\n(.*?)```", re.DOTALL)
+RERUN_OVERRIDE_FILE = "pending_rerun.json"
+RERUN_OVERRIDE_TTL_SECONDS = 60
+AUTO_MODEL = "auto"
+COMMANDS = {
+    "stats": "_show_stats",
+    "spend": "_show_spend",
+    "find": "_find_conversations",
+    "recent": "_recall_prompts",
 }
+# Commands that take the rest of the query as their argument.
+TEXT_COMMANDS = {"find", "recent"}
+CONVERSATION_FILE_PATTERN = re.compile(r"^Conversations '(.*)' keyword\.txt$")
+CONVERSATION_STREAM_PREFIX = "conversation:"
+CONVERSATION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CONVERSATION_TIMESTAMP = re.compile(
+    r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] User: ", re.MULTILINE
+)
+STATS_WINDOW = 1000
+# Earlier answers offered while a prompt is typed, and the shortest typed
+# prompt worth looking up.
+RECALL_WHILE_TYPING_LIMIT = 5
+RECALL_WHILE_TYPING_MIN_CHARS = 3
+# Answer actions a recalled answer can run once it is stored.
+RECALLED_ACTIONS = {"copy_answer", "display_answer", "open_in_editor"}
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain a running summary of a conversation between a user and an "
+    "assistant. Merge the previous summary with the new messages into one "
+    "concise summary that keeps facts, decisions, names, numbers, code "
+    "identifiers and open questions needed to continue the conversation. "
+    "Write it in the language of the conversation. Reply with the summary only."
+)
 
 
 class AliceAI(Flox):
     def __init__(self):
         self._load_settings()
+        self.backends = {name: cls(self) for name, cls in PROVIDERS.items()}
+        self.context_turns = []
+        self.context_summary = ""
+        self.prompt_token_estimate = 0
+        self.prompt_token_estimate_raw = 0.0
+        self.prompt_token_estimate_model = ""
+        self.auto_ranking = None
+        self.last_usage = {}
+        self.first_call_usage = {}
+        self.last_response_id = ""
+        self.last_ttft_ms = None
+        self.last_latency_ms = None
+        self.last_spend = None
+        self.budget_notice = None
 
         try:
             self.csv_file = open("system_messages.csv", encoding="utf-8", mode="r")
@@ -32,6 +95,81 @@ class AliceAI(Flox):
             self.prompts = None
             logging.error("Unable to open system_messages.csv")
 
+    # Stores are created on first use: most plugin processes only answer a
+    # keystroke and never touch most of them.
+
+    @cached_property
+    def answer_store(self) -> AnswerStore:
+        return AnswerStore(os.path.join(os.getcwd(), "answers"))
+
+    @cached_property
+    def single_flight(self) -> SingleFlight:
+        return SingleFlight(os.path.join(os.getcwd(), "inflight"))
+
+    @cached_property
+    def conversation_store(self) -> ConversationStore:
+        return ConversationStore(os.path.join(os.getcwd(), "sessions"))
+
+    @cached_property
+    def router(self) -> ModelRouter:
+        return ModelRouter(
+            os.path.join(os.getcwd(), "model_stats.json"),
+            os.path.join(os.getcwd(), "routing_log.jsonl"),
+        )
+
+    @cached_property
+    def token_estimator(self) -> TokenEstimator:
+        return TokenEstimator(os.path.join(os.getcwd(), "token_calibration.json"))
+
+    @cached_property
+    def request_stats(self) -> RequestStats:
+        return RequestStats(os.path.join(os.getcwd(), "request_stats.jsonl"))
+
+    @cached_property
+    def usage_ledger(self) -> UsageLedger:
+        return UsageLedger(
+            os.path.join(os.getcwd(), "usage_ledger.jsonl"),
+            PriceTable(os.path.join(os.getcwd(), "prices.csv")),
+        )
+
+    @cached_property
+    def request_columns(self) -> ColumnStore:
+        return ColumnStore(os.path.join(os.getcwd(), "request_metrics.bin"))
+
+    @cached_property
+    def budget_guard(self) -> BudgetGuard:
+        return BudgetGuard(os.path.join(os.getcwd(), "budget_counter.json"))
+
+    @cached_property
+    def archive(self) -> Archive:
+        return Archive(
+            os.path.join(os.getcwd(), "archive"),
+            compression=self.archive_compression,
+            segment_bytes=self.archive_segment_kb * 1024,
+            segment_seconds=self.archive_segment_days * 24 * 3600,
+            max_bytes=self.archive_max_mb * 1024 * 1024,
+            max_age_seconds=self.archive_max_age_days * 24 * 3600,
+        )
+
+    @cached_property
+    def conversation_index(self) -> ConversationIndex:
+        return ConversationIndex(
+            os.path.join(os.getcwd(), "conversation_index.sqlite3")
+        )
+
+    @cached_property
+    def request_history(self) -> RequestHistory:
+        return RequestHistory(
+            os.path.join(os.getcwd(), "request_history.jsonl"),
+            self.archive if self.archive_request_history else None,
+        )
+
+    @cached_property
+    def prompt_index(self) -> PromptIndex:
+        return PromptIndex(
+            os.path.join(os.getcwd(), "prompt_index.data"), self.recall_index_limit
+        )
+
     def _load_settings(self) -> None:
         self.provider = (self.settings.get("provider") or "openai").lower()
         self.api_key = self.settings.get("api_key")
@@ -44,6 +182,36 @@ class AliceAI(Flox):
         self.request_history_limit = self._parse_int_setting(
             self.settings.get("request_history_limit"), 10
         )
+        self.request_gzip_min_bytes = self._parse_int_setting(
+            self.settings.get("request_gzip_min_bytes"), 0
+        )
+        self.archive_request_history = self._parse_bool_setting(
+            self.settings.get("archive_request_history"), False
+        )
+        self.recall_while_typing = self._parse_bool_setting(
+            self.settings.get("recall_while_typing"), True
+        )
+        self.recall_index_limit = self._parse_limit_setting(
+            self.settings.get("recall_index_limit"), 1000
+        )
+        self.archive_compression = (
+            self.settings.get("archive_compression") or "gzip"
+        ).lower()
+        self.archive_conversations = self._parse_bool_setting(
+            self.settings.get("archive_conversations"), False
+        )
+        self.archive_segment_kb = self._parse_limit_setting(
+            self.settings.get("archive_segment_kb"), 1024
+        )
+        self.archive_segment_days = self._parse_limit_setting(
+            self.settings.get("archive_segment_days"), 7
+        )
+        self.archive_max_mb = self._parse_int_setting(
+            self.settings.get("archive_max_mb"), 0
+        )
+        self.archive_max_age_days = self._parse_int_setting(
+            self.settings.get("archive_max_age_days"), 0
+        )
         self.log_level = self.settings.get("log_level")
         self.api_endpoint = (
             self.settings.get("api_endpoint")
@@ -52,6 +220,9 @@ class AliceAI(Flox):
         self.openai_request_mode = (
             self.settings.get("openai_request_mode") or "sync"
         ).lower()
+        self.responses_store = self._parse_bool_setting(
+            self.settings.get("responses_store"), False
+        )
         self.yandex_request_mode = (
             self.settings.get("yandex_request_mode") or "sync"
         ).lower()
@@ -75,6 +246,15 @@ class AliceAI(Flox):
             self.settings.get("yandex_openai_endpoint")
             or "https://llm.api.cloud.yandex.net/v1/chat/completions"
         )
+        self.local_endpoint = (
+            self.settings.get("local_endpoint")
+            or "http://127.0.0.1:8080/v1/chat/completions"
+        )
+        self.local_model = self.settings.get("local_model") or ""
+        self.local_api_key = self.settings.get("local_api_key") or ""
+        self.local_request_mode = (
+            self.settings.get("local_request_mode") or "sync"
+        ).lower()
         self.answer_action_order = self.settings.get("answer_action_order") or (
             "copy,preview,editor"
         )
@@ -99,10 +279,89 @@ class AliceAI(Flox):
         self.editor_open_mode = (
             self.settings.get("editor_open_mode") or "saved_if_available"
         ).lower()
+        self.conversation_context = self._parse_bool_setting(
+            self.settings.get("conversation_context"), False
+        )
+        self.context_token_budget = self._parse_int_setting(
+            self.settings.get("context_token_budget"), 2000
+        )
+        self.conversation_timeout_minutes = self._parse_int_setting(
+            self.settings.get("conversation_timeout_minutes"), 30
+        )
+        self.context_summary_enabled = self._parse_bool_setting(
+            self.settings.get("context_summary"), False
+        )
+        self.summary_model = self.settings.get("summary_model") or (
+            "openai:gpt-5-nano"
+        )
+        self.summary_threshold_tokens = self._parse_int_setting(
+            self.settings.get("summary_threshold_tokens"), 6000
+        )
+        self.max_prompt_tokens = self._parse_int_setting(
+            self.settings.get("max_prompt_tokens"), 0
+        )
+        self.max_output_tokens = self._parse_int_setting(
+            self.settings.get("max_output_tokens"), 0
+        )
+        self.overlong_prompt_mode = (
+            self.settings.get("overlong_prompt_mode") or "truncate"
+        ).lower()
+        self.request_timeout_seconds = self._parse_int_setting(
+            self.settings.get("request_timeout_seconds"), 120
+        )
+        self.auto_model_candidates = self.settings.get("auto_model_candidates") or (
+            "openai:gpt-5,openai:gpt-5-mini,openai:gpt-5-nano"
+        )
+        self.auto_latency_target_ms = self._parse_int_setting(
+            self.settings.get("auto_latency_target_ms"), 8000
+        )
+        self.fallback_chain = self.settings.get("fallback_chain") or ""
+        self.fallback_deadline_seconds = self._parse_int_setting(
+            self.settings.get("fallback_deadline_seconds"), 90
+        )
+        self.auto_continue = self._parse_bool_setting(
+            self.settings.get("auto_continue"), True
+        )
+        self.max_continuations = self._parse_int_setting(
+            self.settings.get("max_continuations"), 2
+        )
+        self.rerun_models = self.settings.get("rerun_models") or (
+            "openai:gpt-5-nano,openai:gpt-5,"
+            "yandex_openai:yandexgpt/latest,yandex_native:yandexgpt-lite"
+        )
+        self.daily_budget = self._parse_float_setting(
+            self.settings.get("daily_budget"), 0.0
+        )
+        self.monthly_budget = self._parse_float_setting(
+            self.settings.get("monthly_budget"), 0.0
+        )
+        self.budget_currency = (self.settings.get("budget_currency") or "USD").upper()
+        self.budget_action = (self.settings.get("budget_action") or "block").lower()
+        if self.budget_action not in BUDGET_ACTIONS:
+            self.budget_action = "block"
+        self.budget_downgrade_model = self.settings.get("budget_downgrade_model") or (
+            "openai:gpt-5-nano"
+        )
+        self.temperature = None
+        self.reasoning_effort = ""
+        self.latency_target_ms = self.auto_latency_target_ms
+        self.target_overridden = False
+        self.rerun_system_message = None
+        self.budget_downgraded = False
+        self.prompt_keyword = ""
+        self.request_errors = []
+        self.request_deadline = None
+        self.answered_by = ""
+        self.answer_truncated = False
+        self.partial_answer = ""
+        self.partial_response_id = ""
         self.logger_level(self.log_level)
 
     def query(self, query: str) -> None:
         self._load_settings()
+        if not query.endswith(self.prompt_stop) and self._run_command(query):
+            return
+        self._apply_rerun_override(query)
         if not self._ensure_auth():
             return
         if self.prompts is None:
@@ -114,34 +373,69 @@ class AliceAI(Flox):
             return
         if query.endswith(self.prompt_stop):
             prompt, prompt_keyword, system_message = self.split_prompt(query)
-
-            answer, prompt_timestamp, answer_timestamp = self.send_prompt(
-                prompt, system_message
-            )
-
-            self._log_request_history(
-                prompt_keyword,
-                prompt,
-                system_message,
+            if self.rerun_system_message is not None:
+                system_message = self.rerun_system_message
+            self.prompt_keyword = prompt_keyword
+            if self._apply_generation_profile(prompt_keyword):
+                if not self._ensure_auth():
+                    return
+            self.context_turns = self._load_context_turns(prompt_keyword)
+            prompt = self._fit_prompt_budget(prompt, system_message)
+            if prompt is None:
+                return
+            prompt = self._check_spend_budget(prompt, system_message)
+            if prompt is None:
+                return
+
+            (
                 answer,
                 prompt_timestamp,
                 answer_timestamp,
-            )
+                is_leader,
+            ) = self._send_prompt_single_flight(prompt, system_message)
 
             filename = None
-            if self.save_conversation_setting:
-                filename = self.save_conversation(
-                    prompt_keyword, prompt, prompt_timestamp, answer, answer_timestamp
+            if is_leader and answer and self.conversation_context:
+                self.conversation_store.append_turn(
+                    prompt_keyword,
+                    prompt,
+                    answer,
+                    answer_timestamp,
+                    self.last_response_id,
                 )
+            if is_leader:
+                self._record_request_stats(prompt_keyword, answer)
+                self._log_request_history(
+                    prompt_keyword,
+                    prompt,
+                    system_message,
+                    answer,
+                    prompt_timestamp,
+                    answer_timestamp,
+                )
+                if self.save_conversation_setting:
+                    filename = self.save_conversation(
+                        prompt_keyword,
+                        prompt,
+                        prompt_timestamp,
+                        answer,
+                        answer_timestamp,
+                    )
+            elif self.save_conversation_setting:
+                filename = self._conversation_filename(prompt_keyword)
 
             if answer:
                 answer = answer.lstrip("\n").lstrip("\n")
                 short_answer = self.ellipsis(answer, 30)
 
                 for action in self._build_answer_actions(
-                    prompt, answer, filename, short_answer
+                    prompt, answer, filename, short_answer, prompt_keyword
                 ):
                     self.add_item(**action)
+            else:
+                self._report_request_errors()
+            if self.budget_notice:
+                self.add_item(**self.budget_notice)
 
         else:
             self.add_item(
@@ -151,425 +445,1138 @@ class AliceAI(Flox):
                     f"| Mode: {self._current_request_mode_label()}"
                 ),
             )
+            self._offer_typed_prompt_answers(query)
         return
 
-    def send_prompt(
-        self, prompt: str, system_message: str
-    ) -> Tuple[str, datetime, datetime]:
+    def _run_command(self, query: str) -> bool:
         """
-        Query the selected provider end-point
+        Handle a plugin sub-command typed without the prompt stop.
         """
-        if self.provider == "openai":
-            return self._send_openai_prompt(prompt, system_message)
-        if self.provider == "yandex_openai":
-            return self._send_yandex_openai_prompt(prompt, system_message)
-        return self._send_yandex_native_prompt(prompt, system_message)
+        name, _, argument = query.strip().partition(" ")
+        command = COMMANDS.get(name.lower())
+        if not command:
+            return False
+        if not argument.strip():
+            getattr(self, command)()
+        elif name.lower() in TEXT_COMMANDS:
+            getattr(self, command)(argument.strip())
+        else:
+            return False
+        return True
 
-    def _send_openai_prompt(
-        self, prompt: str, system_message: str
-    ) -> Tuple[str, datetime, datetime]:
-        url = self.api_endpoint
+    def _record_request_stats(self, prompt_keyword: str, answer: str) -> None:
+        now = time.time()
+        for error in self.request_errors:
+            if not error.get("target"):
+                continue
+            provider, model = error["target"]
+            self.request_columns.record(
+                now, None, None, False, prompt_keyword, provider, model
+            )
+        if not answer:
+            return
+        self.request_columns.record(
+            now,
+            self.last_latency_ms,
+            self.last_ttft_ms,
+            True,
+            prompt_keyword,
+            self.provider,
+            self._current_model_name(),
+        )
+        self.request_stats.record(
+            {
+                "ts": now,
+                "keyword": prompt_keyword,
+                "provider": self.provider,
+                "model": self._current_model_name(),
+                "prompt_tokens": self.last_usage.get("prompt_tokens", 0),
+                "cached_tokens": self.last_usage.get("cached_tokens", 0),
+                "completion_tokens": self.last_usage.get("completion_tokens", 0),
+                "ttft_ms": self.last_ttft_ms,
+                "latency_ms": self.last_latency_ms,
+                "stream": self.backend.request_mode() == "async",
+            }
+        )
 
-        headers = self._openai_headers()
-        stream = self.openai_request_mode == "async"
-        body = self._openai_body(prompt, system_message, self.model, stream)
+    def _show_stats(self) -> None:
+        """
+        Latency, error and usage figures over all recorded requests, then
+        prompt-cache hit ratio and time to first token, overall and per
+        keyword, over the most recent requests.
+        """
+        records = self.request_stats.recent(STATS_WINDOW)
+        if records and not os.path.exists(self.request_columns.path):
+            self.request_columns.backfill(reversed(records))
+        self._show_request_analytics()
+        if not records:
+            self.add_item(
+                title="No request statistics yet",
+                subtitle="Statistics are collected for answered prompts",
+            )
+            return
+        by_keyword = {}
+        for record in records:
+            by_keyword.setdefault(record.get("keyword") or "", []).append(record)
+        groups = [(f"Last {len(records)} requests", records)]
+        groups += sorted(
+            ((f"'{keyword}'", group) for keyword, group in by_keyword.items()),
+            key=lambda item: -len(item[1]),
+        )
+        for title, group in groups:
+            stats = summarize(group)
+            self.add_item(
+                title=f"{title}: {stats['cached_ratio']:.0%} of prompt tokens cached",
+                subtitle=(
+                    f"Cache hits: {stats['cache_hits']}/{stats['requests']} "
+                    f"| First token: {self._format_ms(stats['ttft_hit_ms'])} "
+                    f"with hit, {self._format_ms(stats['ttft_miss_ms'])} without"
+                ),
+            )
 
-        return self._send_request(url, headers, body, "OpenAI", stream)
+    def _show_request_analytics(self) -> None:
+        columns = self.request_columns.load()
+        if not len(columns):
+            return
+        now = time.time()
+        utc_offset = datetime.now().astimezone().utcoffset().total_seconds()
+        stats = aggregate(columns, now, utc_offset)
+        latency = stats["latency"]
+        self.add_item(
+            title=(
+                f"{stats['requests']} requests: {self._format_ms(latency['p50'])} "
+                f"median, {self._format_ms(latency['p90'])} p90, "
+                f"{self._format_ms(latency['p99'])} p99"
+            ),
+            subtitle=(
+                f"Errors: {stats['errors']} "
+                f"({stats['errors'] / stats['requests']:.1%})"
+            ),
+        )
+        per_day = stats["per_day"]
+        self.add_item(
+            title=(
+                f"Answers today: {per_day[-1][1]}, "
+                f"{sum(count for _, count in per_day) / len(per_day):.1f} a day "
+                f"over {len(per_day)} days"
+            ),
+            subtitle=" | ".join(
+                f"{time.strftime('%d.%m', time.gmtime(day))}: {count}"
+                for day, count in per_day
+            ),
+        )
+        if stats["top_keywords"]:
+            self.add_item(
+                title="Top keywords",
+                subtitle=" | ".join(
+                    f"{keyword or '(default)'}: {count}"
+                    for keyword, count in stats["top_keywords"]
+                ),
+            )
+        for target in stats["targets"]:
+            latency = target["latency"]
+            self.add_item(
+                title=(
+                    f"{target['provider']}:{target['model']}: "
+                    f"{target['requests']} requests"
+                ),
+                subtitle=(
+                    f"{self._format_ms(latency['p50'])} median, "
+                    f"{self._format_ms(latency['p90'])} p90 "
+                    f"| Errors: {target['errors'] / target['requests']:.1%}"
+                ),
+            )
 
-    def _send_yandex_openai_prompt(
-        self, prompt: str, system_message: str
-    ) -> Tuple[str, datetime, datetime]:
-        url = self.yandex_openai_endpoint
-        headers = self._yandex_headers()
-        stream = self.yandex_request_mode == "async"
-        body = self._openai_body(
-            prompt, system_message, self._yandex_model_value(), stream
+    def _show_spend(self) -> None:
+        """
+        Token usage and cost from the usage ledger: today, the last 7 and 30
+        days, and the last 30 days by model and by keyword.
+        """
+        now = time.time()
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = today.timestamp() - 29 * 24 * 3600
+        entries = list(self.usage_ledger.entries(month_start))
+        self._show_budget()
+        if not entries:
+            self.add_item(
+                title="No usage recorded yet",
+                subtitle="Usage is recorded for every answered request",
+            )
+            return
+        for title, since in (
+            ("Today", today.timestamp()),
+            ("Last 7 days", today.timestamp() - 6 * 24 * 3600),
+            ("Last 30 days", month_start),
+        ):
+            period = [entry for entry in entries if entry["ts"] >= since]
+            total = spend_by(period, lambda entry: "").get("", {})
+            subtitle = (
+                f"{total.get('requests', 0)} requests "
+                f"| {total.get('tokens', 0):,} tokens"
+            )
+            days = round((now - since) / (24 * 3600))
+            if days > 1:
+                subtitle += f" | {total.get('requests', 0) / days:.1f} requests a day"
+            self.add_item(
+                title=f"{title}: {format_cost(total.get('cost', {}))}",
+                subtitle=subtitle,
+            )
+        for label, key in (
+            ("Model", lambda entry: f"{entry['provider']}:{entry['model']}"),
+            ("Keyword", lambda entry: entry.get("keyword") or "(default)"),
+        ):
+            groups = sorted(
+                spend_by(entries, key).items(),
+                key=lambda item: (-sum(item[1]["cost"].values()), -item[1]["tokens"]),
+            )
+            for name, group in groups[:5]:
+                self.add_item(
+                    title=f"{label} {name}: {format_cost(group['cost'])}",
+                    subtitle=(
+                        f"Last 30 days: {group['requests']} requests "
+                        f"| {group['tokens']:,} tokens"
+                    ),
+                )
+
+    def _show_budget(self) -> None:
+        daily, monthly = self.budget_guard.spent(self.budget_currency)
+        for period, spent, budget in (
+            ("Today", daily, self.daily_budget),
+            ("This month", monthly, self.monthly_budget),
+        ):
+            if not budget:
+                continue
+            self.add_item(
+                title=(
+                    f"{period}: {format_cost({self.budget_currency: spent})} "
+                    f"of {format_cost({self.budget_currency: budget})} budget"
+                ),
+                subtitle=(
+                    f"{min(spent / budget, 1):.0%} used "
+                    f"| When exhausted: {self.budget_action}"
+                ),
+            )
+
+    def _find_conversations(self, text: str = "") -> None:
+        """
+        Saved exchanges containing every word of text, newest first, from
+        the conversation index.
+        """
+        index = self.conversation_index
+        if not index.exists():
+            self.add_item(
+                title="Press Enter to index saved conversations",
+                subtitle="Needed once before 'find' can search them",
+                method=self.build_conversation_index,
+                parameters=[text],
+                dont_hide=True,
+            )
+            return
+        results = index.search(text) if text else None
+        if results is None:
+            self.add_item(
+                title="Type the text to find after 'find'",
+                subtitle="Searches saved conversations; words need 3+ characters",
+            )
+            return
+        if not results:
+            self.add_item(
+                title=f"Nothing found for '{text}'",
+                subtitle="Only conversations saved with 'Save conversation' are found",
+            )
+        for result in results:
+            found_at = datetime.fromtimestamp(result["ts"]).strftime(
+                CONVERSATION_TIME_FORMAT
+            )
+            self.add_item(
+                title=self.ellipsis(result["prompt"], 80),
+                subtitle=f"{found_at} '{result['keyword']}' | {result['snippet']}",
+                method=self.copy_found_answer,
+                parameters=[result["id"]],
+            )
+        if not index.backfilled():
+            self.add_item(
+                title="Indexing saved conversations",
+                subtitle="Older conversations are found once indexing finishes",
+                method=self.build_conversation_index,
+                parameters=[text],
+                dont_hide=True,
+            )
+
+    def _recall_prompts(self, fragment: str = "") -> None:
+        """
+        Previous answers whose prompts fuzzy-match fragment, without an API
+        call.
+        """
+        if not fragment:
+            self.add_item(
+                title="Type part of a previous prompt after 'recent'",
+                subtitle="Shows earlier answers without sending a request",
+            )
+            return
+        if self.recall_index_limit <= 0:
+            self.add_item(
+                title="Recall of earlier prompts is turned off",
+                subtitle="Set 'Recall index size' above 0 to index answered prompts",
+            )
+            return
+        records = self.prompt_index.search(fragment)
+        if not records and not self.prompt_index.exists():
+            self.add_item(
+                title="Earlier prompts are not indexed yet",
+                subtitle="They are indexed in the background after the next answer",
+            )
+            return
+        if not records:
+            self.add_item(
+                title=f"No previous prompt matches '{fragment}'",
+                subtitle=f"Only the newest {self.recall_index_limit} prompts are kept",
+            )
+            return
+        for record in records:
+            self._add_recalled_answer(record)
+
+    def _offer_typed_prompt_answers(self, query: str) -> None:
+        """
+        Earlier answers to prompts starting with what has been typed so far,
+        asked with the same keyword, so a repeated question needs no request.
+        """
+        if not self.recall_while_typing or self.recall_index_limit <= 0:
+            return
+        if not query.strip():
+            return
+        prompt, prompt_keyword, _ = self.split_prompt(query)
+        if len(prompt.strip()) < RECALL_WHILE_TYPING_MIN_CHARS:
+            return
+        for record in self.prompt_index.complete(
+            prompt, prompt_keyword, RECALL_WHILE_TYPING_LIMIT
+        ):
+            self._add_recalled_answer(record)
+
+    def seed_prompt_index(self) -> None:
+        """
+        Fill a new prompt index from the newest request history entries.
+        """
+        if self.recall_index_limit <= 0 or self.prompt_index.exists():
+            return
+        entries = (
+            entry
+            for entry in self.request_history.iter_entries()
+            if entry.get("prompt") and entry.get("answer") and entry_time(entry)
+        )
+        newest = list(islice(entries, self.recall_index_limit))
+        self.prompt_index.backfill(
+            (
+                entry_time(entry),
+                entry.get("prompt_keyword", ""),
+                entry["prompt"],
+                entry["answer"],
+            )
+            for entry in reversed(newest)
         )
 
-        return self._send_request(
-            url, headers, body, "Yandex OpenAI-compatible", stream
+    def _add_recalled_answer(self, record: dict) -> None:
+        """
+        Offer an indexed answer with the same actions as a fresh one. The
+        answer is copied to the answer store only when an action is chosen,
+        so showing it writes nothing.
+        """
+        prompt, answer = record["prompt"], record["answer"]
+        answer_id = self.answer_store.key(prompt, answer)
+        actions = self._answer_action_definitions(
+            answer_id, None, self.ellipsis(answer, 60)
         )
+        if not actions:
+            return
+        asked_at = datetime.fromtimestamp(record["ts"]).strftime(
+            CONVERSATION_TIME_FORMAT
+        )
+        ts = repr(record["ts"])
+        action = actions[0]
+        action["title"] = self.ellipsis(prompt, 80)
+        action["subtitle"] = f"{asked_at} | {action['subtitle']}"
+        action["parameters"] = [
+            ts,
+            answer_id,
+            action["method"].__name__,
+            action["parameters"],
+        ]
+        action["method"] = self.run_recalled_action
+        action["context"] = [answer_id, None, record.get("keyword", ""), ts]
+        self.add_item(**action)
+
+    def run_recalled_action(
+        self, ts: str, answer_id: str, method: str, parameters: list
+    ) -> None:
+        """
+        Store a recalled answer, then run the answer action chosen for it.
+        """
+        if method not in RECALLED_ACTIONS:
+            return
+        if self._store_recalled_answer(ts, answer_id):
+            getattr(self, method)(*parameters)
 
-    def _send_yandex_native_prompt(
+    def _store_recalled_answer(self, ts: str, answer_id: str) -> bool:
+        """
+        Copy the prompt index record sent at ts with answer_id to the
+        answer store.
+        """
+        try:
+            records = self.prompt_index.at(float(ts))
+        except ValueError:
+            return False
+        for record in records:
+            prompt, answer = record.get("prompt", ""), record.get("answer", "")
+            if self.answer_store.key(prompt, answer) == answer_id:
+                self.answer_store.put(prompt, answer)
+                return True
+        return False
+
+    def _format_ms(self, value: Optional[float]) -> str:
+        if value is None:
+            return "n/a"
+        if value >= 1000:
+            return f"{value / 1000:.1f} s"
+        return f"{value:.0f} ms"
+
+    def _send_prompt_single_flight(
         self, prompt: str, system_message: str
-    ) -> Tuple[str, datetime, datetime]:
-        if self.yandex_request_mode == "async":
-            return self._send_yandex_native_async_prompt(prompt, system_message)
-        url = self.yandex_native_endpoint
-        headers = self._yandex_headers()
-        model_uri = self._yandex_model_uri()
-        body = {
-            "modelUri": model_uri,
-            "completionOptions": {
-                "stream": False,
-                "temperature": 0.6,
-                "maxTokens": 2000,
-            },
-            "messages": [
-                {"role": "system", "text": system_message},
-                {"role": "user", "text": prompt},
-            ],
-        }
+    ) -> Tuple[str, datetime, datetime, bool]:
+        """
+        Send the prompt unless an identical request is already in flight in
+        another plugin process, in which case its answer is reused.
+        """
+        key = request_fingerprint(
+            self.provider,
+            self._current_model_label(),
+            system_message,
+            self.context_summary,
+            json.dumps([turn.get("ts") for turn in self.context_turns]),
+            prompt,
+        )
 
-        prompt_timestamp = datetime.now()
-        logging.debug(f"Sending Yandex native request with data: {body}")
-        try:
-            response = requests.request(
-                "POST",
-                url,
-                headers=headers,
-                data=json.dumps(body),
-                proxies=PROXIES,
-            )
-        except UnicodeEncodeError as e:
-            logging.error(f"UnicodeEncodeError: {e}")
-            return "", prompt_timestamp, datetime.now()
-
-        logging.debug(f"Response: {response}")
-        answer_timestamp = datetime.now()
-        result = ""
-        response_json = response.json()
-        if response.ok:
-            alternatives = response_json.get("result", {}).get("alternatives", [])
-            for entry in alternatives:
-                message = entry.get("message", {})
-                result += message.get("text", "")
-        else:
-            self._handle_error(response, response_json, "Yandex native")
+        sent = []
+        rounds = 1 + (self.max_continuations if self.auto_continue else 0)
+        self.single_flight.wait_timeout = max(
+            self.request_timeout_seconds * rounds, self.fallback_deadline_seconds
+        )
 
-        return result, prompt_timestamp, answer_timestamp
+        def call() -> Optional[dict]:
+            answer, prompt_timestamp, answer_timestamp = self._dispatch_prompt(
+                prompt, system_message
+            )
+            sent.append((answer, prompt_timestamp, answer_timestamp))
+            self._calibrate_token_estimator()
+            if not answer:
+                return None
+            return {
+                "answer": answer,
+                "prompt_timestamp": prompt_timestamp.isoformat(),
+                "answer_timestamp": answer_timestamp.isoformat(),
+                "answered_by": self.answered_by,
+            }
+
+        result, is_leader = self.single_flight.run(key, call)
+        if is_leader:
+            answer, prompt_timestamp, answer_timestamp = sent[-1]
+            return answer, prompt_timestamp, answer_timestamp, True
+        self.answered_by = result.get("answered_by", "")
+        return (
+            result.get("answer", ""),
+            datetime.fromisoformat(result["prompt_timestamp"]),
+            datetime.fromisoformat(result["answer_timestamp"]),
+            False,
+        )
 
-    def _send_yandex_native_async_prompt(
+    def _dispatch_prompt(
         self, prompt: str, system_message: str
     ) -> Tuple[str, datetime, datetime]:
-        url = self._yandex_async_endpoint(self.yandex_native_endpoint)
-        headers = self._yandex_headers()
-        model_uri = self._yandex_model_uri()
-        body = {
-            "modelUri": model_uri,
-            "completionOptions": {
-                "stream": False,
-                "temperature": 0.6,
-                "maxTokens": 2000,
-            },
-            "messages": [
-                {"role": "system", "text": system_message},
-                {"role": "user", "text": prompt},
-            ],
+        if self._current_model_name() == AUTO_MODEL:
+            return self._send_auto_routed_prompt(prompt, system_message)
+        primary = (self.provider, self._current_model_name())
+        targets = [primary]
+        fallback_chain = "" if self.budget_downgraded else self.fallback_chain
+        for target in self._parse_model_targets(fallback_chain):
+            if target not in targets and target[1] != AUTO_MODEL:
+                if self._has_credentials(target[0]):
+                    targets.append(target)
+        return self._send_with_fallback(targets, prompt, system_message)
+
+    def _send_auto_routed_prompt(
+        self, prompt: str, system_message: str
+    ) -> Tuple[str, datetime, datetime]:
+        """
+        Let the router pick a candidate for the "auto" model and fall back
+        down its ranking when a candidate fails.
+        """
+        if self.auto_ranking is None:
+            self._route_auto_model(prompt, system_message)
+        ranking = self.auto_ranking
+        decision = {
+            "ts": time.time(),
+            "keyword": self.prompt_keyword,
+            "prompt_tokens": self.prompt_token_estimate,
+            "target_ms": self.latency_target_ms,
+            "ranking": ranking,
+            "attempts": [],
+            "chosen": None,
         }
+        if not ranking:
+            self._record_request_error(
+                "Auto model",
+                "No auto model candidate has credentials configured",
+                model_failed=False,
+            )
 
-        prompt_timestamp = datetime.now()
-        logging.debug(f"Sending Yandex native async request with data: {body}")
-        try:
-            response = requests.request(
-                "POST",
-                url,
-                headers=headers,
-                data=json.dumps(body),
-                proxies=PROXIES,
-            )
-        except UnicodeEncodeError as e:
-            logging.error(f"UnicodeEncodeError: {e}")
-            return "", prompt_timestamp, datetime.now()
-
-        logging.debug(f"Response: {response}")
-        answer_timestamp = datetime.now()
-        if not response.ok:
-            response_json = response.json()
-            self._handle_error(response, response_json, "Yandex native async")
-            return "", prompt_timestamp, answer_timestamp
-
-        response_json = response.json()
-        operation_id = response_json.get("id")
-        if not operation_id:
-            logging.error("Missing operation id in Yandex async response.")
-            return "", prompt_timestamp, answer_timestamp
-
-        return self._poll_yandex_operation(
-            operation_id, headers, prompt_timestamp, answer_timestamp
-        )
-
-    def _poll_yandex_operation(
+        def record(provider: str, model: str, ok: bool, latency_ms: int) -> None:
+            self.router.record(provider, model, ok, latency_ms)
+            key = target_key(provider, model)
+            decision["attempts"].append(
+                {"target": key, "ok": ok, "latency_ms": latency_ms}
+            )
+            if ok:
+                decision["chosen"] = key
+
+        result = self._send_with_fallback(
+            [(row["provider"], row["model"]) for row in ranking],
+            prompt,
+            system_message,
+            record,
+            always_label=True,
+        )
+        self.router.log_decision(decision)
+        return result
+
+    def _send_with_fallback(
         self,
-        operation_id: str,
-        headers: dict,
-        prompt_timestamp: datetime,
-        answer_timestamp: datetime,
-        max_attempts: int = 60,
-        poll_interval_seconds: float = 1.0,
+        targets: list,
+        prompt: str,
+        system_message: str,
+        on_attempt=None,
+        always_label: bool = False,
     ) -> Tuple[str, datetime, datetime]:
-        operation_url = self._yandex_operation_endpoint(operation_id)
-        for _ in range(max_attempts):
-            try:
-                response = requests.get(
-                    operation_url, headers=headers, proxies=PROXIES
+        """
+        Try the provider/model targets in order until one answers. With more
+        than one target, all attempts share one overall deadline.
+        """
+        answer, prompt_timestamp, answer_timestamp = "", datetime.now(), datetime.now()
+        if len(targets) > 1:
+            self.request_deadline = time.monotonic() + self.fallback_deadline_seconds
+        for index, (provider, model) in enumerate(targets):
+            if index and self._budget_blocks(provider, model):
+                continue
+            if index and self._deadline_passed():
+                self._record_request_error(
+                    "Fallback",
+                    "Gave up after reaching the fallback deadline",
+                    model_failed=False,
                 )
-            except UnicodeEncodeError as e:
-                logging.error(f"UnicodeEncodeError: {e}")
-                return "", prompt_timestamp, datetime.now()
-
-            if not response.ok:
-                response_json = response.json()
-                self._handle_error(response, response_json, "Yandex native async")
-                return "", prompt_timestamp, datetime.now()
-
-            response_json = response.json()
-            if response_json.get("done"):
-                if response_json.get("error"):
-                    self._handle_error(
-                        response, response_json, "Yandex native async"
-                    )
-                    return "", prompt_timestamp, datetime.now()
-                answer_timestamp = datetime.now()
-                response_body = response_json.get("response", {})
-                result = ""
-                alternatives = response_body.get("alternatives")
-                if alternatives is None:
-                    alternatives = response_body.get("result", {}).get(
-                        "alternatives", []
-                    )
-                for entry in alternatives:
-                    message = entry.get("message", {})
-                    result += message.get("text", "")
-                return result, prompt_timestamp, answer_timestamp
-
-            time.sleep(poll_interval_seconds)
-
-        logging.error("Timed out waiting for Yandex async operation to complete.")
-        return "", prompt_timestamp, datetime.now()
-
-    def _yandex_async_endpoint(self, endpoint: str) -> str:
-        if endpoint.endswith("completionAsync"):
-            return endpoint
-        if endpoint.endswith("/completion"):
-            return f"{endpoint}Async"
-        return "https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync"
+                break
+            self._use_target(provider, model)
+            error_count = len(self.request_errors)
+            started = time.monotonic()
+            answer, prompt_timestamp, answer_timestamp = self.send_prompt(
+                prompt, system_message
+            )
+            latency_ms = round((time.monotonic() - started) * 1000)
+            if not answer and self._deadline_passed():
+                # Cut short by the deadline: not a failure of the model.
+                for error in self.request_errors[error_count:]:
+                    error["target"] = None
+            elif on_attempt:
+                on_attempt(provider, model, bool(answer), latency_ms)
+            if answer:
+                self.last_latency_ms = latency_ms
+                if index or always_label:
+                    self.answered_by = self._current_model_label()
+                break
+            if len(targets) > 1:
+                for error in self.request_errors[error_count:]:
+                    error["provider"] = f"{error['provider']} ({model})"
+        self.request_deadline = None
+        return answer, prompt_timestamp, answer_timestamp
 
-    def _yandex_operation_endpoint(self, operation_id: str) -> str:
-        return f"https://operation.api.cloud.yandex.net/operations/{operation_id}"
+    def _request_timeout(self) -> float:
+        """
+        Timeout for the next HTTP call: the configured request timeout, cut
+        down to what is left of the fallback deadline.
+        """
+        if self.request_deadline is None:
+            return self.request_timeout_seconds
+        remaining = self.request_deadline - time.monotonic()
+        return max(1.0, min(self.request_timeout_seconds, remaining))
+
+    def _deadline_passed(self) -> bool:
+        return (
+            self.request_deadline is not None
+            and time.monotonic() >= self.request_deadline
+        )
 
-    def _send_request(
-        self,
-        url: str,
-        headers: dict,
-        body: dict,
-        provider_label: str,
-        stream: bool = False,
+    def send_prompt(
+        self, prompt: str, system_message: str
     ) -> Tuple[str, datetime, datetime]:
-        data = json.dumps(body)
-        prompt_timestamp = datetime.now()
-        logging.debug(f"Sending request with data: {data}")
-        try:
-            response = requests.request(
-                "POST", url, headers=headers, data=data, proxies=PROXIES, stream=stream
-            )
-        except UnicodeEncodeError as e:
-            logging.error(f"UnicodeEncodeError: {e}")
-            return "", prompt_timestamp, datetime.now()
-
-        logging.debug(f"Response: {response}")
-        answer_timestamp = datetime.now()
+        """
+        Query the selected provider end-point. Answers cut off by the output
+        token limit are continued with follow-up requests and stitched.
+        """
+        self.partial_answer = ""
+        self.partial_response_id = ""
+        answer, prompt_timestamp, answer_timestamp = self.backend.send(
+            prompt, system_message
+        )
+        continuations = 0
+        usage, ttft_ms = self.last_usage, self.last_ttft_ms
+        self.first_call_usage = usage
+        while (
+            answer
+            and self.answer_truncated
+            and self.auto_continue
+            and continuations < self.max_continuations
+            and not self._deadline_passed()
+        ):
+            continuations += 1
+            logging.info(f"Answer was truncated, continuation {continuations}")
+            self.partial_answer = answer
+            self.partial_response_id = self.last_response_id
+            error_count = len(self.request_errors)
+            more, _, continued_timestamp = self.backend.send(prompt, system_message)
+            usage = self._merge_usage(usage, self.last_usage)
+            if not more:
+                logging.warning("Continuation failed, keeping the partial answer")
+                del self.request_errors[error_count:]
+                break
+            answer = self._stitch_answer(answer, more)
+            answer_timestamp = continued_timestamp
+        self.partial_answer = ""
+        self.last_usage, self.last_ttft_ms = usage, ttft_ms
+        if answer:
+            self._record_usage(prompt, system_message, answer)
+        return answer, prompt_timestamp, answer_timestamp
+
+    def _record_usage(self, prompt: str, system_message: str, answer: str) -> None:
+        """
+        Add the call to the usage ledger. Providers that report no usage are
+        recorded with estimated token counts.
+        """
+        usage = self.last_usage
+        if not usage.get("prompt_tokens") and not usage.get("completion_tokens"):
+            usage = {
+                "prompt_tokens": self.prompt_token_estimate
+                or self._estimate_tokens(f"{system_message}\n{prompt}"),
+                "completion_tokens": self._estimate_tokens(answer),
+            }
+        self.last_spend = self.usage_ledger.record(
+            self.prompt_keyword, self.provider, self._current_model_name(), usage
+        )
+        if self.last_spend:
+            self.budget_guard.add(self.last_spend["currency"], self.last_spend["cost"])
 
-        result = ""
-        if stream:
-            result = self._consume_openai_stream(response)
-        else:
-            response_json = response.json()
-            if response.ok:
-                for entry in response_json.get("choices", []):
-                    message = entry.get("message", {})
-                    result += message.get("content", "")
-            else:
-                self._handle_error(response, response_json, provider_label)
-        return result, prompt_timestamp, answer_timestamp
+    def _stitch_answer(self, answer: str, continuation: str) -> str:
+        """
+        Join a continuation to the partial answer, dropping text the model
+        repeated from the end of the partial answer.
+        """
+        tail = answer[-200:]
+        for size in range(min(len(tail), len(continuation)), 7, -1):
+            if continuation.startswith(tail[-size:]):
+                return answer + continuation[size:]
+        return answer + continuation
+
+    def _merge_usage(self, first: dict, second: dict) -> dict:
+        if not first or not second:
+            return first or second
+        return {
+            key: first.get(key, 0) + second.get(key, 0)
+            for key in first.keys() | second.keys()
+        }
 
-    def _consume_openai_stream(self, response) -> str:
-        if not response.ok:
-            response_json = response.json()
-            self._handle_error(response, response_json, "Streaming request")
-            return ""
-        result = ""
-        for line in response.iter_lines(decode_unicode=True):
-            if not line:
-                continue
-            line = line.strip()
-            if line.startswith("data:"):
-                line = line[len("data:") :].strip()
-            if not line or line == "[DONE]":
-                break
-            try:
-                payload = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            for entry in payload.get("choices", []):
-                delta = entry.get("delta", {})
-                if delta:
-                    result += delta.get("content", "")
-                else:
-                    message = entry.get("message", {})
-                    result += message.get("content", "")
-        return result
+    def _capture_usage(self, usage) -> None:
+        """
+        Normalize OpenAI-style and Yandex usage blocks into self.last_usage.
+        """
+        if not isinstance(usage, dict):
+            return
 
-    def _consume_yandex_stream(self, response) -> str:
-        if not response.ok:
-            response_json = response.json()
-            self._handle_error(response, response_json, "Yandex native streaming")
-            return ""
-        result = ""
-        last_message_text = ""
-        for line in response.iter_lines(decode_unicode=True):
-            if not line:
-                continue
-            line = line.strip()
-            if line.startswith("data:"):
-                line = line[len("data:") :].strip()
-            if not line:
-                continue
-            try:
-                payload = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            alternatives = payload.get("result", {}).get("alternatives", [])
-            for entry in alternatives:
-                message = entry.get("message", {})
-                message_text = message.get("text", "")
-                if not message_text:
+        def count(*keys) -> int:
+            for key in keys:
+                try:
+                    return int(usage[key])
+                except (KeyError, TypeError, ValueError):
                     continue
-                if message_text.startswith(last_message_text):
-                    result += message_text[len(last_message_text) :]
-                else:
-                    result += message_text
-                last_message_text = message_text
-        return result
+            return 0
+
+        self.last_usage = {
+            "prompt_tokens": count("prompt_tokens", "inputTextTokens", "input_tokens"),
+            "completion_tokens": count(
+                "completion_tokens", "completionTokens", "output_tokens"
+            ),
+            "total_tokens": count("total_tokens", "totalTokens"),
+        }
+        for details_key in ("prompt_tokens_details", "input_tokens_details"):
+            details = usage.get(details_key)
+            if isinstance(details, dict) and details.get("cached_tokens"):
+                self.last_usage["cached_tokens"] = int(details["cached_tokens"])
 
     def _handle_error(self, response, response_json: dict, provider_label: str) -> None:
+        error = response_json.get("error")
+        if isinstance(error, dict):
+            error = error.get("message")
         error_message = (
-            response_json.get("error", {}).get("message")
-            or response_json.get("message")
-            or "Unknown error"
+            error or response_json.get("message") or response.reason or "Unknown error"
+        )
+        self.request_errors.append(
+            {
+                "provider": provider_label,
+                "status": response.status_code,
+                "message": error_message,
+                "target": (self.provider, self._current_model_name()),
+            }
         )
-        self.add_item(title="An error occurred", subtitle=error_message)
         logging.error(
             f"{provider_label} API returned {response.status_code} with message: {response_json}"
         )
 
-    def _openai_headers(self) -> dict:
-        return {
-            "Authorization": "Bearer " + self.api_key,
-            "Content-Type": "application/json",
-        }
-
-    def _yandex_headers(self) -> dict:
-        token = self._yandex_token()
-        headers = {
-            "Authorization": f"{self._yandex_auth_prefix()} {token}",
-            "Content-Type": "application/json",
-        }
-        if self.yandex_folder_id:
-            headers["x-folder-id"] = self.yandex_folder_id
-        return headers
+    def _record_request_error(
+        self, provider_label: str, message: str, model_failed: bool = True
+    ) -> None:
+        """
+        Keep an error for the results; with model_failed, it also counts as
+        a failure of the current model in the request statistics.
+        """
+        target = (self.provider, self._current_model_name()) if model_failed else None
+        self.request_errors.append(
+            {"provider": provider_label, "message": message, "target": target}
+        )
+        logging.error(f"{provider_label} request failed: {message}")
 
-    def _openai_body(
-        self, prompt: str, system_message: str, model: str, stream: bool
-    ) -> dict:
-        return {
-            "model": model,
-            "messages": [
+    def _report_request_errors(self) -> None:
+        """
+        Show the errors of a request that produced no answer. They are only
+        reported at the end so a later fallback can still succeed silently.
+        """
+        for error in self.request_errors:
+            subtitle = error["message"]
+            if len(self.request_errors) > 1:
+                subtitle = f"{error['provider']}: {subtitle}"
+            self.add_item(title="An error occurred", subtitle=subtitle)
+
+    def _context_messages(self, text_key: str) -> list:
+        messages = []
+        if self.context_summary:
+            messages.append(
                 {
                     "role": "system",
-                    "content": system_message,
-                },
-                {"role": "user", "content": prompt},
-            ],
-            "stream": stream,
-        }
+                    text_key: "Summary of the earlier conversation:\n"
+                    + self.context_summary,
+                }
+            )
+        for turn in self.context_turns:
+            messages.append({"role": "user", text_key: turn.get("prompt", "")})
+            messages.append({"role": "assistant", text_key: turn.get("answer", "")})
+        return messages
+
+    def _load_context_turns(self, prompt_keyword: str) -> list:
+        self.context_summary = ""
+        if not self.conversation_context:
+            return []
+        max_age_seconds = self.conversation_timeout_minutes * 60
+        read_budget = self.context_token_budget
+        after_ts = None
+        if self.context_summary_enabled:
+            summary = self.conversation_store.load_summary(
+                prompt_keyword, max_age_seconds
+            )
+            if summary:
+                self.context_summary = summary.get("summary", "")
+                after_ts = summary.get("until_ts")
+            read_budget = max(read_budget, self.summary_threshold_tokens)
+        turns, truncated = self.conversation_store.recent_turns(
+            prompt_keyword,
+            read_budget,
+            self._estimate_tokens,
+            max_age_seconds,
+            after_ts,
+        )
+        if self.context_summary_enabled and truncated:
+            self._start_background("compact_conversation", [prompt_keyword])
+        return self._fit_context_budget(turns)
+
+    def _fit_context_budget(self, turns: list) -> list:
+        window = []
+        used_tokens = 0
+        for turn in reversed(turns):
+            used_tokens += self._estimate_tokens(
+                turn.get("prompt", "")
+            ) + self._estimate_tokens(turn.get("answer", ""))
+            if used_tokens > self.context_token_budget:
+                break
+            window.append(turn)
+        window.reverse()
+        return window
 
-    def _yandex_auth_prefix(self) -> str:
-        return "Api-Key" if self.yandex_auth_type == "api_key" else "Bearer"
-
-    def _yandex_token(self) -> str:
-        if self.yandex_auth_type == "iam_token":
-            return self.yandex_iam_token or ""
-        return self.yandex_api_key or ""
-
-    def _yandex_model_uri(self) -> str:
-        model = self._yandex_model_raw()
-        if model.startswith("gpt://"):
-            return model
-        if self.yandex_folder_id:
-            return f"gpt://{self.yandex_folder_id}/{model}"
-        return ""
-
-    def _yandex_model_raw(self) -> str:
-        preset = (self.yandex_model_preset or "").strip()
-        custom = (self.yandex_model_custom or "").strip()
-        if preset and preset != "custom":
-            return preset
-        if custom:
-            return custom
-        return (self.yandex_model or "").strip()
-
-    def _yandex_model_value(self) -> str:
-        return self._yandex_model_uri() or self._yandex_model_raw()
+    def _start_background(self, method: str, parameters: list) -> None:
+        """
+        Run a plugin method in a detached plugin process so the current
+        query does not wait for it (e.g. summarizing evicted turns).
+        """
+        request = json.dumps({"method": method, "parameters": parameters})
+        if os.name == "nt":
+            options = {"creationflags": subprocess.CREATE_NO_WINDOW}
+        else:
+            options = {"start_new_session": True}
+        try:
+            subprocess.Popen(
+                [sys.executable, os.path.join(os.getcwd(), "main.py"), request],
+                cwd=os.getcwd(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                **options,
+            )
+        except OSError as error:
+            logging.error(f"Failed to start {method} in the background: {error}")
 
-    def _current_model_label(self) -> str:
-        if self.provider == "openai":
-            return self.model
-        model_label = self._yandex_model_raw() or self.yandex_model
-        if self.provider == "yandex_openai":
-            return f"{model_label} (OpenAI-compatible)"
-        return f"{model_label} (native)"
+    def build_conversation_index(self, text: str = "") -> None:
+        """
+        Create the conversation index and index the exchanges saved so far in
+        the background, then search again for text.
+        """
+        if self.conversation_index.claim_backfill():
+            self._start_background("index_conversations", [])
+        self.change_query(f"{self.user_keyword} find {text}", requery=True)
 
-    def _current_request_mode_label(self) -> str:
-        if self.provider == "openai":
-            mode = self.openai_request_mode
-        else:
-            mode = self.yandex_request_mode
-        if mode == "sync":
-            return "sync (blocking)"
-        if self.provider == "yandex_native":
-            return "async (operation)"
-        return "async (streaming)"
+    def index_conversations(self) -> None:
+        """
+        Add the exchanges saved before the conversation index existed.
+        """
+        self.conversation_index.backfill(self._saved_exchanges())
 
-    def _ensure_auth(self) -> bool:
-        if self.provider == "openai":
-            if not self.api_key:
+    def compact_conversation(self, prompt_keyword: str) -> None:
+        """
+        Fold the turns that no longer fit the context window into the rolling
+        summary of the keyword's conversation.
+        """
+        store = self.conversation_store
+        if not store.acquire_summary_lock(prompt_keyword):
+            return
+        self.prompt_keyword = prompt_keyword
+        try:
+            max_age_seconds = self.conversation_timeout_minutes * 60
+            summary = store.load_summary(prompt_keyword, max_age_seconds) or {}
+            turns, _ = store.recent_turns(
+                prompt_keyword,
+                self.summary_threshold_tokens * 4,
+                self._estimate_tokens,
+                max_age_seconds,
+                summary.get("until_ts"),
+            )
+            evicted = turns[: len(turns) - len(self._fit_context_budget(turns))]
+            if not evicted:
+                return
+            for provider, model in self._parse_model_targets(self.summary_model)[:1]:
+                self._use_target(provider, model)
+            if not self._has_credentials(self.provider):
+                logging.error(f"No credentials for summary provider {self.provider}")
+                return
+            self.openai_request_mode = "sync"
+            self.yandex_request_mode = self.local_request_mode = "sync"
+            self.context_turns = []
+            self.context_summary = ""
+            transcript = "\n".join(
+                f"User: {turn.get('prompt', '')}\nAssistant: {turn.get('answer', '')}"
+                for turn in evicted
+            )
+            if summary.get("summary"):
+                transcript = (
+                    f"Previous summary:\n{summary['summary']}\n\n"
+                    f"New messages:\n{transcript}"
+                )
+            self.prompt_token_estimate = self._estimate_tokens(
+                f"{SUMMARY_SYSTEM_MESSAGE}\n{transcript}"
+            )
+            if self._budget_blocks(self.provider, self._current_model_name()):
+                logging.warning("Conversation summary skipped: budget exhausted")
+                return
+            text, _, _ = self.send_prompt(transcript, SUMMARY_SYSTEM_MESSAGE)
+            if text.strip():
+                store.save_summary(prompt_keyword, text.strip(), evicted[-1]["ts"])
+        finally:
+            store.release_summary_lock(prompt_keyword)
+
+    def _estimate_tokens(self, text: str) -> int:
+        return self.token_estimator.estimate(text, self._sizing_model())
+
+    def _sizing_model(self) -> str:
+        """
+        Model whose tokenizer and context window size the request: the
+        configured model, or for "auto" the candidate the router ranked first.
+        """
+        model = self._current_model_name()
+        if model == AUTO_MODEL and self.auto_ranking:
+            return self.auto_ranking[0]["model"]
+        return model
+
+    def _route_auto_model(self, prompt: str, system_message: str) -> None:
+        """
+        Rank the "auto" candidates for this prompt before it is sized, so the
+        budget is that of the model expected to answer.
+        """
+        self.auto_ranking = None
+        if self._current_model_name() != AUTO_MODEL:
+            return
+        candidates = [
+            target
+            for target in self._parse_model_targets(self.auto_model_candidates)
+            if target[1] != AUTO_MODEL and self._has_credentials(target[0])
+        ]
+        self.auto_ranking = self.router.rank(
+            candidates,
+            self._estimate_request_tokens(prompt, system_message),
+            self.latency_target_ms,
+        )
+
+    def _fit_prompt_budget(self, prompt: str, system_message: str) -> Optional[str]:
+        """
+        Check the estimated request size before sending it. Context turns are
+        dropped first; then the prompt is truncated or rejected according to
+        the overlong_prompt_mode setting.
+        """
+        self._route_auto_model(prompt, system_message)
+        model = self._sizing_model()
+        limit = self._prompt_token_limit(model)
+        estimate = self._estimate_request_tokens(prompt, system_message)
+        while estimate > limit and self.context_turns:
+            self.context_turns.pop(0)
+            estimate = self._estimate_request_tokens(prompt, system_message)
+        if estimate > limit:
+            fitted = None
+            if self.overlong_prompt_mode == "truncate":
+                overhead = estimate - self._estimate_tokens(prompt)
+                fitted = truncate_to_tokens(
+                    prompt, limit - overhead, self._estimate_tokens
+                )
+            if fitted is None:
                 self.add_item(
-                    title="Unable to load the OpenAI API key",
-                    subtitle=(
-                        "Please make sure you've added a valid OpenAI API key in the settings"
-                    ),
+                    title="The prompt is too long",
+                    subtitle=f"About {estimate} tokens, the limit is {limit} tokens",
                 )
-                return False
-            return True
+                return None
+            logging.warning(f"Prompt truncated from about {estimate} tokens")
+            prompt = fitted
+            estimate = self._estimate_request_tokens(prompt, system_message)
+        self.prompt_token_estimate = estimate
+        return prompt
+
+    def _check_spend_budget(self, prompt: str, system_message: str) -> Optional[str]:
+        """
+        Compare today's and this month's spend plus the estimated cost of the
+        prompt with the configured budgets. An exhausted budget blocks the
+        request, only adds a warning, or switches to the downgrade model,
+        according to the budget_action setting.
+        """
+        exceeded = self._exceeded_budget()
+        if exceeded is None:
+            return prompt
+        period, spent, budget = exceeded
+        title = (
+            f"{period} budget of {format_cost({self.budget_currency: budget})} "
+            "is exhausted"
+        )
+        spent_text = f"Spent {format_cost({self.budget_currency: spent})}"
+        if self.budget_action == "warn":
+            self.budget_notice = self._budget_warning(exceeded)
+            return prompt
+        if self.budget_action == "downgrade":
+            for provider, model in self._parse_model_targets(
+                self.budget_downgrade_model
+            )[:1]:
+                if not self._has_credentials(provider):
+                    break
+                self._use_target(provider, model)
+                self.target_overridden = True
+                self.budget_downgraded = True
+                self.budget_notice = {
+                    "title": title,
+                    "subtitle": (
+                        f"{spent_text}; answered by {target_key(provider, model)}"
+                    ),
+                }
+                return self._fit_prompt_budget(prompt, system_message)
+        resets = "tomorrow" if period == "Daily" else "next month"
+        self.add_item(
+            title=title,
+            subtitle=f"{spent_text}; requests are blocked until {resets}",
+        )
+        return None
 
-        token = self._yandex_token()
-        if not token:
-            self.add_item(
-                title="Unable to load the Yandex token",
-                subtitle=(
-                    "Please make sure you've added a valid Yandex API key or IAM token"
-                ),
-            )
+    def _budget_warning(self, exceeded: Tuple[str, float, float]) -> dict:
+        period, spent, budget = exceeded
+        return {
+            "title": (
+                f"{period} budget of {format_cost({self.budget_currency: budget})} "
+                "is exhausted"
+            ),
+            "subtitle": (
+                f"Spent {format_cost({self.budget_currency: spent})}; "
+                "the request was sent anyway"
+            ),
+        }
+
+    def _budget_blocks(self, provider: str, model: str) -> bool:
+        """
+        Whether an exhausted budget rules out a call to provider:model that
+        was not covered by the check before the request: a fallback target
+        or a conversation summary. With budget_action "warn" the call goes
+        ahead with a notice.
+        """
+        exceeded = self._exceeded_budget(provider, model)
+        if exceeded is None:
             return False
-        if not self._yandex_model_value():
-            self.add_item(
-                title="Missing Yandex model",
-                subtitle="Please select or enter a Yandex model in the settings",
-            )
+        if self.budget_action == "warn":
+            self.budget_notice = self.budget_notice or self._budget_warning(exceeded)
             return False
-        if (
-            self.provider in ("yandex_native", "yandex_openai")
-            and not self._yandex_model_uri()
+        self._record_request_error(
+            "Budget",
+            f"Skipped {target_key(provider, model)}: "
+            f"the {exceeded[0].lower()} budget is exhausted",
+            model_failed=False,
+        )
+        return True
+
+    def _exceeded_budget(
+        self, provider: Optional[str] = None, model: Optional[str] = None
+    ) -> Optional[Tuple[str, float, float]]:
+        """
+        Return (period, spent, budget) of the first budget a call to
+        provider:model would exceed, or None. Defaults to the current target,
+        for "auto" the candidate the router ranked first. Local models and
+        models priced in another currency are not limited.
+        """
+        if not self.daily_budget and not self.monthly_budget:
+            return None
+        if provider is None:
+            provider, model = self.provider, self._current_model_name()
+            if model == AUTO_MODEL and self.auto_ranking:
+                provider = self.auto_ranking[0]["provider"]
+                model = self.auto_ranking[0]["model"]
+        currency, estimate = self.usage_ledger.prices.cost(
+            model, {"prompt_tokens": self.prompt_token_estimate}
+        )
+        if provider == "local" or currency not in (None, self.budget_currency):
+            return None
+        daily, monthly = self.budget_guard.spent(self.budget_currency)
+        for period, spent, budget in (
+            ("Daily", daily, self.daily_budget),
+            ("Monthly", monthly, self.monthly_budget),
         ):
+            if budget and spent + estimate > budget:
+                return period, spent, budget
+        return None
+
+    def _estimate_request_tokens(self, prompt: str, system_message: str) -> int:
+        texts = [system_message, self.context_summary, prompt]
+        for turn in self.context_turns:
+            texts.append(turn.get("prompt", ""))
+            texts.append(turn.get("answer", ""))
+        model = self._sizing_model()
+        self.prompt_token_estimate_model = model
+        self.prompt_token_estimate_raw = self.token_estimator.estimate_messages_raw(
+            texts, model
+        )
+        family, _ = model_limits(model)
+        return int(
+            self.prompt_token_estimate_raw * self.token_estimator.factor(family) + 0.5
+        )
+
+    def _prompt_token_limit(self, model: str) -> int:
+        if self.max_prompt_tokens:
+            return self.max_prompt_tokens
+        _, context_window = model_limits(model)
+        reserve = self.max_output_tokens or DEFAULT_MAX_OUTPUT_TOKENS
+        return max(context_window - reserve, context_window // 2)
+
+    def _max_output_tokens(self, model: str) -> Optional[int]:
+        """
+        Output token cap that still fits the model's context window. None
+        means "provider default" (only used when no limit is configured).
+        """
+        _, context_window = model_limits(model)
+        remaining = max(1, context_window - self.prompt_token_estimate)
+        if self.max_output_tokens:
+            return min(self.max_output_tokens, remaining)
+        if remaining < DEFAULT_MAX_OUTPUT_TOKENS:
+            return remaining
+        return None
+
+    def _calibrate_token_estimator(self) -> None:
+        """
+        Correct the estimator with the prompt tokens the provider counted.
+        Answers from a fallback model are skipped: the estimate was made for
+        another model's tokenizer.
+        """
+        if self._current_model_name() != self.prompt_token_estimate_model:
+            return
+        # Continuations resend the prompt, so only the first call's count
+        # matches the estimate.
+        actual_tokens = self.first_call_usage.get("prompt_tokens")
+        if actual_tokens and self.prompt_token_estimate_raw:
+            self.token_estimator.calibrate(
+                self._current_model_name(),
+                self.prompt_token_estimate_raw,
+                actual_tokens,
+            )
+
+    @property
+    def backend(self):
+        return self.backends[self.provider]
+
+    def _use_target(self, provider: str, model: str) -> None:
+        self.provider = provider
+        if model:
+            self.backend.use_model(model)
+
+    def _parse_model_targets(self, value: str) -> list:
+        """
+        Parse a list of "provider:model" targets separated by commas or "->".
+        A target without a known provider prefix uses the current provider.
+        """
+        targets = []
+        for token in re.split(r",|->", value or ""):
+            token = token.strip()
+            if not token:
+                continue
+            provider, separator, model = token.partition(":")
+            if separator and provider.strip().lower() in PROVIDERS:
+                targets.append((provider.strip().lower(), model.strip()))
+            else:
+                targets.append((self.provider, token))
+        return targets
+
+    def _current_model_name(self) -> str:
+        return self.backend.model_name()
+
+    def _has_credentials(self, provider: str) -> bool:
+        backend = self.backends.get(provider)
+        return backend is not None and backend.has_credentials()
+
+    def _current_model_label(self) -> str:
+        return self.backend.model_label()
+
+    def _current_request_mode_label(self) -> str:
+        return self.backend.request_mode_label()
+
+    def _ensure_auth(self) -> bool:
+        if self.provider not in self.backends:
             self.add_item(
-                title="Missing Yandex Folder ID",
-                subtitle=(
-                    "Please provide a folder ID or use a full model URI "
-                    "(gpt://<folder-id>/<model>)"
-                ),
+                title=f"Unknown provider '{self.provider}'",
+                subtitle="Please select a provider in the settings",
             )
             return False
+        error = self.backend.auth_error()
+        if error:
+            title, subtitle = error
+            self.add_item(title=title, subtitle=subtitle)
+            return False
         return True
 
     def save_conversation(
@@ -580,29 +1587,116 @@ class AliceAI(Flox):
         answer: str,
         answer_timestamp: datetime,
     ) -> str:
-        filename = f"Conversations '{keyword}' keyword.txt"
+        filename = self._conversation_filename(keyword)
         formatted_prompt_timestamp = prompt_timestamp.strftime("%Y-%m-%d %H:%M:%S")
         formatted_answer_timestamp = answer_timestamp.strftime("%Y-%m-%d %H:%M:%S")
         new_content = f"[{formatted_prompt_timestamp}] User: {prompt}\n[{formatted_answer_timestamp}] AliceAI: {answer}\n\n"  # noqa: E501
 
-        if os.path.exists(filename):
-            try:
-                with open(filename, "r", encoding="utf-8") as file:
-                    existing_content = file.read()
-            except PermissionError:
-                logging.error(PermissionError)
+        try:
+            with locked(filename):
+                try:
+                    with open(filename, "r", encoding="utf-8") as file:
+                        existing_content = file.read()
+                except FileNotFoundError:
+                    existing_content = ""
+                if self._archive_conversation(keyword, existing_content):
+                    existing_content = ""
+                new_content = new_content + existing_content
+                write_atomic(
+                    filename, new_content.replace("\n", os.linesep).encode("utf-8")
+                )
+        except OSError as error:
+            logging.error(f"Failed to save conversation: {error}")
         else:
-            existing_content = ""
+            self.conversation_index.add(
+                keyword,
+                prompt_timestamp.replace(microsecond=0).timestamp(),
+                prompt,
+                answer,
+            )
+
+        return filename
+
+    def _archive_conversation(self, keyword: str, content: str) -> bool:
+        """
+        Move a conversation file that reached the archive segment size or
+        age into a compressed archive segment, if conversations are archived.
+        Returns True if it was moved.
+        """
+        if not self.archive_conversations:
+            return False
+        timestamps = CONVERSATION_TIMESTAMP.findall(content)
+        if not timestamps:
+            return False
+        end, start = (
+            datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+            for timestamp in (timestamps[0], timestamps[-1])
+        )
+        data = content.replace("\n", os.linesep).encode("utf-8")
+        if not self.archive.segment_full(len(data), time.time() - start):
+            return False
+        try:
+            self.archive.add_segment(
+                f"{CONVERSATION_STREAM_PREFIX}{keyword}",
+                data,
+                start,
+                end,
+                len(timestamps),
+            )
+        except OSError as error:
+            logging.error(f"Failed to archive conversation: {error}")
+            return False
+        return True
 
-        new_content = new_content + existing_content
+    def _saved_exchanges(self) -> Iterator[Tuple[str, float, str, str]]:
+        """
+        Yield (keyword, timestamp, prompt, answer) for every exchange in the
+        conversation files and their archive segments, oldest first.
+        """
+        keywords = {
+            match.group(1)
+            for match in map(CONVERSATION_FILE_PATTERN.match, glob.glob("*.txt"))
+            if match
+        }
+        keywords.update(
+            stream[len(CONVERSATION_STREAM_PREFIX) :]
+            for stream in self.archive.streams()
+            if stream.startswith(CONVERSATION_STREAM_PREFIX)
+        )
+        yield from heapq.merge(
+            *(self._saved_keyword_exchanges(keyword) for keyword in keywords),
+            key=lambda exchange: exchange[1],
+        )
 
+    def _saved_keyword_exchanges(
+        self, keyword: str
+    ) -> Iterator[Tuple[str, float, str, str]]:
+        stream = f"{CONVERSATION_STREAM_PREFIX}{keyword}"
+        for segment in reversed(self.archive.segments(stream)):
+            content = self.archive.read(segment).decode("utf-8", errors="replace")
+            yield from self._parse_saved_exchanges(keyword, content)
         try:
-            with open(filename, "w", encoding="utf-8") as file:
-                file.write(new_content)
-        except PermissionError:
-            logging.error(PermissionError)
+            with open(
+                self._conversation_filename(keyword), "r", encoding="utf-8"
+            ) as file:
+                content = file.read()
+        except OSError:
+            return
+        yield from self._parse_saved_exchanges(keyword, content)
 
-        return filename
+    def _parse_saved_exchanges(
+        self, keyword: str, content: str
+    ) -> Iterator[Tuple[str, float, str, str]]:
+        content = content.replace("\r\n", "\n")
+        for timestamp, prompt, answer in reversed(parse_exchanges(content)):
+            try:
+                ts = datetime.strptime(timestamp, CONVERSATION_TIME_FORMAT).timestamp()
+            except ValueError:
+                continue
+            yield keyword, ts, prompt, answer
+
+    def _conversation_filename(self, keyword: str) -> str:
+        return f"Conversations '{keyword}' keyword.txt"
 
     def split_prompt(self, query: str) -> Tuple[str, str, str]:
         prompt = query.rstrip(self.prompt_stop).strip()
@@ -614,7 +1708,7 @@ class AliceAI(Flox):
         for row in self.prompts:
             if row["Key Word"] == prompt_keyword:
                 system_message = row["System Message"]
-                prompt = prompt.split(" ", 1)[1]
+                prompt = prompt.split(" ", 1)[-1]
 
         if not system_message:
             prompt_keyword = self.default_system_prompt
@@ -638,6 +1732,61 @@ class AliceAI(Flox):
 
         return prompt, prompt_keyword, system_message
 
+    def _apply_generation_profile(self, prompt_keyword: str) -> bool:
+        """
+        Apply the optional generation columns of the keyword's CSV row
+        (Provider, Model, Max Tokens, Temperature, Reasoning Effort, Latency
+        Target).
+        Returns True when the provider was switched.
+        """
+        row = next(
+            (row for row in self.prompts or [] if row["Key Word"] == prompt_keyword),
+            {},
+        )
+        provider = (row.get("Provider") or "").strip().lower()
+        model = (row.get("Model") or "").strip()
+        switched = False
+        if (provider or model) and not self.target_overridden:
+            if provider and provider not in PROVIDERS:
+                logging.error(f"Unknown provider '{provider}' for '{prompt_keyword}'")
+            else:
+                switched = bool(provider) and provider != self.provider
+                self._use_target(provider or self.provider, model)
+        max_tokens = self._parse_int_setting(row.get("Max Tokens"), 0)
+        if max_tokens:
+            self.max_output_tokens = max_tokens
+        try:
+            self.temperature = float(str(row.get("Temperature")).replace(",", "."))
+        except ValueError:
+            self.temperature = None
+        self.reasoning_effort = (row.get("Reasoning Effort") or "").strip().lower()
+        self.latency_target_ms = self._parse_int_setting(
+            row.get("Latency Target"), self.auto_latency_target_ms
+        )
+        return switched
+
+    def _reasoning_effort_for(self, model: str) -> str:
+        """
+        Map the profile's reasoning effort onto what the OpenAI model accepts.
+        """
+        effort = self.reasoning_effort
+        name = (model or "").lower()
+        if not effort:
+            return ""
+        if not name.startswith(("gpt-5", "o1", "o3", "o4")):
+            return ""
+        if name.startswith("gpt-5-pro"):
+            return "high"
+        if name.startswith("gpt-5") and "-pro" in name:
+            return effort if effort in ("medium", "high") else "medium"
+        if name.startswith(("gpt-5.1", "gpt-5.2")):
+            return "none" if effort == "minimal" else effort
+        if name.startswith("gpt-5") and effort == "none":
+            return "minimal"
+        if name.startswith(("o1", "o3", "o4")) and effort in ("none", "minimal"):
+            return "low"
+        return effort
+
     def _apply_custom_system_prompt(self, system_message: str) -> str:
         custom_prompt = self.custom_system_prompt.strip()
         if not custom_prompt:
@@ -653,6 +1802,21 @@ class AliceAI(Flox):
             return fallback
         return parsed if parsed > 0 else fallback
 
+    def _parse_limit_setting(self, value, fallback: int) -> int:
+        """
+        Like _parse_int_setting, but 0 is kept: it turns the limit off.
+        """
+        if str(value).strip() == "0":
+            return 0
+        return self._parse_int_setting(value, fallback)
+
+    def _parse_float_setting(self, value, fallback: float) -> float:
+        try:
+            parsed = float(str(value).replace(",", "."))
+        except (TypeError, ValueError):
+            return fallback
+        return parsed if parsed > 0 else fallback
+
     def _parse_bool_setting(self, value, fallback: bool) -> bool:
         if value is None:
             return fallback
@@ -678,7 +1842,6 @@ class AliceAI(Flox):
     ) -> None:
         if self.request_history_limit <= 0:
             return
-        history_file = os.path.join(os.getcwd(), "request_history.json")
         entry = {
             "prompt_keyword": prompt_keyword,
             "prompt": prompt,
@@ -688,65 +1851,83 @@ class AliceAI(Flox):
             "model": self._current_model_label(),
             "prompt_timestamp": prompt_timestamp.isoformat(),
             "answer_timestamp": answer_timestamp.isoformat(),
+            "prompt_tokens_estimate": self.prompt_token_estimate,
         }
-        history = []
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, "r", encoding="utf-8") as file:
-                    history = json.load(file)
-            except (json.JSONDecodeError, OSError):
-                history = []
-        if not isinstance(history, list):
-            history = []
-        history.insert(0, entry)
-        history = history[: self.request_history_limit]
-        try:
-            with open(history_file, "w", encoding="utf-8") as file:
-                json.dump(history, file, ensure_ascii=False, indent=2)
-        except OSError as error:
-            logging.error(f"Failed to write request history: {error}")
+        if self.last_usage:
+            entry["usage"] = self.last_usage
+        if self.last_response_id:
+            entry["response_id"] = self.last_response_id
+        self.request_history.add(entry, self.request_history_limit)
+        if answer and self.recall_index_limit > 0:
+            self.prompt_index.add(
+                prompt_timestamp.timestamp(), prompt_keyword, prompt, answer
+            )
+            if not self.prompt_index.exists():
+                self._start_background("seed_prompt_index", [])
 
     def ellipsis(self, string: str, length: int):
         string = string.split("\n", 1)[0]
         return string[: length - 3] + "..." if len(string) > length else string
 
     def _build_answer_actions(
-        self, prompt: str, answer: str, filename: Optional[str], short_answer: str
+        self,
+        prompt: str,
+        answer: str,
+        filename: Optional[str],
+        short_answer: str,
+        prompt_keyword: str = "",
+    ) -> list:
+        """
+        Build the primary answer result. Secondary actions are computed on
+        demand in context_menu from the stored answer.
+        """
+        if not answer:
+            return []
+        answer_id = self.answer_store.put(prompt, answer)
+        actions = self._answer_action_definitions(answer_id, filename, short_answer)
+        if not actions:
+            return []
+        primary = actions[0]
+        primary["context"] = [answer_id, filename, prompt_keyword]
+        if primary["method"] == self.display_answer:
+            primary["Preview"] = {
+                "Description": self._format_action_text(
+                    prompt, answer, self.preview_action_mode
+                )
+            }
+        return [primary]
+
+    def _answer_action_definitions(
+        self, answer_id: str, filename: Optional[str], short_answer: str
     ) -> list:
         action_order = self._parse_action_order(self.answer_action_order)
-        action_text = {
-            "copy": self._format_action_text(prompt, answer, self.copy_action_mode),
-            "preview": self._format_action_text(
-                prompt, answer, self.preview_action_mode
-            ),
-            "editor": self._format_action_text(
-                prompt, answer, self.editor_action_mode
-            ),
-        }
+        subtitle = f"Answer: {short_answer}"
+        if self.answered_by:
+            subtitle = f"{subtitle} | via {self.answered_by}"
         action_definitions = {
             "copy": {
                 "title": "Copy to clipboard",
-                "subtitle": f"Answer: {short_answer}",
+                "subtitle": subtitle,
                 "method": self.copy_answer,
-                "parameters": [action_text["copy"]],
+                "parameters": [answer_id, self.copy_action_mode],
                 "enabled": self.enable_copy_action,
             },
             "preview": {
                 "title": "Preview answer",
-                "subtitle": f"Answer: {short_answer}",
+                "subtitle": subtitle,
                 "method": self.display_answer,
-                "parameters": [action_text["preview"]],
+                "parameters": [answer_id, self.preview_action_mode],
                 "enabled": self.enable_preview_action,
                 "dont_hide": True,
-                "Preview": {"Description": action_text["preview"]},
             },
             "editor": {
                 "title": "Open in text editor",
-                "subtitle": f"Answer: {short_answer}",
+                "subtitle": self._editor_subtitle(subtitle, filename),
                 "method": self.open_in_editor,
                 "parameters": [
                     filename,
-                    action_text["editor"],
+                    answer_id,
+                    self.editor_action_mode,
                     self.editor_open_mode,
                 ],
                 "enabled": self.enable_editor_action,
@@ -757,13 +1938,81 @@ class AliceAI(Flox):
             action = action_definitions.get(action_id)
             if not action or not action["enabled"]:
                 continue
-            if not action_text.get(action_id):
-                continue
             action_payload = dict(action)
             action_payload.pop("enabled", None)
             actions.append(action_payload)
         return actions
 
+    def context_menu(self, data) -> None:
+        """
+        Secondary actions for an answer result, resolved from the answer store.
+        """
+        if not isinstance(data, list) or not data:
+            return
+        answer_id = data[0]
+        filename = data[1] if len(data) > 1 else None
+        prompt_keyword = data[2] if len(data) > 2 else ""
+        if len(data) > 3:
+            self._store_recalled_answer(data[3], answer_id)
+        record = self.answer_store.get(answer_id)
+        if not record:
+            self.add_item(
+                title="Answer is no longer available",
+                subtitle="Send the prompt again to get a new answer",
+            )
+            return
+        answer = record.get("answer", "")
+        short_answer = self.ellipsis(answer, 30)
+
+        for action in self._answer_action_definitions(
+            answer_id, filename, short_answer
+        )[1:]:
+            self.add_item(**action)
+
+        if self.copy_action_mode != "prompt_and_answer":
+            self.add_item(
+                title="Copy prompt and answer",
+                subtitle=f"Prompt: {self.ellipsis(record.get('prompt', ''), 30)}",
+                method=self.copy_answer,
+                parameters=[answer_id, "prompt_and_answer"],
+            )
+
+        for index, (language, code) in enumerate(self._extract_code_blocks(answer)):
+            self.add_item(
+                title=f"Copy code block {index + 1}"
+                + (f" ({language})" if language else ""),
+                subtitle=self.ellipsis(code.strip(), 60),
+                method=self.copy_code_block,
+                parameters=[answer_id, index],
+            )
+
+        if self.conversation_context:
+            self.add_item(
+                title="Start a new conversation",
+                subtitle=f"Forget previous '{prompt_keyword}' prompts as context",
+                method=self.reset_conversation,
+                parameters=[prompt_keyword],
+            )
+
+        current_target = (self.provider, self._current_model_name())
+        for provider, model in self._parse_model_targets(self.rerun_models):
+            if (provider, model) == current_target:
+                continue
+            if not self._has_credentials(provider):
+                continue
+            self.add_item(
+                title=f"Re-run with {model}",
+                subtitle=f"Provider: {provider}",
+                method=self.rerun_with_model,
+                parameters=[answer_id, prompt_keyword, provider, model],
+            )
+
+    def _extract_code_blocks(self, answer: str) -> list:
+        return [
+            (match.group(1), match.group(2))
+            for match in CODE_BLOCK_PATTERN.finditer(answer or "")
+        ]
+
     def _parse_action_order(self, value: str) -> list:
         known = ["copy", "preview", "editor"]
         tokens = [token.strip().lower() for token in (value or "").split(",")]
@@ -787,18 +2036,53 @@ class AliceAI(Flox):
             return f"Prompt:\n{prompt}\n\nAnswer:\n{answer}"
         return answer
 
-    def copy_answer(self, text: str) -> None:
+    def _resolve_action_text(self, answer_id: str, mode: str) -> str:
+        record = self.answer_store.get(answer_id)
+        if not record:
+            return ""
+        return self._format_action_text(
+            record.get("prompt", ""), record.get("answer", ""), mode
+        )
+
+    def copy_answer(self, answer_id: str, mode: str = "answer_only") -> None:
         """
         Copy answer to the clipboard.
         """
+        text = self._resolve_action_text(answer_id, mode)
         if not text:
             return
         pyperclip.copy(text)
 
+    def copy_found_answer(self, exchange_id: int) -> None:
+        """
+        Copy the answer of an exchange found by "find" to the clipboard.
+        """
+        exchange = self.conversation_index.get(exchange_id)
+        if not exchange:
+            return
+        pyperclip.copy(
+            self._format_action_text(
+                exchange["prompt"], exchange["answer"], self.copy_action_mode
+            )
+        )
+
+    def _editor_subtitle(self, subtitle: str, filename: Optional[str]) -> str:
+        """
+        Note that the saved conversation only holds the newest messages once
+        older ones were moved to the archive.
+        """
+        match = CONVERSATION_FILE_PATTERN.match(os.path.basename(filename or ""))
+        if match and self.archive.segments(
+            f"{CONVERSATION_STREAM_PREFIX}{match.group(1)}"
+        ):
+            return f"{subtitle} | older messages are in the archive folder"
+        return subtitle
+
     def open_in_editor(
         self,
         filename: Optional[str],
-        text: Optional[str],
+        answer_id: Optional[str],
+        mode: str = "answer_only",
         open_mode: str = "saved_if_available",
     ) -> None:
         """
@@ -809,6 +2093,7 @@ class AliceAI(Flox):
             webbrowser.open(filename)
             return
 
+        text = self._resolve_action_text(answer_id, mode)
         if text:
             temp_file = "temp_answer.txt"
             with open(temp_file, "w", encoding="utf-8") as f:
@@ -816,10 +2101,98 @@ class AliceAI(Flox):
             webbrowser.open(temp_file)
             return
 
-    def display_answer(self, text: str) -> None:
+    def copy_code_block(self, answer_id: str, index: int) -> None:
+        """
+        Copy a fenced code block of the answer to the clipboard.
+        """
+        record = self.answer_store.get(answer_id)
+        if not record:
+            return
+        code_blocks = self._extract_code_blocks(record.get("answer", ""))
+        if 0 <= index < len(code_blocks):
+            pyperclip.copy(code_blocks[index][1])
+
+    def rerun_with_model(
+        self, answer_id: str, prompt_keyword: str, provider: str, model: str
+    ) -> None:
+        """
+        Send the stored prompt again with another provider/model, with the
+        system message the answer was originally asked with if the request
+        history still has it.
+        """
+        record = self.answer_store.get(answer_id)
+        if not record:
+            return
+        query = f"{record.get('prompt', '')}{self.prompt_stop}"
+        known_keywords = [row["Key Word"] for row in self.prompts or []]
+        if prompt_keyword in known_keywords:
+            query = f"{prompt_keyword} {query}"
+        override = {
+            "query": query,
+            "provider": provider,
+            "model": model,
+            "created": time.time(),
+        }
+        system_message = self._original_system_message(record, prompt_keyword)
+        if system_message is not None:
+            override["system_message"] = system_message
+        try:
+            with open(RERUN_OVERRIDE_FILE, "w", encoding="utf-8") as file:
+                json.dump(override, file, ensure_ascii=False)
+        except OSError as error:
+            logging.error(f"Failed to store re-run override: {error}")
+            return
+        self.change_query(f"{self.user_keyword} {query}", requery=True)
+
+    def _original_system_message(
+        self, record: dict, prompt_keyword: str
+    ) -> Optional[str]:
+        for entry in self.request_history.iter_entries(self.request_history_limit):
+            if (
+                entry.get("prompt") == record.get("prompt")
+                and entry.get("answer") == record.get("answer")
+                and entry.get("prompt_keyword") == prompt_keyword
+            ):
+                return self.request_history.system_message(entry)
+        return None
+
+    def reset_conversation(self, prompt_keyword: str) -> None:
+        """
+        Stop using earlier prompts of this keyword as conversation context.
+        """
+        self.conversation_store.reset(prompt_keyword)
+
+    def _apply_rerun_override(self, query: str) -> None:
+        if not os.path.exists(RERUN_OVERRIDE_FILE):
+            return
+        try:
+            with open(RERUN_OVERRIDE_FILE, "r", encoding="utf-8") as file:
+                override = json.load(file)
+        except (json.JSONDecodeError, OSError):
+            override = {}
+        if time.time() - override.get("created", 0) > RERUN_OVERRIDE_TTL_SECONDS:
+            self._remove_file(RERUN_OVERRIDE_FILE)
+            return
+        if override.get("query", "").strip() != query.strip():
+            return
+        self._remove_file(RERUN_OVERRIDE_FILE)
+        if override.get("provider") in PROVIDERS:
+            self._use_target(override["provider"], override.get("model", ""))
+            self.target_overridden = True
+        if isinstance(override.get("system_message"), str):
+            self.rerun_system_message = override["system_message"]
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def display_answer(self, answer_id: str, mode: str = "answer_only") -> None:
         """
         Display the answer in Flow Launcher preview dialog.
         """
+        text = self._resolve_action_text(answer_id, mode)
         if not text:
             return
         self.show_msg("Answer preview", text, use_main_window_as_owner=True)
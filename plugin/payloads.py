@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+from typing import Iterator, Tuple
+
+try:
+    import orjson as fast_json
+except ImportError:
+    fast_json = None
+
+JSON_SEPARATORS = (",", ":")
+GZIP_COMPRESS_LEVEL = 5
+ERROR_TEXT_LIMIT = 500
+SSE_DATA_PREFIX = b"data:"
+SSE_DONE_MARKER = b"[DONE]"
+
+
+def encode_json_body(body: dict, gzip_min_bytes: int = 0) -> Tuple[bytes, dict]:
+    """
+    Serialize a request body as compact UTF-8 JSON.
+
+    Returns the encoded bytes and the headers describing them. Bodies of at
+    least gzip_min_bytes bytes are gzipped (0 disables compression).
+    """
+    data = json.dumps(body, ensure_ascii=False, separators=JSON_SEPARATORS).encode(
+        "utf-8"
+    )
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    if gzip_min_bytes > 0 and len(data) >= gzip_min_bytes:
+        data = gzip.compress(data, compresslevel=GZIP_COMPRESS_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Length"] = str(len(data))
+    return data, headers
+
+
+def loads_json(data: bytes):
+    """
+    Parse UTF-8 JSON bytes, using orjson when it is importable.
+    """
+    if fast_json is not None:
+        return fast_json.loads(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def decode_json_response(response) -> dict:
+    """
+    Decode a response body as UTF-8 JSON without charset detection.
+
+    Non-JSON bodies (proxy error pages, plain-text errors) are returned as
+    {"message": <text>} so error handling can still show something useful.
+    """
+    raw = response.content or b""
+    if not raw.strip():
+        return {}
+    try:
+        payload = loads_json(raw)
+    except ValueError:
+        text = raw.decode("utf-8", errors="replace").strip()
+        return {"message": text[:ERROR_TEXT_LIMIT] or str(response.reason or "")}
+    if isinstance(payload, dict):
+        return payload
+    return {"data": payload}
+
+
+def iter_sse_payloads(response) -> Iterator[dict]:
+    """
+    Yield the JSON payloads of a server-sent events (or JSON lines) stream.
+
+    Lines are handled as raw bytes so UTF-8 text is never decoded with the
+    ISO-8859-1 fallback requests applies to text/event-stream responses.
+    """
+    for line in response.iter_lines():
+        line = line.strip()
+        if line.startswith(SSE_DATA_PREFIX):
+            line = line[len(SSE_DATA_PREFIX) :].strip()
+        if not line:
+            continue
+        if line == SSE_DONE_MARKER:
+            return
+        try:
+            payload = loads_json(line)
+        except ValueError:
+            continue
+        if isinstance(payload, dict):
+            yield payload
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from heapq import nlargest
+from itertools import compress, islice
+from typing import Iterable, List, Optional, Tuple
+
+from flox.string_matcher import string_matcher
+
+from payloads import JSON_SEPARATORS
+from storage import locked, write_atomic
+
+# Offset of the record in the data file, then the bigram signature.
+ROW = struct.Struct("<Q32s")
+SIGNATURE_BYTES = 32
+OFFSET_BYTES = ROW.size - SIGNATURE_BYTES
+# BIT_MASKS[bit] maps a signature byte to 1 if the bit is set, else 0.
+BIT_MASKS = [bytes((value >> bit) & 1 for value in range(256)) for bit in range(8)]
+# Prompts handed to string_matcher per search, newest first, and the
+# length of prompt it looks at: its cost grows with the text.
+MAX_CANDIDATES = 200
+MATCH_CHARS = 200
+# The index may exceed max_entries by this fraction before it is compacted.
+COMPACT_SLACK = 0.25
+# prompt_index.prefix: the number of rows it covers, then one PREFIX_KEY
+# per row (the start of the normalized prompt and the row number), sorted.
+PREFIX_HEADER = struct.Struct("<Q")
+PREFIX_KEY = struct.Struct("<48sI")
+PREFIX_KEY_BYTES = 48
+# Rows appended since the keys were sorted are checked one by one; the keys
+# are re-sorted once this many have piled up.
+PREFIX_TAIL = 64
+
+
+def bigram_bits(text: str) -> set:
+    """
+    Signature bit numbers of the character bigrams of text, ignoring case.
+    """
+    text = text.lower()
+    return {
+        zlib.crc32(text[index : index + 2].encode("utf-8")) & 0xFF
+        for index in range(len(text) - 1)
+    }
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def prefix_key(prompt: str) -> bytes:
+    return normalize(prompt).encode("utf-8")[:PREFIX_KEY_BYTES]
+
+
+def signature(text: str) -> bytes:
+    value = 0
+    for bit in bigram_bits(text):
+        value |= 1 << bit
+    return value.to_bytes(SIGNATURE_BYTES, "little")
+
+
+class PrefixKeys:
+    """
+    The sorted keys of a memory-mapped prompt_index.prefix as a sequence,
+    for bisect.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self) -> int:
+        return (len(self.data) - PREFIX_HEADER.size) // PREFIX_KEY.size
+
+    def __getitem__(self, index: int) -> bytes:
+        start = PREFIX_HEADER.size + index * PREFIX_KEY.size
+        return self.data[start : start + PREFIX_KEY_BYTES]
+
+
+class PromptIndex:
+    """
+    Previous prompts with their answers for instant recall (prompt_index.*).
+
+    Records are JSON lines appended to prompt_index.data; prompt_index.rows
+    holds one fixed-width ROW per record with its offset and a 256-bit
+    signature of the prompt's character bigrams. A search keeps only the
+    prompts whose signature has every bit of the fragment's bigrams: each
+    required bit is one strided slice of the rows, turned into a 0/1 byte
+    per row with bytes.translate and combined with an integer AND, so the
+    prefilter runs in C. Only the surviving candidates are scored with
+    Flow Launcher's fuzzy string_matcher.
+
+    Readers hold a shared lock, so they do not wait for each other, but
+    never overlap a writer: compaction replaces all three files, and rows
+    read before it would point into the old data file.
+
+    prompt_index.prefix keeps the rows sorted by the start of their
+    lowercased prompt, so completing a partly typed prompt is a binary
+    search over the memory-mapped keys rather than a scan of every prompt.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.rows_path = f"{os.path.splitext(path)[0]}.rows"
+        self.prefix_path = f"{os.path.splitext(path)[0]}.prefix"
+        self.max_entries = max_entries
+
+    def exists(self) -> bool:
+        return os.path.exists(self.rows_path)
+
+    def add(self, ts: float, keyword: str, prompt: str, answer: str) -> None:
+        """
+        Append a request to an existing index; until the index is seeded by
+        backfill() requests are only kept by the request history.
+        """
+        try:
+            with locked(self.path):
+                if self.exists():
+                    self._append([(ts, keyword, prompt, answer)])
+        except OSError as error:
+            logging.error(f"Failed to update prompt index: {error}")
+
+    def backfill(self, records: Iterable[Tuple[float, str, str, str]]) -> None:
+        """
+        Seed an empty index from (ts, keyword, prompt, answer) records,
+        oldest first.
+        """
+        if self.exists():
+            return
+        records = list(records)[-self.max_entries :]
+        try:
+            with locked(self.path):
+                if self.exists():
+                    return
+                write_atomic(self.path, b"")
+                write_atomic(self.rows_path, b"")
+                write_atomic(self.prefix_path, PREFIX_HEADER.pack(0))
+                self._append(records)
+        except OSError as error:
+            logging.error(f"Failed to build prompt index: {error}")
+
+    def search(self, fragment: str, limit: int = 10) -> List[dict]:
+        """
+        The best fuzzy matches of fragment among the indexed prompts, one
+        per distinct prompt, ordered by score and then by recency.
+        """
+        fragment = " ".join(fragment.split())
+        if not self.exists():
+            return []
+        with locked(self.path, shared=True):
+            try:
+                with open(self.rows_path, "rb") as file:
+                    rows = file.read()
+            except FileNotFoundError:
+                return []
+            count = len(rows) // ROW.size
+            candidates = self._candidates(rows, count, fragment)
+            records = list(self._records(rows, candidates))
+        scored = {}
+        for index, record in zip(candidates, records):
+            prompt = record.get("prompt", "")
+            if prompt in scored:
+                continue
+            match = string_matcher(fragment, prompt[:MATCH_CHARS])
+            if match.matched:
+                scored[prompt] = (match.score, index, record)
+        best = sorted(scored.values(), key=lambda item: (-item[0], -item[1]))
+        return [record for _, _, record in best[:limit]]
+
+    def complete(
+        self, text: str, keyword: Optional[str] = None, limit: int = 5
+    ) -> List[dict]:
+        """
+        The newest records whose prompt starts with text, ignoring case and
+        runs of whitespace, one per distinct prompt. With keyword, only the
+        records asked with that keyword.
+        """
+        typed = normalize(text)
+        if not typed or not self.exists():
+            return []
+        with locked(self.path, shared=True):
+            return self._complete(typed, keyword, limit)
+
+    def at(self, ts: float) -> List[dict]:
+        """
+        The records of the requests sent at ts, newest first.
+        """
+        if not self.exists():
+            return []
+        start = b'{"ts":' + json.dumps(ts).encode("utf-8") + b","
+        results = []
+        with locked(self.path, shared=True):
+            try:
+                with open(self.path, "rb") as file:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return []
+            with data:
+                end = len(data)
+                while end > 0:
+                    offset = data.rfind(b"\n" + start, 0, end) + 1
+                    if not offset and data[: len(start)] != start:
+                        break
+                    line_end = data.find(b"\n", offset)
+                    try:
+                        results.append(
+                            json.loads(data[offset:line_end].decode("utf-8"))
+                        )
+                    except ValueError:
+                        pass
+                    end = offset - 1
+        return results
+
+    def _complete(self, typed: str, keyword: Optional[str], limit: int) -> List[dict]:
+        try:
+            with open(self.rows_path, "rb") as file:
+                rows = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return []
+        with rows:
+            count = len(rows) // ROW.size
+            covered, indexes = self._prefix_rows(typed.encode("utf-8"), count)
+            tail = range(count - 1, max(covered, count - PREFIX_TAIL) - 1, -1)
+            candidates = list(tail) + nlargest(MAX_CANDIDATES, indexes)
+            results = {}
+            for record in self._records(rows, candidates):
+                prompt = record.get("prompt", "")
+                if prompt in results or not normalize(prompt).startswith(typed):
+                    continue
+                if keyword is not None and record.get("keyword") != keyword:
+                    continue
+                results[prompt] = record
+                if len(results) >= limit:
+                    break
+        return list(results.values())
+
+    def _prefix_rows(self, typed: bytes, count: int) -> Tuple[int, List[int]]:
+        """
+        The number of rows covered by the sorted keys and the row numbers
+        whose key starts with typed.
+        """
+        key = typed[:PREFIX_KEY_BYTES]
+        try:
+            with open(self.prefix_path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return 0, []
+        with data:
+            covered = min(PREFIX_HEADER.unpack_from(data)[0], count)
+            keys = PrefixKeys(data)
+            start = bisect_left(keys, key)
+            end = bisect_right(keys, key.ljust(PREFIX_KEY_BYTES, b"\xff"), start)
+            matches = data[
+                PREFIX_HEADER.size
+                + start * PREFIX_KEY.size : PREFIX_HEADER.size
+                + end * PREFIX_KEY.size
+            ]
+        return covered, [
+            index for _, index in PREFIX_KEY.iter_unpack(matches) if index < covered
+        ]
+
+    def _candidates(self, rows: bytes, count: int, fragment: str) -> List[int]:
+        """
+        Row numbers whose signature contains every bigram of the words of
+        fragment, newest first.
+        """
+        required = set()
+        for word in fragment.split():
+            required |= bigram_bits(word)
+        mask = None
+        for bit in required:
+            column = rows[OFFSET_BYTES + bit // 8 :: ROW.size][:count]
+            flags = int.from_bytes(column.translate(BIT_MASKS[bit % 8]), "little")
+            mask = flags if mask is None else mask & flags
+        if mask is None:
+            indexes = range(count)
+        else:
+            indexes = compress(range(count), mask.to_bytes(count, "little"))
+        return list(islice(reversed(list(indexes)), MAX_CANDIDATES))
+
+    def _records(self, rows: bytes, indexes: List[int]) -> Iterable[dict]:
+        if not indexes:
+            return
+        with open(self.path, "rb") as file:
+            try:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return
+            with data:
+                for index in indexes:
+                    offset = ROW.unpack_from(rows, index * ROW.size)[0]
+                    end = data.find(b"\n", offset)
+                    try:
+                        yield json.loads(data[offset:end].decode("utf-8"))
+                    except ValueError:
+                        yield {}
+
+    def _append(self, records: List[Tuple[float, str, str, str]]) -> None:
+        try:
+            offset = os.path.getsize(self.path)
+        except FileNotFoundError:
+            offset = 0
+        lines = []
+        rows = []
+        keys = []
+        for ts, keyword, prompt, answer in records:
+            line = json.dumps(
+                {"ts": ts, "keyword": keyword, "prompt": prompt, "answer": answer},
+                ensure_ascii=False,
+                separators=JSON_SEPARATORS,
+            ).encode("utf-8")
+            lines.append(line + b"\n")
+            rows.append(ROW.pack(offset, signature(prompt)))
+            keys.append(prefix_key(prompt))
+            offset += len(line) + 1
+        with open(self.path, "ab") as file:
+            file.write(b"".join(lines))
+        with open(self.rows_path, "ab") as file:
+            file.write(b"".join(rows))
+        count = os.path.getsize(self.rows_path) // ROW.size
+        if count > self.max_entries + max(1, int(self.max_entries * COMPACT_SLACK)):
+            self._compact(count)
+            count = self.max_entries
+        self._update_prefix(count, keys[-count:])
+
+    def _update_prefix(self, count: int, new_keys: List[bytes]) -> None:
+        """
+        Re-sort the prefix keys once PREFIX_TAIL rows are not covered by
+        them; new_keys are the keys of the last rows, just appended.
+        """
+        if count - self._prefix_covered() < PREFIX_TAIL:
+            return
+        covered, entries = self._prefix_entries()
+        first_new = count - len(new_keys)
+        if covered < first_new:
+            with open(self.rows_path, "rb") as file:
+                rows = file.read()
+            older = self._records(rows, list(range(covered, first_new)))
+            entries.extend(
+                PREFIX_KEY.pack(prefix_key(record.get("prompt", "")), index)
+                for index, record in zip(range(covered, first_new), older)
+            )
+        entries.extend(
+            PREFIX_KEY.pack(key, index)
+            for index, key in enumerate(new_keys, first_new)
+            if index >= covered
+        )
+        entries.sort()
+        write_atomic(self.prefix_path, PREFIX_HEADER.pack(count) + b"".join(entries))
+
+    def _prefix_covered(self) -> int:
+        try:
+            with open(self.prefix_path, "rb") as file:
+                return PREFIX_HEADER.unpack(file.read(PREFIX_HEADER.size))[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def _prefix_entries(self) -> Tuple[int, List[bytes]]:
+        try:
+            with open(self.prefix_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return 0, []
+        if len(data) < PREFIX_HEADER.size:
+            return 0, []
+        size = PREFIX_KEY.size
+        return PREFIX_HEADER.unpack_from(data)[0], [
+            data[start : start + size]
+            for start in range(PREFIX_HEADER.size, len(data) - size + 1, size)
+        ]
+
+    def _compact(self, count: int) -> None:
+        """
+        Keep the newest max_entries records.
+        """
+        with open(self.rows_path, "rb") as file:
+            file.seek((count - self.max_entries) * ROW.size)
+            rows = file.read(self.max_entries * ROW.size)
+        start = ROW.unpack_from(rows, 0)[0]
+        dropped = count - self.max_entries
+        covered, entries = self._prefix_entries()
+        with open(self.path, "rb") as file:
+            file.seek(start)
+            data = file.read()
+        write_atomic(self.path, data)
+        write_atomic(
+            self.rows_path,
+            b"".join(
+                ROW.pack(offset - start, signature_bytes)
+                for offset, signature_bytes in ROW.iter_unpack(rows)
+            ),
+        )
+        write_atomic(
+            self.prefix_path,
+            PREFIX_HEADER.pack(max(0, covered - dropped))
+            + b"".join(
+                PREFIX_KEY.pack(key, index - dropped)
+                for key, index in map(PREFIX_KEY.unpack, entries)
+                if dropped <= index < covered
+            ),
+        )
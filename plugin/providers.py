@@ -0,0 +1,732 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+import requests
+
+from payloads import decode_json_response, encode_json_body, iter_sse_payloads
+
+PROXIES = {
+    "http": os.environ.get("HTTP_PROXY", ""),
+    "https": os.environ.get("HTTPS_PROXY", ""),
+}
+
+YANDEX_OPERATIONS_ENDPOINT = "https://operation.api.cloud.yandex.net/operations"
+YANDEX_ASYNC_ENDPOINT = (
+    "https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync"
+)
+RESPONSES_ENDPOINT = "https://api.openai.com/v1/responses"
+DEFAULT_YANDEX_TEMPERATURE = 0.6
+DEFAULT_MAX_OUTPUT_TOKENS = 2000
+PROMPT_CACHE_KEY_PREFIX = "aliceai-"
+CONTINUATION_PROMPT = (
+    "Your previous answer was cut off by the length limit. Continue exactly "
+    "where it stopped, without repeating anything and without a preamble."
+)
+YANDEX_TRUNCATED_STATUS = "ALTERNATIVE_STATUS_TRUNCATED_FINAL"
+
+
+class Provider:
+    """
+    Base class of the LLM back-ends.
+
+    A provider builds the request for the plugin's current prompt, sends it
+    through its own pooled HTTP session and parses the answer. Shared
+    request state (context messages, output limits, usage, errors) is read
+    from and reported to the plugin instance.
+    """
+
+    name = ""
+    label = ""
+    use_proxies = True
+    connect_timeout: Optional[float] = None
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self._session = None
+        self._started = 0.0
+
+    def model_name(self) -> str:
+        raise NotImplementedError
+
+    def model_label(self) -> str:
+        return self.model_name()
+
+    def use_model(self, model: str) -> None:
+        raise NotImplementedError
+
+    def request_mode(self) -> str:
+        raise NotImplementedError
+
+    def request_mode_label(self) -> str:
+        if self.request_mode() == "sync":
+            return "sync (blocking)"
+        return "async (streaming)"
+
+    def has_credentials(self) -> bool:
+        return True
+
+    def auth_error(self) -> Optional[Tuple[str, str]]:
+        """
+        Return (title, subtitle) describing missing configuration, or None.
+        """
+        return None
+
+    def send(self, prompt: str, system_message: str) -> Tuple[str, datetime, datetime]:
+        raise NotImplementedError
+
+    def session(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            if self.use_proxies:
+                session.proxies.update(PROXIES)
+            else:
+                session.trust_env = False
+            self._session = session
+        return self._session
+
+    def timeout(self):
+        read_timeout = self.plugin._request_timeout()
+        if self.connect_timeout:
+            return (min(self.connect_timeout, read_timeout), read_timeout)
+        return read_timeout
+
+    def post_json(self, url: str, headers: dict, body: dict, stream: bool = False):
+        self.plugin.last_usage = {}
+        self.plugin.last_response_id = ""
+        self.plugin.last_ttft_ms = None
+        self.plugin.answer_truncated = False
+        data, payload_headers = encode_json_body(
+            body, self.plugin.request_gzip_min_bytes
+        )
+        request_headers = dict(headers)
+        request_headers.update(payload_headers)
+        self._started = time.monotonic()
+        return self.session().post(
+            url,
+            headers=request_headers,
+            data=data,
+            stream=stream,
+            timeout=self.timeout(),
+        )
+
+    def continuation_messages(self, text_key: str) -> list:
+        """
+        Messages that ask the model to continue a truncated partial answer.
+        """
+        if not self.plugin.partial_answer:
+            return []
+        return [
+            {"role": "assistant", text_key: self.plugin.partial_answer},
+            {"role": "user", text_key: CONTINUATION_PROMPT},
+        ]
+
+    def mark_first_token(self) -> None:
+        """
+        Record the time to the first answer text of the current request.
+        """
+        if self.plugin.last_ttft_ms is None:
+            self.plugin.last_ttft_ms = round((time.monotonic() - self._started) * 1000)
+
+
+class OpenAICompatibleProvider(Provider):
+    """
+    Chat Completions API, blocking or streamed as server-sent events.
+    """
+
+    max_tokens_field = "max_tokens"
+    stream_usage = False
+    reasoning_effort = False
+    prompt_cache_key = False
+
+    def endpoint(self) -> str:
+        raise NotImplementedError
+
+    def headers(self) -> dict:
+        raise NotImplementedError
+
+    def request_model(self) -> str:
+        return self.model_name()
+
+    def cache_key(self) -> str:
+        """
+        Stable per-keyword routing hint for the provider's prompt cache. The
+        cached prefix itself is the system message followed by the context
+        turns, which are sent byte-for-byte as stored.
+        """
+        if not self.prompt_cache_key or not self.plugin.prompt_keyword:
+            return ""
+        return f"{PROMPT_CACHE_KEY_PREFIX}{self.plugin.prompt_keyword}"
+
+    def body(self, prompt: str, system_message: str, stream: bool) -> dict:
+        plugin = self.plugin
+        model = self.request_model()
+        body = {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_message,
+                },
+                *plugin._context_messages("content"),
+                {"role": "user", "content": prompt},
+                *self.continuation_messages("content"),
+            ],
+            "stream": stream,
+        }
+        max_tokens = plugin._max_output_tokens(model)
+        if max_tokens:
+            body[self.max_tokens_field] = max_tokens
+        if plugin.temperature is not None:
+            body["temperature"] = plugin.temperature
+        if self.reasoning_effort:
+            reasoning_effort = plugin._reasoning_effort_for(model)
+            if reasoning_effort:
+                body["reasoning_effort"] = reasoning_effort
+        if stream and self.stream_usage:
+            body["stream_options"] = {"include_usage": True}
+        if self.cache_key():
+            body["prompt_cache_key"] = self.cache_key()
+        return body
+
+    def send(self, prompt: str, system_message: str) -> Tuple[str, datetime, datetime]:
+        stream = self.request_mode() == "async"
+        body = self.body(prompt, system_message, stream)
+
+        prompt_timestamp = datetime.now()
+        logging.debug(f"Sending request with data: {body}")
+        try:
+            response = self.post_json(self.endpoint(), self.headers(), body, stream)
+        except (UnicodeEncodeError, requests.exceptions.RequestException) as e:
+            self.plugin._record_request_error(self.label, str(e))
+            return "", prompt_timestamp, datetime.now()
+
+        logging.debug(f"Response: {response}")
+        answer_timestamp = datetime.now()
+
+        result = ""
+        with response:
+            if stream:
+                result = self.consume_stream(response)
+            else:
+                self.mark_first_token()
+                response_json = decode_json_response(response)
+                if response.ok:
+                    result = self.parse_response(response_json)
+                else:
+                    self.plugin._handle_error(response, response_json, self.label)
+        return result, prompt_timestamp, answer_timestamp
+
+    def parse_response(self, response_json: dict) -> str:
+        self.plugin._capture_usage(response_json.get("usage"))
+        result = ""
+        for entry in response_json.get("choices", []):
+            message = entry.get("message", {})
+            result += message.get("content", "")
+            self.check_finish_reason(entry)
+        return result
+
+    def check_finish_reason(self, choice: dict) -> None:
+        if choice.get("finish_reason") == "length":
+            self.plugin.answer_truncated = True
+
+    def consume_stream(self, response) -> str:
+        if not response.ok:
+            response_json = decode_json_response(response)
+            self.plugin._handle_error(response, response_json, self.label)
+            return ""
+        result = ""
+        for payload in iter_sse_payloads(response):
+            self.plugin._capture_usage(payload.get("usage"))
+            for entry in payload.get("choices", []):
+                self.check_finish_reason(entry)
+                delta = entry.get("delta", {})
+                if delta:
+                    text = delta.get("content") or ""
+                else:
+                    text = entry.get("message", {}).get("content") or ""
+                if text:
+                    self.mark_first_token()
+                    result += text
+        return result
+
+
+class OpenAIProvider(OpenAICompatibleProvider):
+    name = "openai"
+    label = "OpenAI"
+    max_tokens_field = "max_completion_tokens"
+    stream_usage = True
+    reasoning_effort = True
+    prompt_cache_key = True
+
+    def model_name(self) -> str:
+        return self.plugin.model
+
+    def use_model(self, model: str) -> None:
+        self.plugin.model = model
+
+    def request_mode(self) -> str:
+        return self.plugin.openai_request_mode
+
+    def has_credentials(self) -> bool:
+        return bool(self.plugin.api_key)
+
+    def auth_error(self) -> Optional[Tuple[str, str]]:
+        if not self.plugin.api_key:
+            return (
+                "Unable to load the OpenAI API key",
+                "Please make sure you've added a valid OpenAI API key in the settings",
+            )
+        return None
+
+    def endpoint(self) -> str:
+        return self.plugin.api_endpoint
+
+    def headers(self) -> dict:
+        return {"Authorization": "Bearer " + self.plugin.api_key}
+
+
+class OpenAIResponsesProvider(OpenAIProvider):
+    """
+    OpenAI Responses API. With responses_store on, conversation turns are
+    chained on the server with previous_response_id, so a follow-up only
+    uploads the new user message instead of the whole transcript; otherwise
+    nothing is stored and the transcript is sent as with Chat Completions.
+    """
+
+    name = "openai_responses"
+    label = "OpenAI Responses"
+
+    def __init__(self, plugin):
+        super().__init__(plugin)
+        self.previous_response_id = ""
+
+    def model_label(self) -> str:
+        return f"{self.model_name()} (Responses API)"
+
+    def endpoint(self) -> str:
+        endpoint = self.plugin.api_endpoint
+        if endpoint.endswith("/chat/completions"):
+            return endpoint[: -len("/chat/completions")] + "/responses"
+        return RESPONSES_ENDPOINT
+
+    def body(self, prompt: str, system_message: str, stream: bool) -> dict:
+        plugin = self.plugin
+        model = self.request_model()
+        body = {
+            "model": model,
+            "instructions": system_message,
+            "stream": stream,
+            "store": plugin.responses_store,
+        }
+        if self.previous_response_id:
+            body["previous_response_id"] = self.previous_response_id
+            body["truncation"] = "auto"
+            if self.previous_response_id == plugin.partial_response_id:
+                body["input"] = [{"role": "user", "content": CONTINUATION_PROMPT}]
+            else:
+                body["input"] = [
+                    {"role": "user", "content": prompt},
+                    *self.continuation_messages("content"),
+                ]
+        else:
+            body["input"] = [
+                *plugin._context_messages("content"),
+                {"role": "user", "content": prompt},
+                *self.continuation_messages("content"),
+            ]
+        max_tokens = plugin._max_output_tokens(model)
+        if max_tokens:
+            body["max_output_tokens"] = max_tokens
+        if plugin.temperature is not None:
+            body["temperature"] = plugin.temperature
+        reasoning_effort = plugin._reasoning_effort_for(model)
+        if reasoning_effort:
+            body["reasoning"] = {"effort": reasoning_effort}
+        if self.cache_key():
+            body["prompt_cache_key"] = self.cache_key()
+        return body
+
+    def send(self, prompt: str, system_message: str) -> Tuple[str, datetime, datetime]:
+        turns = self.plugin.context_turns
+        self.previous_response_id = turns[-1].get("response_id", "") if turns else ""
+        if self.plugin.partial_answer and self.plugin.partial_response_id:
+            self.previous_response_id = self.plugin.partial_response_id
+        if not self.plugin.responses_store:
+            # Responses that are not stored cannot be chained.
+            self.previous_response_id = ""
+        error_count = len(self.plugin.request_errors)
+        result = super().send(prompt, system_message)
+        errors = self.plugin.request_errors[error_count:]
+        if (
+            not result[0]
+            and self.previous_response_id
+            and errors
+            and errors[-1].get("status") in (400, 404)
+        ):
+            logging.warning(
+                f"Response {self.previous_response_id} cannot be continued, "
+                "sending the conversation again"
+            )
+            del self.plugin.request_errors[error_count:]
+            self.previous_response_id = ""
+            result = super().send(prompt, system_message)
+        return result
+
+    def parse_response(self, response_json: dict) -> str:
+        self.plugin._capture_usage(response_json.get("usage"))
+        self.plugin.last_response_id = response_json.get("id", "")
+        self.check_incomplete(response_json)
+        result = ""
+        for item in response_json.get("output", []):
+            if item.get("type") != "message":
+                continue
+            for content in item.get("content", []):
+                if content.get("type") == "output_text":
+                    result += content.get("text", "")
+        return result
+
+    def consume_stream(self, response) -> str:
+        if not response.ok:
+            response_json = decode_json_response(response)
+            self.plugin._handle_error(response, response_json, self.label)
+            return ""
+        result = ""
+        for payload in iter_sse_payloads(response):
+            event_type = payload.get("type", "")
+            if event_type == "response.output_text.delta":
+                if payload.get("delta"):
+                    self.mark_first_token()
+                    result += payload["delta"]
+            elif event_type == "response.created":
+                response_id = payload.get("response", {}).get("id", "")
+                self.plugin.last_response_id = response_id
+            elif event_type in ("response.completed", "response.incomplete"):
+                self.plugin._capture_usage(payload.get("response", {}).get("usage"))
+                self.check_incomplete(payload.get("response", {}))
+            elif event_type in ("response.failed", "error"):
+                error = payload.get("response", {}).get("error") or payload
+                self.plugin._record_request_error(
+                    self.label, error.get("message") or "Response failed"
+                )
+                return ""
+        return result
+
+    def check_incomplete(self, response_json: dict) -> None:
+        details = response_json.get("incomplete_details") or {}
+        if (
+            response_json.get("status") == "incomplete"
+            and details.get("reason") == "max_output_tokens"
+        ):
+            self.plugin.answer_truncated = True
+
+
+class LocalProvider(OpenAICompatibleProvider):
+    """
+    OpenAI-compatible server on this machine (llama.cpp server, vLLM,
+    Ollama, LM Studio). Proxies are bypassed and a short connect timeout
+    lets a fallback take over quickly when the server is not running.
+    """
+
+    name = "local"
+    label = "Local"
+    use_proxies = False
+    connect_timeout = 2.0
+    stream_usage = True
+
+    def model_name(self) -> str:
+        return self.plugin.local_model
+
+    def use_model(self, model: str) -> None:
+        self.plugin.local_model = model
+
+    def model_label(self) -> str:
+        return f"{self.model_name() or 'default'} (local)"
+
+    def request_mode(self) -> str:
+        return self.plugin.local_request_mode
+
+    def endpoint(self) -> str:
+        return self.plugin.local_endpoint
+
+    def headers(self) -> dict:
+        if self.plugin.local_api_key:
+            return {"Authorization": "Bearer " + self.plugin.local_api_key}
+        return {}
+
+    def body(self, prompt: str, system_message: str, stream: bool) -> dict:
+        body = super().body(prompt, system_message, stream)
+        if not body["model"]:
+            del body["model"]
+        return body
+
+
+class YandexProvider(Provider):
+    """
+    Shared authentication and model resolution of the Yandex back-ends.
+    """
+
+    def model_name(self) -> str:
+        plugin = self.plugin
+        preset = (plugin.yandex_model_preset or "").strip()
+        custom = (plugin.yandex_model_custom or "").strip()
+        if preset and preset != "custom":
+            return preset
+        if custom:
+            return custom
+        return (plugin.yandex_model or "").strip()
+
+    def use_model(self, model: str) -> None:
+        self.plugin.yandex_model_preset = model
+
+    def request_mode(self) -> str:
+        return self.plugin.yandex_request_mode
+
+    def model_uri(self) -> str:
+        model = self.model_name()
+        if model.startswith("gpt://"):
+            return model
+        if self.plugin.yandex_folder_id:
+            return f"gpt://{self.plugin.yandex_folder_id}/{model}"
+        return ""
+
+    def model_value(self) -> str:
+        return self.model_uri() or self.model_name()
+
+    def token(self) -> str:
+        if self.plugin.yandex_auth_type == "iam_token":
+            return self.plugin.yandex_iam_token or ""
+        return self.plugin.yandex_api_key or ""
+
+    def headers(self) -> dict:
+        prefix = "Api-Key" if self.plugin.yandex_auth_type == "api_key" else "Bearer"
+        headers = {"Authorization": f"{prefix} {self.token()}"}
+        if self.plugin.yandex_folder_id:
+            headers["x-folder-id"] = self.plugin.yandex_folder_id
+        return headers
+
+    def has_credentials(self) -> bool:
+        return bool(self.token())
+
+    def auth_error(self) -> Optional[Tuple[str, str]]:
+        if not self.token():
+            return (
+                "Unable to load the Yandex token",
+                "Please make sure you've added a valid Yandex API key or IAM token",
+            )
+        if not self.model_value():
+            return (
+                "Missing Yandex model",
+                "Please select or enter a Yandex model in the settings",
+            )
+        if not self.model_uri():
+            return (
+                "Missing Yandex Folder ID",
+                "Please provide a folder ID or use a full model URI "
+                "(gpt://<folder-id>/<model>)",
+            )
+        return None
+
+
+class YandexOpenAIProvider(YandexProvider, OpenAICompatibleProvider):
+    name = "yandex_openai"
+    label = "Yandex OpenAI-compatible"
+
+    def model_label(self) -> str:
+        model_label = self.model_name() or self.plugin.yandex_model
+        return f"{model_label} (OpenAI-compatible)"
+
+    def endpoint(self) -> str:
+        return self.plugin.yandex_openai_endpoint
+
+    def request_model(self) -> str:
+        return self.model_value()
+
+
+class YandexNativeProvider(YandexProvider):
+    """
+    Foundation Models API: a blocking completion or an asynchronous
+    operation that is polled until it is done.
+    """
+
+    name = "yandex_native"
+    label = "Yandex native"
+
+    def model_label(self) -> str:
+        model_label = self.model_name() or self.plugin.yandex_model
+        return f"{model_label} (native)"
+
+    def request_mode_label(self) -> str:
+        if self.request_mode() == "sync":
+            return "sync (blocking)"
+        return "async (operation)"
+
+    def body(self, prompt: str, system_message: str) -> dict:
+        plugin = self.plugin
+        model_uri = self.model_uri()
+        completion_options = {
+            "stream": False,
+            "temperature": DEFAULT_YANDEX_TEMPERATURE
+            if plugin.temperature is None
+            else plugin.temperature,
+            "maxTokens": plugin._max_output_tokens(model_uri)
+            or DEFAULT_MAX_OUTPUT_TOKENS,
+        }
+        if plugin.reasoning_effort:
+            completion_options["reasoningOptions"] = {
+                "mode": "DISABLED"
+                if plugin.reasoning_effort in ("none", "minimal")
+                else "ENABLED_HIDDEN"
+            }
+        return {
+            "modelUri": model_uri,
+            "completionOptions": completion_options,
+            "messages": [
+                {"role": "system", "text": system_message},
+                *plugin._context_messages("text"),
+                {"role": "user", "text": prompt},
+                *self.continuation_messages("text"),
+            ],
+        }
+
+    def send(self, prompt: str, system_message: str) -> Tuple[str, datetime, datetime]:
+        if self.request_mode() == "async":
+            return self.send_async(prompt, system_message)
+        body = self.body(prompt, system_message)
+
+        prompt_timestamp = datetime.now()
+        logging.debug(f"Sending Yandex native request with data: {body}")
+        try:
+            response = self.post_json(
+                self.plugin.yandex_native_endpoint, self.headers(), body
+            )
+        except (UnicodeEncodeError, requests.exceptions.RequestException) as e:
+            self.plugin._record_request_error(self.label, str(e))
+            return "", prompt_timestamp, datetime.now()
+
+        logging.debug(f"Response: {response}")
+        answer_timestamp = datetime.now()
+        self.mark_first_token()
+        response_json = decode_json_response(response)
+        if not response.ok:
+            self.plugin._handle_error(response, response_json, self.label)
+            return "", prompt_timestamp, answer_timestamp
+        result_json = response_json.get("result", {})
+        self.plugin._capture_usage(result_json.get("usage"))
+        return self.alternatives_text(result_json), prompt_timestamp, answer_timestamp
+
+    def send_async(
+        self, prompt: str, system_message: str
+    ) -> Tuple[str, datetime, datetime]:
+        label = f"{self.label} async"
+        headers = self.headers()
+        body = self.body(prompt, system_message)
+
+        prompt_timestamp = datetime.now()
+        logging.debug(f"Sending Yandex native async request with data: {body}")
+        try:
+            response = self.post_json(self.async_endpoint(), headers, body)
+        except (UnicodeEncodeError, requests.exceptions.RequestException) as e:
+            self.plugin._record_request_error(label, str(e))
+            return "", prompt_timestamp, datetime.now()
+
+        logging.debug(f"Response: {response}")
+        answer_timestamp = datetime.now()
+        response_json = decode_json_response(response)
+        if not response.ok:
+            self.plugin._handle_error(response, response_json, label)
+            return "", prompt_timestamp, answer_timestamp
+
+        operation_id = response_json.get("id")
+        if not operation_id:
+            self.plugin._record_request_error(
+                label, "Missing operation id in the response"
+            )
+            return "", prompt_timestamp, answer_timestamp
+
+        return self.poll_operation(
+            operation_id, headers, prompt_timestamp, answer_timestamp
+        )
+
+    def poll_operation(
+        self,
+        operation_id: str,
+        headers: dict,
+        prompt_timestamp: datetime,
+        answer_timestamp: datetime,
+        max_attempts: int = 60,
+        poll_interval_seconds: float = 1.0,
+    ) -> Tuple[str, datetime, datetime]:
+        label = f"{self.label} async"
+        operation_url = f"{YANDEX_OPERATIONS_ENDPOINT}/{operation_id}"
+        for _ in range(max_attempts):
+            if self.plugin._deadline_passed():
+                break
+            try:
+                response = self.session().get(
+                    operation_url, headers=headers, timeout=self.timeout()
+                )
+            except (UnicodeEncodeError, requests.exceptions.RequestException) as e:
+                self.plugin._record_request_error(label, str(e))
+                return "", prompt_timestamp, datetime.now()
+
+            response_json = decode_json_response(response)
+            if not response.ok:
+                self.plugin._handle_error(response, response_json, label)
+                return "", prompt_timestamp, datetime.now()
+
+            if response_json.get("done"):
+                if response_json.get("error"):
+                    self.plugin._handle_error(response, response_json, label)
+                    return "", prompt_timestamp, datetime.now()
+                answer_timestamp = datetime.now()
+                self.mark_first_token()
+                response_body = response_json.get("response", {})
+                self.plugin._capture_usage(response_body.get("usage"))
+                if "alternatives" not in response_body:
+                    response_body = response_body.get("result", {})
+                return (
+                    self.alternatives_text(response_body),
+                    prompt_timestamp,
+                    answer_timestamp,
+                )
+
+            time.sleep(poll_interval_seconds)
+
+        self.plugin._record_request_error(
+            label, "Timed out waiting for the operation to complete"
+        )
+        return "", prompt_timestamp, datetime.now()
+
+    def async_endpoint(self) -> str:
+        endpoint = self.plugin.yandex_native_endpoint
+        if endpoint.endswith("completionAsync"):
+            return endpoint
+        if endpoint.endswith("/completion"):
+            return f"{endpoint}Async"
+        return YANDEX_ASYNC_ENDPOINT
+
+    def alternatives_text(self, result_json: dict) -> str:
+        result = ""
+        for entry in result_json.get("alternatives", []):
+            message = entry.get("message", {})
+            result += message.get("text", "")
+            if entry.get("status") == YANDEX_TRUNCATED_STATUS:
+                self.plugin.answer_truncated = True
+        return result
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (
+        OpenAIProvider,
+        OpenAIResponsesProvider,
+        YandexNativeProvider,
+        YandexOpenAIProvider,
+        LocalProvider,
+    )
+}
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+from statistics import median
+from typing import List, Optional
+
+from payloads import JSON_SEPARATORS
+from storage import append_line, iter_lines_reversed, keep_tail_lines, locked
+
+
+class RequestStats:
+    """
+    Per-request telemetry (token usage, prompt-cache hits, latency) kept as
+    append-only JSON lines. Only the newest records are read back, so the
+    stats view does not depend on the size of the file.
+    """
+
+    def __init__(self, path: str, max_file_bytes: int = 1024 * 1024):
+        self.path = path
+        self.max_file_bytes = max_file_bytes
+
+    def record(self, entry: dict) -> None:
+        data = json.dumps(entry, ensure_ascii=False, separators=JSON_SEPARATORS)
+        try:
+            with locked(self.path):
+                append_line(self.path, data.encode("utf-8"))
+                if os.path.getsize(self.path) > self.max_file_bytes:
+                    keep_tail_lines(self.path, self.max_file_bytes // 2)
+        except OSError as error:
+            logging.error(f"Failed to write request stats: {error}")
+
+    def recent(self, limit: int = 1000) -> List[dict]:
+        """
+        Return up to limit records, newest first.
+        """
+        records = []
+        for line in iter_lines_reversed(self.path):
+            try:
+                records.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                continue
+            if len(records) >= limit:
+                break
+        return records
+
+
+def summarize(records: List[dict]) -> dict:
+    """
+    Aggregate prompt-cache and time-to-first-token figures of the records.
+    """
+    prompt_tokens = sum(record.get("prompt_tokens", 0) for record in records)
+    cached_tokens = sum(record.get("cached_tokens", 0) for record in records)
+    hits = [record for record in records if record.get("cached_tokens", 0) > 0]
+    misses = [record for record in records if record.get("cached_tokens", 0) <= 0]
+    return {
+        "requests": len(records),
+        "cache_hits": len(hits),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "cached_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "ttft_hit_ms": median_of(hits, "ttft_ms"),
+        "ttft_miss_ms": median_of(misses, "ttft_ms"),
+    }
+
+
+def median_of(records: List[dict], key: str) -> Optional[float]:
+    values = [record[key] for record in records if record.get(key) is not None]
+    return median(values) if values else None
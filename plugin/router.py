@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+from storage import append_line, keep_tail_lines, locked, write_atomic
+
+STATS_WEIGHT = 0.2
+MIN_SAMPLES = 3
+MAX_ERROR_RATE = 0.5
+ERROR_RATE_MEMORY_SECONDS = 30 * 60
+PROMPT_MS_PER_1K_TOKENS = 150.0
+
+
+def target_key(provider: str, model: str) -> str:
+    return f"{provider}:{model}"
+
+
+class ModelRouter:
+    """
+    Latency-aware choice among candidate provider/model targets.
+
+    Per-target latency and error rates are kept as exponential moving
+    averages in a small JSON file, so ranking costs O(candidates) and never
+    rescans history. Every decision and its outcome is appended to a JSON
+    lines log for offline evaluation of the policy; the log keeps its newest
+    lines within max_log_bytes.
+    """
+
+    def __init__(
+        self, stats_file: str, log_file: str, max_log_bytes: int = 1024 * 1024
+    ):
+        self.stats_file = stats_file
+        self.log_file = log_file
+        self.max_log_bytes = max_log_bytes
+        self._stats = None
+
+    def rank(
+        self, candidates: List[Tuple[str, str]], prompt_tokens: int, target_ms: int
+    ) -> List[dict]:
+        """
+        Order candidates for a request. Candidates are given best-first; the
+        first one expected to meet target_ms with an acceptable error rate
+        wins, the rest follow as fallbacks, fastest first.
+        """
+        stats = self._load()
+        now = time.time()
+        rows = []
+        for preference, (provider, model) in enumerate(candidates):
+            entry = stats.get(target_key(provider, model), {})
+            predicted_ms = None
+            if entry.get("samples", 0) >= MIN_SAMPLES:
+                predicted_ms = round(
+                    entry["latency_ms"] + prompt_tokens / 1000 * PROMPT_MS_PER_1K_TOKENS
+                )
+            error_rate = entry.get("error_rate", 0.0)
+            if now - entry.get("updated", 0) > ERROR_RATE_MEMORY_SECONDS:
+                error_rate = 0.0
+            rows.append(
+                {
+                    "provider": provider,
+                    "model": model,
+                    "preference": preference,
+                    "predicted_ms": predicted_ms,
+                    "error_rate": round(error_rate, 3),
+                }
+            )
+
+        def meets_target(row: dict) -> bool:
+            return row["error_rate"] < MAX_ERROR_RATE and (
+                row["predicted_ms"] is None or row["predicted_ms"] <= target_ms
+            )
+
+        eligible = [row for row in rows if meets_target(row)]
+        remaining = sorted(
+            (row for row in rows if not meets_target(row)),
+            key=lambda row: (
+                row["error_rate"] >= MAX_ERROR_RATE,
+                row["predicted_ms"] or 0,
+            ),
+        )
+        return eligible + remaining
+
+    def record(
+        self, provider: str, model: str, ok: bool, latency_ms: Optional[float]
+    ) -> None:
+        try:
+            with locked(self.stats_file):
+                self._stats = None
+                stats = self._load()
+                entry = stats.setdefault(
+                    target_key(provider, model),
+                    {"latency_ms": 0.0, "error_rate": 0.0, "samples": 0},
+                )
+                outcome = 0.0 if ok else 1.0
+                entry["error_rate"] += (outcome - entry["error_rate"]) * STATS_WEIGHT
+                if ok and latency_ms is not None:
+                    if entry["samples"] == 0:
+                        entry["latency_ms"] = latency_ms
+                    else:
+                        entry["latency_ms"] += (
+                            latency_ms - entry["latency_ms"]
+                        ) * STATS_WEIGHT
+                    entry["samples"] += 1
+                entry["updated"] = time.time()
+                data = json.dumps(stats, separators=JSON_SEPARATORS)
+                write_atomic(self.stats_file, data.encode("utf-8"))
+        except OSError as error:
+            logging.error(f"Failed to save model statistics: {error}")
+
+    def log_decision(self, decision: dict) -> None:
+        data = json.dumps(decision, ensure_ascii=False, separators=JSON_SEPARATORS)
+        try:
+            with locked(self.log_file):
+                append_line(self.log_file, data.encode("utf-8"))
+                if os.path.getsize(self.log_file) > self.max_log_bytes:
+                    keep_tail_lines(self.log_file, self.max_log_bytes // 2)
+        except OSError as error:
+            logging.error(f"Failed to write routing log: {error}")
+
+    def _load(self) -> dict:
+        if self._stats is None:
+            try:
+                with open(self.stats_file, "rb") as file:
+                    self._stats = json.loads(file.read().decode("utf-8"))
+            except (OSError, ValueError):
+                self._stats = {}
+        return self._stats
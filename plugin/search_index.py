@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import re
+import sqlite3
+import time
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
+
+# Exchanges of a conversation file, newest first:
+# "[ts] User: prompt\n[ts] AliceAI: answer\n\n".
+EXCHANGE_PATTERN = re.compile(
+    r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] User: (.*?)\n"
+    r"\[\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\] AliceAI: (.*?)\n*"
+    r"(?=^\[\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\] User: |\Z)",
+    re.DOTALL | re.MULTILINE,
+)
+TOKENIZERS = ("trigram", "unicode61 remove_diacritics 2")
+TRIGRAM = 3
+# Rowids are prompt times in milliseconds, so rowid order is time order.
+ROWIDS_PER_SECOND = 1000
+# Candidate rows checked per search before giving up on finding more.
+MAX_CANDIDATES = 5000
+BACKFILL_BATCH = 1000
+BACKFILL_STALE_SECONDS = 3600
+SNIPPET_CHARS = 60
+
+
+def parse_exchanges(content: str) -> List[Tuple[str, str, str]]:
+    """
+    Split the text of a conversation file into (timestamp, prompt, answer)
+    tuples, newest first.
+    """
+    return [
+        (timestamp, prompt, answer.rstrip("\n"))
+        for timestamp, prompt, answer in EXCHANGE_PATTERN.findall(content)
+    ]
+
+
+def snippet(text: str, term: str, size: int = SNIPPET_CHARS) -> str:
+    """
+    The part of text around the first occurrence of term, on one line.
+    """
+    position = max(0, text.lower().find(term.lower()))
+    start = max(0, position - size // 3)
+    excerpt = " ".join(text[start : start + size].split())
+    prefix = "…" if start else ""
+    suffix = "…" if start + size < len(text) else ""
+    return f"{prefix}{excerpt}{suffix}"
+
+
+class ConversationIndex:
+    """
+    Full-text index of saved conversations (conversation_index.sqlite3).
+
+    Every exchange is one row of an SQLite FTS5 table, written when the
+    exchange is saved, so searches never read the conversation files or
+    the archive. The index is created by the first search that is run;
+    until then saving an exchange does not touch it. The trigram tokenizer
+    indexes every three-character substring without positions
+    (detail=none), which keeps the index about the size of the text: a
+    search matches the rows that contain all trigrams of the query, then
+    checks the candidates for the words themselves, in any script and
+    case. SQLite builds without the trigram tokenizer fall back to
+    word-prefix matching.
+
+    Rowids are the prompt time in milliseconds, so FTS5 returns the newest
+    matches first by walking the rowids backwards and stops at the limit,
+    and re-indexing an exchange that is already present is a no-op.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+        self._tokenizer = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def add(self, keyword: str, timestamp: float, prompt: str, answer: str) -> None:
+        """
+        Index a saved exchange. Nothing is written until the first search
+        creates the index; backfill() then picks the exchange up from the
+        conversation files.
+        """
+        if not self.exists():
+            return
+        try:
+            connection = self._connect()
+            with connection:
+                self._insert(connection, keyword, timestamp, prompt, answer)
+        except sqlite3.Error as error:
+            logging.error(f"Failed to update conversation index: {error}")
+
+    def claim_backfill(self) -> bool:
+        """
+        Whether exchanges saved before the index existed still have to be
+        indexed and nobody else is doing it; the caller then runs backfill().
+        """
+        try:
+            connection = self._connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                state = self._meta(connection, "backfill")
+                if state == "done":
+                    return False
+                if state and time.time() - float(state) < BACKFILL_STALE_SECONDS:
+                    return False
+                self._set_meta(connection, "backfill", str(time.time()))
+        except (sqlite3.Error, ValueError) as error:
+            logging.error(f"Failed to read conversation index: {error}")
+            return False
+        return True
+
+    def backfilled(self) -> bool:
+        if not self.exists():
+            return False
+        try:
+            return self._meta(self._connect(), "backfill") == "done"
+        except sqlite3.Error:
+            return True
+
+    def backfill(self, exchanges: Iterable[Tuple[str, float, str, str]]) -> None:
+        """
+        Index (keyword, timestamp, prompt, answer) exchanges saved before the
+        index existed, in small transactions so saving new exchanges is not
+        held up.
+        """
+        exchanges = iter(exchanges)
+        try:
+            connection = self._connect()
+            while True:
+                batch = list(islice(exchanges, BACKFILL_BATCH))
+                with connection:
+                    for exchange in batch:
+                        self._insert(connection, *exchange)
+                    if not batch:
+                        self._set_meta(connection, "backfill", "done")
+                        return
+        except sqlite3.Error as error:
+            logging.error(f"Failed to build conversation index: {error}")
+
+    def search(self, text: str, limit: int = 20) -> Optional[List[dict]]:
+        """
+        Newest exchanges containing every word of text. Returns None if the
+        text has no word long enough to look up.
+        """
+        words = text.split()
+        try:
+            connection = self._connect()
+            query = self._match_query(words)
+            if not query:
+                return None
+            cursor = connection.execute(
+                "SELECT rowid, keyword, ts, prompt, answer FROM exchanges "
+                "WHERE exchanges MATCH ? ORDER BY rowid DESC",
+                (query,),
+            )
+            results = []
+            for rowid, keyword, ts, prompt, answer in islice(cursor, MAX_CANDIDATES):
+                if not self._contains(f"{prompt}\n{answer}", words):
+                    continue
+                in_answer = words[0].lower() in answer.lower()
+                results.append(
+                    {
+                        "id": rowid,
+                        "keyword": keyword,
+                        "ts": ts,
+                        "prompt": prompt,
+                        "snippet": snippet(answer if in_answer else prompt, words[0]),
+                    }
+                )
+                if len(results) >= limit:
+                    break
+            cursor.close()
+        except sqlite3.Error as error:
+            logging.error(f"Failed to search conversations: {error}")
+            return []
+        return results
+
+    def get(self, exchange_id: int) -> Optional[dict]:
+        try:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT keyword, ts, prompt, answer FROM exchanges "
+                    "WHERE rowid = ?",
+                    (exchange_id,),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as error:
+            logging.error(f"Failed to read conversation index: {error}")
+            return None
+        if row is None:
+            return None
+        return dict(zip(("keyword", "ts", "prompt", "answer"), row))
+
+    def _insert(
+        self,
+        connection: sqlite3.Connection,
+        keyword: str,
+        timestamp: float,
+        prompt: str,
+        answer: str,
+    ) -> None:
+        first = int(timestamp * ROWIDS_PER_SECOND)
+        rows = connection.execute(
+            "SELECT rowid, keyword, prompt FROM exchanges "
+            "WHERE rowid BETWEEN ? AND ?",
+            (first, first + ROWIDS_PER_SECOND - 1),
+        ).fetchall()
+        if any(row[1:] == (keyword, prompt) for row in rows):
+            return
+        connection.execute(
+            "INSERT INTO exchanges (rowid, keyword, ts, prompt, answer) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                max((row[0] for row in rows), default=first - 1) + 1,
+                keyword,
+                timestamp,
+                prompt,
+                answer,
+            ),
+        )
+
+    def _match_query(self, words: List[str]) -> str:
+        if self._tokenizer == TOKENIZERS[0]:
+            terms = {
+                word[index : index + TRIGRAM]
+                for word in words
+                for index in range(len(word) - TRIGRAM + 1)
+            }
+            return " AND ".join(
+                '"{}"'.format(term.replace('"', '""')) for term in sorted(terms)
+            )
+        terms = [term for word in words for term in re.findall(r"\w+", word)]
+        return " AND ".join(f'"{term}"*' for term in terms)
+
+    def _contains(self, text: str, words: List[str]) -> bool:
+        if self._tokenizer != TOKENIZERS[0]:
+            return True
+        text = text.lower()
+        return all(word.lower() in text for word in words)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is not None:
+            return self._connection
+        connection = sqlite3.connect(self.path, timeout=10)
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._tokenizer = self._meta(connection, "tokenizer")
+            if self._tokenizer is None:
+                self._tokenizer = self._create_table(connection)
+                self._set_meta(connection, "tokenizer", self._tokenizer)
+        self._connection = connection
+        return connection
+
+    def _create_table(self, connection: sqlite3.Connection) -> str:
+        for tokenizer in TOKENIZERS:
+            try:
+                connection.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS exchanges USING fts5("
+                    "keyword UNINDEXED, ts UNINDEXED, prompt, answer, "
+                    f"tokenize = '{tokenizer}', detail = none)"
+                )
+                return tokenizer
+            except sqlite3.OperationalError as error:
+                logging.warning(f"FTS5 tokenizer {tokenizer} unavailable: {error}")
+        raise sqlite3.OperationalError("FTS5 is not available")
+
+    def _meta(self, connection: sqlite3.Connection, key: str) -> Optional[str]:
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, connection: sqlite3.Connection, key: str, value: str) -> None:
+        connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from payloads import JSON_SEPARATORS
+
+LOCK_SUFFIX = ".lock"
+RESULT_SUFFIX = ".json"
+
+
+def request_fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = (part or "").encode("utf-8")
+        digest.update(str(len(encoded)).encode("ascii") + b":" + encoded)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Cross-process de-duplication of identical requests.
+
+    The first process to create <key>.lock becomes the leader and runs the
+    call; its result is published as <key>.json. Followers wait for the lock
+    to disappear and reuse the published result instead of issuing the call
+    again. Only a result published after a follower arrived is reused, so
+    asking the same thing again later sends a new request rather than
+    returning the previous answer.
+
+    wait_timeout should cover the leader's slowest call; a lock older than
+    that is treated as abandoned (the leader was killed).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        wait_timeout: float = 360.0,
+        poll_interval: float = 0.1,
+    ):
+        self.directory = directory
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    def run(self, key: str, call: Callable[[], Optional[dict]]) -> Tuple[dict, bool]:
+        """
+        Return (result, is_leader). The call returns a JSON-serializable dict
+        to publish, or None when the result must not be shared (e.g. errors).
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as error:
+            logging.error(f"Single-flight directory unavailable: {error}")
+            return call() or {}, True
+
+        lock_path = os.path.join(self.directory, f"{key}{LOCK_SUFFIX}")
+        result_path = os.path.join(self.directory, f"{key}{RESULT_SUFFIX}")
+        arrived = time.time()
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            shared = self._read_result(result_path, arrived)
+            if shared is not None:
+                logging.info(f"Reusing in-flight result for request {key[:12]}")
+                return shared, False
+            try:
+                lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._age(lock_path) > self.wait_timeout:
+                    self._remove(lock_path)
+                    continue
+                time.sleep(self.poll_interval)
+                continue
+            except OSError as error:
+                logging.error(f"Unable to create single-flight lock: {error}")
+                break
+            try:
+                os.write(lock_fd, str(os.getpid()).encode("ascii"))
+                os.close(lock_fd)
+                result = call()
+                if result is not None:
+                    self._publish(result_path, result)
+                return result or {}, True
+            finally:
+                self._remove(lock_path)
+
+        logging.warning(f"Gave up waiting for in-flight request {key[:12]}")
+        return call() or {}, True
+
+    def _read_result(self, path: str, arrived: float) -> Optional[dict]:
+        """
+        The result at path if it was published after the caller arrived.
+        """
+        try:
+            if os.path.getmtime(path) < arrived:
+                return None
+        except OSError:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return json.loads(file.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _publish(self, path: str, result: dict) -> None:
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as file:
+                file.write(
+                    json.dumps(
+                        result, ensure_ascii=False, separators=JSON_SEPARATORS
+                    ).encode("utf-8")
+                )
+            os.replace(temp_path, path)
+        except OSError as error:
+            logging.error(f"Failed to publish in-flight result: {error}")
+            self._remove(temp_path)
+        self._prune_results()
+
+    def _prune_results(self) -> None:
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        now = time.time()
+        for entry in entries:
+            if not entry.name.endswith(RESULT_SUFFIX):
+                continue
+            try:
+                if now - entry.stat().st_mtime > self.wait_timeout:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _age(self, path: str) -> float:
+        try:
+            return time.time() - os.path.getmtime(path)
+        except OSError:
+            return float("inf")
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
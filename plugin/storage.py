@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+if os.name == "nt":
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+
+    class _Overlapped(ctypes.Structure):
+        _fields_ = [
+            ("Internal", ctypes.c_void_p),
+            ("InternalHigh", ctypes.c_void_p),
+            ("Offset", wintypes.DWORD),
+            ("OffsetHigh", wintypes.DWORD),
+            ("hEvent", wintypes.HANDLE),
+        ]
+
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    LOCKFILE_FAIL_IMMEDIATELY = 0x1
+else:
+    import fcntl
+
+READ_BLOCK_SIZE = 64 * 1024
+LOCK_SUFFIX = ".lock"
+REPLACE_RETRIES = 20
+REPLACE_RETRY_DELAY = 0.05
+
+
+def iter_lines_reversed(
+    path: str, block_size: int = READ_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """
+    Yield the non-empty lines of a file from last to first.
+
+    The file is read backwards in fixed-size blocks, so callers that stop
+    early only pay for the tail they actually consume.
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            lines = (file.read(read_size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+
+def append_line(path: str, data: bytes) -> None:
+    """
+    Append one newline-terminated record with a single O_APPEND write.
+
+    A writer killed mid-write leaves a record without its newline; the new
+    record then starts on a line of its own instead of being glued to it.
+    Call it under locked(path): another writer's append in progress would
+    look like such a torn record.
+    """
+    flags = os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        separator = b""
+        if size:
+            os.lseek(fd, size - 1, os.SEEK_SET)
+            if os.read(fd, 1) != b"\n":
+                separator = b"\n"
+        os.write(fd, separator + data.rstrip(b"\n") + b"\n")
+    finally:
+        os.close(fd)
+
+
+def count_lines(path: str, block_size: int = READ_BLOCK_SIZE) -> int:
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with file:
+        blocks = iter(lambda: file.read(block_size), b"")
+        return sum(block.count(b"\n") for block in blocks)
+
+
+def keep_tail_lines(path: str, max_bytes: int) -> None:
+    """
+    Rewrite a line-oriented file to its newest lines that fit max_bytes.
+    """
+    kept = deque()
+    kept_bytes = 0
+    for line in iter_lines_reversed(path):
+        if kept_bytes + len(line) > max_bytes:
+            break
+        kept.appendleft(line)
+        kept_bytes += len(line) + 1
+    write_atomic(path, b"".join(line + b"\n" for line in kept))
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Replace a file's content so readers see either the old or the new
+    version, never a partial write.
+
+    On Windows os.replace fails while another process has the target open,
+    so the replace is retried for a short while.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(temp_path, path)
+                return
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(REPLACE_RETRY_DELAY)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@contextmanager
+def locked(
+    path: str, timeout: float = 10.0, poll_interval: float = 0.02, shared: bool = False
+):
+    """
+    Hold an exclusive advisory lock on <path>.lock for a read-modify-write
+    of path, or with shared a lock that only excludes writers, for reading
+    it. Locks are released by the OS when a process dies, so a killed
+    writer cannot block others. If the lock cannot be taken within timeout
+    seconds the block runs unlocked rather than losing the write.
+    """
+    lock_file = open(f"{path}{LOCK_SUFFIX}", "a+b")
+    acquired = False
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                _lock(lock_file, shared)
+                acquired = True
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    action = "Reading" if shared else "Writing"
+                    logging.warning(f"{action} {path} without a lock after {timeout}s")
+                    break
+                time.sleep(poll_interval)
+        yield
+    finally:
+        if acquired:
+            _unlock(lock_file, shared)
+        lock_file.close()
+
+
+def _lock(lock_file, shared: bool) -> None:
+    if os.name == "nt" and shared:
+        # msvcrt.locking has no shared mode; LockFileEx takes one on the
+        # same byte, which msvcrt's exclusive lock respects.
+        handle = msvcrt.get_osfhandle(lock_file.fileno())
+        if not _kernel32.LockFileEx(
+            wintypes.HANDLE(handle),
+            LOCKFILE_FAIL_IMMEDIATELY,
+            0,
+            1,
+            0,
+            ctypes.byref(_Overlapped()),
+        ):
+            raise ctypes.WinError(ctypes.get_last_error())
+    elif os.name == "nt":
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        fcntl.flock(lock_file.fileno(), mode | fcntl.LOCK_NB)
+
+
+def _unlock(lock_file, shared: bool) -> None:
+    if os.name == "nt" and shared:
+        handle = msvcrt.get_osfhandle(lock_file.fileno())
+        _kernel32.UnlockFileEx(
+            wintypes.HANDLE(handle), 0, 1, 0, ctypes.byref(_Overlapped())
+        )
+    elif os.name == "nt":
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
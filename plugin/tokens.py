@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import re
+from typing import Optional
+
+from payloads import JSON_SEPARATORS
+from storage import locked, write_atomic
+
+LATIN_RUNS = re.compile(r"[A-Za-z]+")
+CYRILLIC_RUNS = re.compile(r"[\u0400-\u04ff]+")
+DIGIT_RUNS = re.compile(r"[0-9]+")
+CJK_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+WHITESPACE_CHARS = re.compile(r"\s")
+
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 3
+CALIBRATION_WEIGHT = 0.2
+CALIBRATION_LIMITS = (0.5, 2.0)
+
+# Characters per token for each script, by tokenizer family.
+FAMILY_RATIOS = {
+    "o200k": {"latin": 4.2, "cyrillic": 3.4, "digits": 3.0, "cjk": 1.1},
+    "cl100k": {"latin": 4.0, "cyrillic": 2.3, "digits": 3.0, "cjk": 0.8},
+    "yandex": {"latin": 3.6, "cyrillic": 4.2, "digits": 2.0, "cjk": 0.8},
+    "generic": {"latin": 3.8, "cyrillic": 3.0, "digits": 2.5, "cjk": 0.9},
+}
+
+# Model name prefix -> (tokenizer family, usable context window in tokens).
+MODEL_LIMITS = (
+    ("gpt-5", "o200k", 272000),
+    ("gpt-4.1", "o200k", 1047576),
+    ("gpt-4o", "o200k", 128000),
+    ("gpt-4-turbo", "cl100k", 128000),
+    ("gpt-4", "cl100k", 8192),
+    ("gpt-3.5-turbo", "cl100k", 16385),
+    ("yandexgpt", "yandex", 32768),
+    ("aliceai", "yandex", 32768),
+    ("qwen3", "generic", 131072),
+    ("gpt-oss", "o200k", 131072),
+    ("gemma-3", "generic", 131072),
+)
+DEFAULT_FAMILY = "generic"
+DEFAULT_CONTEXT_WINDOW = 32768
+
+
+def model_limits(model: str) -> tuple:
+    """
+    Return (tokenizer family, context window) for a model name or URI.
+    """
+    name = (model or "").lower()
+    if name.startswith("gpt://"):
+        name = name.split("/", 3)[-1]
+    for prefix, family, context_window in MODEL_LIMITS:
+        if name.startswith(prefix):
+            return family, context_window
+    return DEFAULT_FAMILY, DEFAULT_CONTEXT_WINDOW
+
+
+def estimate_text_tokens(text: str, family: str = DEFAULT_FAMILY) -> float:
+    """
+    Uncalibrated token estimate from per-script character counts.
+    """
+    if not text:
+        return 0.0
+    ratios = FAMILY_RATIOS.get(family, FAMILY_RATIOS[DEFAULT_FAMILY])
+    total = 0.0
+    counted_chars = 0
+    for pattern, script in (
+        (LATIN_RUNS, "latin"),
+        (CYRILLIC_RUNS, "cyrillic"),
+        (DIGIT_RUNS, "digits"),
+    ):
+        runs = pattern.findall(text)
+        if not runs:
+            continue
+        chars = sum(map(len, runs))
+        counted_chars += chars
+        total += max(len(runs), chars / ratios[script])
+    cjk_chars = len(CJK_CHARS.findall(text))
+    whitespace_chars = len(WHITESPACE_CHARS.findall(text))
+    total += cjk_chars / ratios["cjk"]
+    total += text.count("\n") * 0.5
+    other_chars = len(text) - counted_chars - cjk_chars - whitespace_chars
+    total += max(0, other_chars) * 0.8
+    return total
+
+
+class TokenEstimator:
+    """
+    Dependency-free token estimator calibrated per tokenizer family.
+
+    Calibration factors are moving averages of the ratio between the prompt
+    token counts reported in provider usage blocks and the raw estimates,
+    persisted in a small JSON file.
+    """
+
+    def __init__(self, calibration_file: str):
+        self.calibration_file = calibration_file
+        self._calibration = None
+
+    def estimate(self, text: str, model: str) -> int:
+        family, _ = model_limits(model)
+        return int(estimate_text_tokens(text, family) * self.factor(family) + 0.5)
+
+    def estimate_messages_raw(self, texts: list, model: str) -> float:
+        family, _ = model_limits(model)
+        return REQUEST_OVERHEAD_TOKENS + sum(
+            MESSAGE_OVERHEAD_TOKENS + estimate_text_tokens(text, family)
+            for text in texts
+        )
+
+    def estimate_messages(self, texts: list, model: str) -> int:
+        family, _ = model_limits(model)
+        raw_tokens = self.estimate_messages_raw(texts, model)
+        return int(raw_tokens * self.factor(family) + 0.5)
+
+    def factor(self, family: str) -> float:
+        return self._load().get(family, {}).get("factor", 1.0)
+
+    def calibrate(self, model: str, raw_estimate: float, actual_tokens: int) -> None:
+        if raw_estimate <= 0 or not actual_tokens or actual_tokens <= 0:
+            return
+        family, _ = model_limits(model)
+        try:
+            with locked(self.calibration_file):
+                self._calibration = None
+                calibration = self._load()
+                entry = calibration.setdefault(family, {"factor": 1.0, "samples": 0})
+                ratio = actual_tokens / raw_estimate
+                low, high = CALIBRATION_LIMITS
+                factor = (
+                    entry["factor"] + (ratio - entry["factor"]) * CALIBRATION_WEIGHT
+                )
+                entry["factor"] = round(min(high, max(low, factor)), 4)
+                entry["samples"] = entry.get("samples", 0) + 1
+                data = json.dumps(calibration, separators=JSON_SEPARATORS)
+                write_atomic(self.calibration_file, data.encode("utf-8"))
+        except OSError as error:
+            logging.error(f"Failed to save token calibration: {error}")
+
+    def _load(self) -> dict:
+        if self._calibration is None:
+            try:
+                with open(self.calibration_file, "rb") as file:
+                    self._calibration = json.loads(file.read().decode("utf-8"))
+            except (OSError, ValueError):
+                self._calibration = {}
+        return self._calibration
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, estimate, marker: str = "\n…\n"
+) -> Optional[str]:
+    """
+    Shorten text to about max_tokens by keeping its head and tail. Returns
+    None when not even a minimal excerpt fits.
+    """
+    if max_tokens <= 0:
+        return None
+    current = estimate(text)
+    if current <= max_tokens:
+        return text
+    keep_chars = int(len(text) * max_tokens / current * 0.95)
+    if keep_chars < 16:
+        return None
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    return text[:head] + marker + text[-tail:]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import importlib.util
+import os
+import re
+import shutil
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The plugin modules import each other and the bundled libraries by bare
+# name, as they do when Flow Launcher runs plugin/main.py.
+sys.path[:0] = [os.path.join(ROOT, "plugin"), os.path.join(ROOT, "lib")]
+
+
+class Flox:
+    """
+    The part of flox.Flox the plugin uses. The bundled flox looks for the
+    Flow Launcher installation when it is imported and answers the JSON-RPC
+    request in sys.argv when the plugin object is released, so tests use
+    this instead; results are kept as the same item dicts.
+    """
+
+    user_keyword = "ai"
+    plugin_settings = {}
+
+    def __init_subclass__(cls, **kwargs):
+        cls._results = []
+
+    @property
+    def settings(self):
+        return self.plugin_settings
+
+    def add_item(
+        self,
+        title,
+        subtitle="",
+        icon=None,
+        method=None,
+        parameters=None,
+        context=None,
+        glyph=None,
+        score=0,
+        **kwargs,
+    ):
+        item = {
+            "Title": str(title),
+            "SubTitle": str(subtitle),
+            "ContextData": context,
+            "Score": score,
+            "JsonRPCAction": {},
+        }
+        if method:
+            item["JsonRPCAction"] = {
+                "method": getattr(method, "__name__", method),
+                "parameters": parameters or [],
+                "dontHideAfterAction": kwargs.pop("dont_hide", False),
+            }
+        item.update(kwargs)
+        self._results.append(item)
+        return item
+
+    def change_query(self, query, requery=False):
+        self.changed_query = query
+
+    def show_msg(self, title, subtitle="", ico_path=""):
+        self.message = (title, subtitle)
+
+    def logger_level(self, level):
+        pass
+
+
+def _install_flox() -> None:
+    module = types.ModuleType("flox")
+    module.Flox = Flox
+    module.__path__ = []
+    spec = importlib.util.spec_from_file_location(
+        "flox.string_matcher", os.path.join(ROOT, "lib", "flox", "string_matcher.py")
+    )
+    string_matcher = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(string_matcher)
+    module.string_matcher = string_matcher
+    sys.modules["flox"] = module
+    sys.modules["flox.string_matcher"] = string_matcher
+
+
+_install_flox()
+
+
+def template_defaults() -> dict:
+    """
+    Setting defaults from SettingsTemplate.yaml, as Flow Launcher passes
+    them to a freshly installed plugin.
+    """
+    defaults = {}
+    name = None
+    with open(os.path.join(ROOT, "SettingsTemplate.yaml"), encoding="utf-8") as file:
+        for line in file:
+            match = re.match(r"\s+name: (\S+)", line)
+            if match:
+                name = match.group(1)
+            match = re.match(r"\s+defaultValue: (.*)", line)
+            if match and name:
+                value = match.group(1).strip()
+                if value[:1] in ("'", '"'):
+                    value = value[1:-1]
+                defaults[name] = value
+    return defaults
+
+
+@pytest.fixture
+def plugin_dir(tmp_path, monkeypatch):
+    """
+    An empty plugin folder with the shipped CSV files, as the working
+    directory.
+    """
+    for name in ("system_messages.csv", "prices.csv"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def make_plugin(plugin_dir):
+    """
+    Build the plugin as one Flow Launcher query process would, with the
+    template defaults overridden by settings.
+    """
+    from main import AliceAI
+
+    def make(**settings):
+        Flox.plugin_settings = {**template_defaults(), **settings}
+        AliceAI._results = []
+        return AliceAI()
+
+    return make
+
+
+@pytest.fixture
+def stub_server():
+    from stub_server import StubServer
+
+    server = StubServer().start()
+    yield server
+    server.stop()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Set, Tuple
+
+
+class StubServer:
+    """
+    Local stand-in for the OpenAI Chat Completions and Responses APIs.
+
+    Every request body is kept in requests as (path, body). Answers are
+    "Answer <n>." numbered by request; the first truncate answers are cut
+    off by the output limit, requests for a model in failing_models get an
+    HTTP 500, and usage reports cached_tokens of PROMPT_TOKENS as cached.
+    Streamed requests are answered with server-sent events.
+    """
+
+    PROMPT_TOKENS = 100
+    COMPLETION_TOKENS = 10
+
+    def __init__(self):
+        self.requests: List[Tuple[str, dict]] = []
+        self.truncate = 0
+        self.cached_tokens = 0
+        self.failing_models: Set[str] = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        self._thread.daemon = True
+
+    @property
+    def chat_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1/chat/completions"
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def bodies(self, path: Optional[str] = None) -> List[dict]:
+        return [body for sent_to, body in self.requests if path in (None, sent_to)]
+
+    def _reply(self, path: str, body: dict) -> Tuple[int, object]:
+        with self._lock:
+            self.requests.append((path, body))
+            number = len(self.requests)
+        if body.get("model") in self.failing_models:
+            return 500, {"error": {"message": f"{body['model']} is unavailable"}}
+        truncated = number <= self.truncate
+        text = f"Answer {number}" + ("" if truncated else ".")
+        if path.endswith("/responses"):
+            return 200, self._response(number, text, truncated, body.get("stream"))
+        return 200, self._chat_completion(text, truncated, body.get("stream"))
+
+    def _chat_completion(self, text: str, truncated: bool, stream: bool):
+        finish_reason = "length" if truncated else "stop"
+        usage = {
+            "prompt_tokens": self.PROMPT_TOKENS,
+            "completion_tokens": self.COMPLETION_TOKENS,
+            "total_tokens": self.PROMPT_TOKENS + self.COMPLETION_TOKENS,
+            "prompt_tokens_details": {"cached_tokens": self.cached_tokens},
+        }
+        if not stream:
+            return {
+                "choices": [
+                    {"message": {"content": text}, "finish_reason": finish_reason}
+                ],
+                "usage": usage,
+            }
+        return [
+            {"choices": [{"delta": {"content": text[:3]}, "finish_reason": None}]},
+            {"choices": [{"delta": {"content": text[3:]}, "finish_reason": None}]},
+            {"choices": [{"delta": {}, "finish_reason": finish_reason}]},
+            {"choices": [], "usage": usage},
+        ]
+
+    def _response(self, number: int, text: str, truncated: bool, stream: bool):
+        response = {
+            "id": f"resp_{number}",
+            "status": "incomplete" if truncated else "completed",
+            "incomplete_details": (
+                {"reason": "max_output_tokens"} if truncated else None
+            ),
+            "output": [
+                {"type": "message", "content": [{"type": "output_text", "text": text}]}
+            ],
+            "usage": {
+                "input_tokens": self.PROMPT_TOKENS,
+                "output_tokens": self.COMPLETION_TOKENS,
+                "input_tokens_details": {"cached_tokens": self.cached_tokens},
+            },
+        }
+        if not stream:
+            return response
+        final = "response.incomplete" if truncated else "response.completed"
+        return [
+            {"type": "response.created", "response": {"id": response["id"]}},
+            {"type": "response.output_text.delta", "delta": text[:3]},
+            {"type": "response.output_text.delta", "delta": text[3:]},
+            {"type": final, "response": response},
+        ]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                body = json.loads(self.rfile.read(length).decode("utf-8"))
+                status, payload = stub._reply(self.path, body)
+                if isinstance(payload, list):
+                    data = b"".join(
+                        b"data: " + json.dumps(event).encode("utf-8") + b"\n\n"
+                        for event in payload
+                    )
+                    data += b"data: [DONE]\n\n"
+                    content_type = "text/event-stream"
+                else:
+                    data = json.dumps(payload).encode("utf-8")
+                    content_type = "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from analytics import MISSING, ColumnStore
+from test_requests import ask
+
+RECORDS = [
+    {
+        "ts": 1000.0 + index,
+        "latency_ms": 500 + index,
+        "ttft_ms": None if index % 2 else 100,
+        "ok": index != 3,
+        "keyword": "short" if index % 2 else "",
+        "provider": "openai",
+        "model": "gpt-5-mini",
+    }
+    for index in range(5)
+]
+
+
+def test_backfill_reads_back_from_an_iterator(tmp_path):
+    store = ColumnStore(str(tmp_path / "request_metrics.bin"))
+
+    store.backfill(iter(RECORDS))
+    columns = store.load()
+
+    assert list(columns.ts) == [record["ts"] for record in RECORDS]
+    assert list(columns.latency_ms) == [500, 501, 502, 503, 504]
+    assert list(columns.ttft_ms) == [100, MISSING, 100, MISSING, 100]
+    assert list(columns.ok) == [1, 1, 1, 0, 1]
+    assert [columns.name("keyword", code) for code in columns.keyword] == [
+        "",
+        "short",
+        "",
+        "short",
+        "",
+    ]
+    assert {columns.name("target", code) for code in columns.target} == {
+        "openai:gpt-5-mini"
+    }
+
+
+def test_backfill_does_not_replace_recorded_metrics(tmp_path):
+    store = ColumnStore(str(tmp_path / "request_metrics.bin"))
+    store.record(2000.0, 700, 200, True, "long", "openai", "gpt-5")
+
+    store.backfill(iter(RECORDS))
+
+    assert list(store.load().ts) == [2000.0]
+
+
+def test_stats_backfill_metrics_from_request_stats(make_plugin, stub_server):
+    ask(make_plugin, stub_server, "short what is a monad||")
+    ask(make_plugin, stub_server, "what is a functor||")
+    os.remove("request_metrics.bin")
+
+    plugin = ask(make_plugin, stub_server, "stats")
+
+    assert len(ColumnStore("request_metrics.bin").load()) == 2
+    titles = [result["Title"] for result in plugin._results]
+    assert any(title.startswith("2 requests: ") for title in titles)
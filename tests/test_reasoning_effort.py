@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import re
+
+import pytest
+
+from conftest import ROOT
+
+# Reasoning efforts each model in the Model dropdown accepts; "" means the
+# field must be left out.
+ACCEPTED_EFFORTS = {
+    "gpt-5.2": {"none", "low", "medium", "high"},
+    "gpt-5.2-pro": {"medium", "high"},
+    "gpt-5": {"minimal", "low", "medium", "high"},
+    "gpt-5-mini": {"minimal", "low", "medium", "high"},
+    "gpt-5-nano": {"minimal", "low", "medium", "high"},
+    "gpt-4o": {""},
+    "gpt-4o-mini": {""},
+    "gpt-4.1": {""},
+    "gpt-4.1-mini": {""},
+    "gpt-4.1-nano": {""},
+    "gpt-4-turbo": {""},
+    "gpt-4": {""},
+    "gpt-3.5-turbo": {""},
+}
+EFFORTS = ["none", "minimal", "low", "medium", "high"]
+
+
+def dropdown_models():
+    with open(os.path.join(ROOT, "SettingsTemplate.yaml"), encoding="utf-8") as file:
+        template = file.read()
+    options = template.split("name: model\n", 1)[1].split("options:", 1)[1]
+    models = []
+    for line in options.splitlines()[1:]:
+        match = re.match(r" {8}- (\S+)", line)
+        if not match:
+            break
+        models.append(match.group(1))
+    return [model for model in models if model != "auto"]
+
+
+def profile_efforts():
+    with open(os.path.join(ROOT, "system_messages.csv"), encoding="utf-8") as file:
+        rows = csv.DictReader(file, delimiter=";")
+        return {
+            row["Key Word"]: row["Reasoning Effort"]
+            for row in rows
+            if row.get("Reasoning Effort")
+        }
+
+
+def test_every_dropdown_model_is_covered():
+    assert set(dropdown_models()) == set(ACCEPTED_EFFORTS)
+
+
+@pytest.mark.parametrize("model", dropdown_models())
+@pytest.mark.parametrize("effort", EFFORTS)
+def test_sent_effort_is_accepted(make_plugin, model, effort):
+    plugin = make_plugin(api_key="key", model=model)
+    plugin.reasoning_effort = effort
+
+    body = plugin.backends["openai"].body("prompt", "system", False)
+
+    assert body.get("reasoning_effort", "") in ACCEPTED_EFFORTS[model]
+
+
+@pytest.mark.parametrize("model", dropdown_models())
+@pytest.mark.parametrize("keyword", sorted(profile_efforts()))
+def test_shipped_profiles_send_accepted_efforts(make_plugin, model, keyword):
+    plugin = make_plugin(api_key="key", model=model, provider="openai_responses")
+    plugin._apply_generation_profile(keyword)
+
+    body = plugin.backends["openai_responses"].body("prompt", "system", False)
+
+    effort = body.get("reasoning", {}).get("effort", "")
+    assert effort in ACCEPTED_EFFORTS[model]
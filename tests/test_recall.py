@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import glob
+
+from test_requests import ask
+
+PROMPTS = ["what is a monad", "what is a functor", "what is a lens"]
+
+
+def ask_all(make_plugin, stub_server, **settings):
+    for prompt in PROMPTS:
+        plugin = ask(make_plugin, stub_server, f"{prompt}||", **settings)
+    return plugin
+
+
+def titles(plugin):
+    return [result["Title"] for result in plugin._results]
+
+
+def test_index_keeps_the_newest_prompts_up_to_the_limit(make_plugin, stub_server):
+    plugin = ask_all(make_plugin, stub_server, recall_index_limit="2")
+
+    plugin.seed_prompt_index()
+
+    plugin = ask(make_plugin, stub_server, "recent what is")
+    assert titles(plugin) == ["what is a lens", "what is a functor"]
+
+
+def test_zero_limit_turns_recall_and_indexing_off(make_plugin, stub_server):
+    plugin = ask_all(make_plugin, stub_server, recall_index_limit="0")
+
+    plugin.seed_prompt_index()
+
+    assert not glob.glob("prompt_index.*")
+    plugin = ask(make_plugin, stub_server, "recent monad", recall_index_limit="0")
+    assert titles(plugin) == ["Recall of earlier prompts is turned off"]
+    plugin = ask(make_plugin, stub_server, "what is a mo", recall_index_limit="0")
+    assert len(plugin._results) == 1
+
+
+def test_recalled_answer_opens_in_the_editor(make_plugin, stub_server, monkeypatch):
+    import main
+
+    opened = []
+    monkeypatch.setattr(main.webbrowser, "open", opened.append)
+    settings = {"answer_action_order": "editor,copy,preview"}
+    plugin = ask_all(make_plugin, stub_server, **settings)
+    plugin.seed_prompt_index()
+    plugin = ask(make_plugin, stub_server, "recent what is a lens", **settings)
+    action = plugin._results[0]["JsonRPCAction"]
+
+    assert action["method"] == "run_recalled_action"
+    assert action["parameters"][2] == "open_in_editor"
+    getattr(plugin, action["method"])(*action["parameters"])
+
+    assert opened == ["temp_answer.txt"]
+    with open("temp_answer.txt", encoding="utf-8") as file:
+        assert file.read() == "Answer 3."
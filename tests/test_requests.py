@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from providers import CONTINUATION_PROMPT
+
+SHORT_SYSTEM_MESSAGE = (
+    "You are an all-knowing AI bot. All your answers are short, to the point, "
+    "and don't give any additional context."
+)
+
+
+def ask(make_plugin, server, query, **settings):
+    plugin = make_plugin(api_key="key", api_endpoint=server.chat_url, **settings)
+    plugin.query(query)
+    return plugin
+
+
+def answer_of(plugin):
+    return plugin._results[0]["SubTitle"].split("Answer: ", 1)[1]
+
+
+def stats_records():
+    with open("request_stats.jsonl", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_chat_completions_payload(make_plugin, stub_server):
+    plugin = ask(make_plugin, stub_server, "short what is a monad||")
+
+    assert stub_server.bodies() == [
+        {
+            "model": "gpt-5-mini",
+            "messages": [
+                {"role": "system", "content": SHORT_SYSTEM_MESSAGE},
+                {"role": "user", "content": "what is a monad"},
+            ],
+            "stream": False,
+            "max_completion_tokens": 400,
+            "reasoning_effort": "minimal",
+            "prompt_cache_key": "aliceai-short",
+        }
+    ]
+    assert answer_of(plugin) == "Answer 1."
+
+
+def test_streamed_chat_completions(make_plugin, stub_server):
+    plugin = ask(
+        make_plugin, stub_server, "what is a monad||", openai_request_mode="async"
+    )
+
+    (body,) = stub_server.bodies()
+    assert body["stream"] is True
+    assert body["stream_options"] == {"include_usage": True}
+    assert answer_of(plugin) == "Answer 1."
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_responses_payload(make_plugin, stub_server, mode):
+    plugin = ask(
+        make_plugin,
+        stub_server,
+        "short what is a monad||",
+        provider="openai_responses",
+        openai_request_mode=mode,
+    )
+
+    assert stub_server.bodies("/v1/responses") == [
+        {
+            "model": "gpt-5-mini",
+            "instructions": SHORT_SYSTEM_MESSAGE,
+            "stream": mode == "async",
+            "store": False,
+            "input": [{"role": "user", "content": "what is a monad"}],
+            "max_output_tokens": 400,
+            "reasoning": {"effort": "minimal"},
+            "prompt_cache_key": "aliceai-short",
+        }
+    ]
+    assert answer_of(plugin) == "Answer 1."
+
+
+@pytest.mark.parametrize("provider", ["openai", "openai_responses"])
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_truncated_answer_is_continued(make_plugin, stub_server, provider, mode):
+    stub_server.truncate = 1
+
+    plugin = ask(
+        make_plugin,
+        stub_server,
+        "what is a monad||",
+        provider=provider,
+        openai_request_mode=mode,
+    )
+
+    first, second = stub_server.bodies()
+    messages = second.get("messages") or second.get("input")
+    assert messages[-2:] == [
+        {"role": "assistant", "content": "Answer 1"},
+        {"role": "user", "content": CONTINUATION_PROMPT},
+    ]
+    assert answer_of(plugin) == "Answer 1Answer 2."
+
+
+def test_continuations_stop_at_the_limit(make_plugin, stub_server):
+    stub_server.truncate = 10
+
+    plugin = ask(make_plugin, stub_server, "what is a monad||", max_continuations="2")
+
+    assert len(stub_server.bodies()) == 3
+    assert answer_of(plugin) == "Answer 1Answer 2Answer 3"
+
+
+def test_continuation_can_be_turned_off(make_plugin, stub_server):
+    stub_server.truncate = 1
+
+    plugin = ask(make_plugin, stub_server, "what is a monad||", auto_continue="false")
+
+    assert len(stub_server.bodies()) == 1
+    assert answer_of(plugin) == "Answer 1"
+
+
+@pytest.mark.parametrize("provider", ["openai", "openai_responses"])
+def test_cached_tokens_are_reported(make_plugin, stub_server, provider):
+    stub_server.cached_tokens = 80
+
+    ask(make_plugin, stub_server, "short what is a monad||", provider=provider)
+    plugin = ask(make_plugin, stub_server, "stats")
+
+    (record,) = stats_records()
+    assert record["keyword"] == "short"
+    assert (record["prompt_tokens"], record["cached_tokens"]) == (100, 80)
+    titles = [result["Title"] for result in plugin._results]
+    assert "Last 1 requests: 80% of prompt tokens cached" in titles
+    assert "'short': 80% of prompt tokens cached" in titles
+
+
+def test_fallback_answers_when_the_model_fails(make_plugin, stub_server):
+    stub_server.failing_models = {"gpt-5-mini"}
+
+    plugin = ask(
+        make_plugin,
+        stub_server,
+        "what is a monad||",
+        fallback_chain="openai:gpt-5-nano",
+    )
+
+    assert [body["model"] for body in stub_server.bodies()] == [
+        "gpt-5-mini",
+        "gpt-5-nano",
+    ]
+    assert answer_of(plugin) == "Answer 2. | via gpt-5-nano"
+    (record,) = stats_records()
+    assert record["model"] == "gpt-5-nano"
+
+
+def test_fallback_is_not_used_when_the_model_answers(make_plugin, stub_server):
+    ask(
+        make_plugin,
+        stub_server,
+        "what is a monad||",
+        fallback_chain="openai:gpt-5-nano",
+    )
+
+    assert [body["model"] for body in stub_server.bodies()] == ["gpt-5-mini"]
+
+
+def test_failure_without_fallback_is_reported(make_plugin, stub_server):
+    stub_server.failing_models = {"gpt-5-mini"}
+
+    plugin = ask(make_plugin, stub_server, "what is a monad||")
+
+    assert len(stub_server.bodies()) == 1
+    assert "gpt-5-mini is unavailable" in json.dumps(plugin._results)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from test_requests import SHORT_SYSTEM_MESSAGE, ask
+
+
+def test_rerun_sends_the_original_system_message(make_plugin, stub_server):
+    plugin = ask(make_plugin, stub_server, "short what is a monad||")
+    answer_id = plugin._results[0]["ContextData"][0]
+    with open("system_messages.csv", encoding="utf-8") as file:
+        prompts = file.read()
+    with open("system_messages.csv", "w", encoding="utf-8") as file:
+        file.write(prompts.replace(SHORT_SYSTEM_MESSAGE, "Answer in one word."))
+
+    plugin.rerun_with_model(answer_id, "short", "openai", "gpt-5-nano")
+    keyword, query = plugin.changed_query.split(" ", 1)
+    ask(make_plugin, stub_server, query)
+
+    first, rerun = stub_server.bodies()
+    assert rerun["model"] == "gpt-5-nano"
+    assert rerun["messages"][0] == first["messages"][0]
+    assert rerun["messages"][0]["content"] == SHORT_SYSTEM_MESSAGE
+
+
+def test_new_request_uses_the_edited_system_message(make_plugin, stub_server):
+    ask(make_plugin, stub_server, "short what is a monad||")
+    with open("system_messages.csv", encoding="utf-8") as file:
+        prompts = file.read()
+    with open("system_messages.csv", "w", encoding="utf-8") as file:
+        file.write(prompts.replace(SHORT_SYSTEM_MESSAGE, "Answer in one word."))
+
+    ask(make_plugin, stub_server, "short what is a monad||")
+
+    assert stub_server.bodies()[1]["messages"][0]["content"] == "Answer in one word."
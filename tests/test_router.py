@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from router import ModelRouter
+
+
+def test_routing_log_keeps_newest_decisions(tmp_path):
+    router = ModelRouter(
+        str(tmp_path / "model_stats.json"),
+        str(tmp_path / "routing_log.jsonl"),
+        max_log_bytes=4096,
+    )
+
+    for number in range(1000):
+        router.log_decision({"decision": number, "model": "gpt-5-mini"})
+
+    assert os.path.getsize(router.log_file) <= 4096
+    with open(router.log_file, encoding="utf-8") as file:
+        numbers = [json.loads(line)["decision"] for line in file]
+    assert numbers == list(range(numbers[0], 1000))
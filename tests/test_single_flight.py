@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import time
+
+from single_flight import SingleFlight
+
+WORKERS = 4
+CALL_SECONDS = 1.0
+
+
+def ask(directory, calls_path, barrier, results):
+    def call():
+        with open(calls_path, "a", encoding="utf-8") as file:
+            file.write(f"{os.getpid()}\n")
+        time.sleep(CALL_SECONDS)
+        return {"answer": "shared"}
+
+    barrier.wait()
+    result, is_leader = SingleFlight(directory, wait_timeout=30).run("key", call)
+    results.put((result, is_leader))
+
+
+def count_calls(calls_path):
+    with open(calls_path, encoding="utf-8") as file:
+        return len(file.read().split())
+
+
+def test_concurrent_requests_share_one_call(tmp_path):
+    directory = str(tmp_path / "inflight")
+    calls_path = str(tmp_path / "calls")
+    barrier = multiprocessing.Barrier(WORKERS)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=ask, args=(directory, calls_path, barrier, results)
+        )
+        for _ in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    assert count_calls(calls_path) == 1
+    assert [result for result, _ in outcomes] == [{"answer": "shared"}] * WORKERS
+    assert sorted(is_leader for _, is_leader in outcomes) == [False] * (WORKERS - 1) + [
+        True
+    ]
+
+
+def test_later_identical_request_calls_again(tmp_path):
+    single_flight = SingleFlight(str(tmp_path / "inflight"), wait_timeout=30)
+    calls = []
+
+    def call():
+        calls.append(None)
+        return {"answer": len(calls)}
+
+    assert single_flight.run("key", call) == ({"answer": 1}, True)
+    time.sleep(0.05)
+    assert single_flight.run("key", call) == ({"answer": 2}, True)
+    assert len(calls) == 2
+
+
+def test_failed_call_is_not_shared(tmp_path):
+    single_flight = SingleFlight(str(tmp_path / "inflight"), wait_timeout=30)
+
+    assert single_flight.run("key", lambda: None) == ({}, True)
+    assert not [
+        name for name in os.listdir(tmp_path / "inflight") if name.endswith(".json")
+    ]
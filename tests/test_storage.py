@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+
+from storage import append_line, keep_tail_lines, locked
+
+WRITERS = 6
+RECORDS = 300
+# Long enough that a torn write would show up as a broken JSON line.
+PADDING = "x" * 500
+
+
+def write_records(path, writer, trim_bytes):
+    for number in range(RECORDS):
+        record = {"writer": writer, "number": number, "padding": PADDING}
+        data = json.dumps(record).encode("utf-8")
+        with locked(path):
+            append_line(path, data)
+            if trim_bytes and os.path.getsize(path) > trim_bytes:
+                keep_tail_lines(path, trim_bytes // 2)
+
+
+def run_writers(path, trim_bytes=0):
+    writers = [
+        multiprocessing.Process(target=write_records, args=(path, writer, trim_bytes))
+        for writer in range(WRITERS)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    with open(path, "rb") as file:
+        lines = file.read().split(b"\n")
+    assert lines[-1] == b""
+    return [json.loads(line) for line in lines[:-1]]
+
+
+def test_concurrent_appends_are_whole_and_kept(tmp_path):
+    records = run_writers(str(tmp_path / "history.jsonl"))
+
+    assert len(records) == WRITERS * RECORDS
+    for writer in range(WRITERS):
+        numbers = [record["number"] for record in records if record["writer"] == writer]
+        assert numbers == list(range(RECORDS))
+
+
+def test_trimmed_file_keeps_each_writers_newest_records(tmp_path):
+    trim_bytes = 64 * 1024
+
+    records = run_writers(str(tmp_path / "stats.jsonl"), trim_bytes)
+
+    assert os.path.getsize(tmp_path / "stats.jsonl") <= trim_bytes
+    for writer in range(WRITERS):
+        numbers = [record["number"] for record in records if record["writer"] == writer]
+        assert numbers == list(range(RECORDS - len(numbers), RECORDS))
+
+
+def test_append_after_a_torn_record_starts_a_new_line(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    append_line(path, b'{"number": 1}')
+    with open(path, "ab") as file:
+        file.write(b'{"number": 2, "cut')
+
+    append_line(path, b'{"number": 3}')
+
+    with open(path, "rb") as file:
+        assert file.read().split(b"\n")[-2] == b'{"number": 3}'
+
+
+def test_shared_locks_exclude_only_writers(tmp_path, caplog):
+    path = str(tmp_path / "data")
+
+    with locked(path, shared=True):
+        with locked(path, timeout=0.1, shared=True):
+            pass
+        assert not caplog.records
+        with locked(path, timeout=0.1):
+            pass
+    assert "Writing" in caplog.records[0].getMessage()
+
+    with locked(path):
+        with locked(path, timeout=0.1, shared=True):
+            pass
+    assert "Reading" in caplog.records[1].getMessage()
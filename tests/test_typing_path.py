@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+REQUEST_ONLY_STORES = (
+    "single_flight",
+    "conversation_store",
+    "router",
+    "token_estimator",
+    "request_stats",
+    "usage_ledger",
+    "request_columns",
+    "budget_guard",
+    "archive",
+    "conversation_index",
+    "request_history",
+)
+
+
+def test_keystroke_builds_no_request_stores(make_plugin):
+    plugin = make_plugin(api_key="key")
+
+    plugin.query("how do I sort a list")
+
+    assert plugin._results[0]["Title"].startswith("Type your prompt")
+    assert not [name for name in REQUEST_ONLY_STORES if name in vars(plugin)]